@@ -1,7 +1,15 @@
 from comfy_api.latest import ComfyExtension, io
 from typing_extensions import override
 
+from .nodes.fens_caption_scanner import FensCaptionScanner
+from .nodes.fens_encode_tokens import FensEncodeTokens
+from .nodes.fens_multi_clip_counter import FensMultiClipTokenCounter
+from .nodes.fens_token_batch_counter import FensTokenBatchCounter
 from .nodes.fens_token_counter import FensTokenCounter
+from .nodes.fens_token_diff import FensTokenDiff
+from .nodes.fens_token_range_counter import FensTokenRangeCounter
+from .nodes.fens_token_truncate import FensTokenTruncate
+from .nodes.fens_tokenizer_counter import FensTokenizerCounter
 from .nodes.opti_empty_latent import OptiEmptyLatent
 from .nodes.opti_empty_latent_advanced import OptiEmptyLatentAdvanced
 
@@ -11,7 +19,19 @@ WEB_DIRECTORY = "./web"
 class FensSimpleNodesExtension(ComfyExtension):
     @override
     async def get_node_list(self) -> list[type[io.ComfyNode]]:
-        return [FensTokenCounter, OptiEmptyLatent, OptiEmptyLatentAdvanced]
+        return [
+            FensTokenCounter,
+            FensTokenBatchCounter,
+            FensTokenizerCounter,
+            FensMultiClipTokenCounter,
+            FensTokenTruncate,
+            FensTokenDiff,
+            FensTokenRangeCounter,
+            FensEncodeTokens,
+            FensCaptionScanner,
+            OptiEmptyLatent,
+            OptiEmptyLatentAdvanced,
+        ]
 
 
 async def comfy_entrypoint() -> FensSimpleNodesExtension:
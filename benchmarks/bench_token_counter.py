@@ -0,0 +1,398 @@
+"""
+Offline benchmark suite for the token counter's hot paths.
+
+Runs without model weights or a GPU: a stub CLIP (see stub_clip.py) stands
+in for the real tokenizer stacks, and only the counter's own stages are
+timed:
+
+  preprocess      FensTokenCounter._preprocess_prompt
+  split_on_break  FensTokenCounter._split_on_break
+  tokenize        FensTokenCounter._tokenize_break_segments (stub tokenizer)
+  count           FensTokenCounter._process_token_counts
+  breakdown       FensTokenCounter._build_token_breakdown (default 256 rows)
+
+The node modules import comfy_api and folder_paths, so a ComfyUI checkout
+must be importable (pass --comfyui or set COMFYUI_PATH). Nothing else from
+ComfyUI is used.
+
+Usage:
+  python benchmarks/bench_token_counter.py --comfyui ../ComfyUI
+  python benchmarks/bench_token_counter.py --quick --json bench_output.json
+  python benchmarks/bench_token_counter.py --update-baseline
+
+Results are compared against benchmarks/baseline.json; a stage counts as a
+regression when it is slower than the baseline by more than --threshold
+(a ratio) and by more than --min-delta-ms. The exit code is 1 on any
+regression so the script can gate CI or a pre-release check.
+
+Absolute timings differ between machines, so every run also times a fixed
+pure-Python calibration workload. Ratios are divided by how much slower
+the calibration ran than when the baseline was recorded, and the gate
+compares code changes rather than hardware.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+import types
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from stub_clip import STACKS, make_stub_clip
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+PACKAGE_NAME = "fens_simple_nodes_bench"  # Avoids clashing with ComfyUI's nodes.py
+
+DEFAULT_REPEAT = 3  # Timing repeats per stage; the fastest one is reported
+DEFAULT_THRESHOLD = 1.5  # Slowdown ratio that counts as a regression
+DEFAULT_MIN_DELTA_MS = 0.5  # Ignore slowdowns smaller than this (timer noise)
+MIN_TIMING_SECONDS = 0.02  # Fast calls are looped until one timing takes this long
+BREAKDOWN_LIMIT = 256  # Matches the node's default breakdown page size
+CORPUS_SEED = 1234
+LARGE_CASE_CHARS = 1_000_000  # Cases at or above this size are skipped by --quick
+CALIBRATION_TAGS = 2_000  # Size of the calibration workload's tag list
+
+WORDS = [
+    "masterpiece",
+    "best",
+    "quality",
+    "portrait",
+    "of",
+    "a",
+    "woman",
+    "standing",
+    "in",
+    "a",
+    "field",
+    "of",
+    "flowers",
+    "golden",
+    "hour",
+    "soft",
+    "lighting",
+    "detailed",
+    "face",
+    "intricate",
+    "dress",
+    "wind",
+    "blowing",
+    "hair",
+    "cinematic",
+    "composition",
+    "depth",
+    "of",
+    "field",
+    "bokeh",
+    "35mm",
+    "film",
+    "grain",
+    "highly",
+    "detailed",
+    "sharp",
+    "focus",
+    "volumetric",
+    "light",
+    "rim",
+    "light",
+    "octane",
+    "render",
+]
+SPECIAL_SNIPPETS = ("AND", "BREAK", "embedding:easynegative", "[from:to:0.5]")
+TAG_STYLES = ("plain", "weighted", "emphasis", "escaped", "special")
+TAG_STYLE_WEIGHTS = (75, 15, 5, 3, 2)  # Rough mix seen in real tag prompts
+NEWLINE_PER_TAG = 0.02  # Chance of a line break after each tag
+
+
+def load_counter(comfyui_path: str | None) -> Any:
+    """
+    Import nodes/ as a standalone package and return FensTokenCounter.
+
+    The repository root __init__ also imports the latent nodes (and with
+    them comfy.model_management), so the nodes directory is mounted on its
+    own under a unique package name instead.
+    """
+    if comfyui_path:
+        sys.path.insert(0, str(Path(comfyui_path).resolve()))
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [str(REPO_DIR / "nodes")]
+    sys.modules[PACKAGE_NAME] = package
+    module = importlib.import_module(f"{PACKAGE_NAME}.fens_token_counter")
+    return module.FensTokenCounter
+
+
+def _tag(rng: random.Random) -> str:
+    words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+    style = rng.choices(TAG_STYLES, weights=TAG_STYLE_WEIGHTS)[0]
+    if style == "weighted":
+        return f"({words}:{rng.uniform(0.5, 1.5):.2f})"
+    if style == "emphasis":
+        return f"(({words}))"
+    if style == "escaped":
+        return rf"{words} \(detail\)"
+    if style == "special":
+        return rng.choice(SPECIAL_SNIPPETS)
+    return words
+
+
+def tag_prompt(size: int, seed: int = CORPUS_SEED) -> str:
+    """Comma-separated tag prompt of roughly size characters."""
+    rng = random.Random(seed)  # noqa: S311 - reproducible corpus, not crypto
+    parts = []
+    length = 0
+    while length < size:
+        tag = _tag(rng)
+        parts.append(tag)
+        length += len(tag) + 2
+        if rng.random() < NEWLINE_PER_TAG:
+            parts.append("\n")
+    return ", ".join(parts)[:size]
+
+
+def nested_prompt(depth: int) -> str:
+    """Deeply nested weight syntax: ((((word ...) ...) ...) ...)."""
+    opening = "".join(f"({WORDS[i % len(WORDS)]} " for i in range(depth))
+    closing = "".join(f":1.{i % 9 + 1})" for i in range(depth))
+    return opening + "center" + closing
+
+
+def break_prompt(segments: int, seed: int = CORPUS_SEED) -> str:
+    """Thousands of short BREAK-separated segments."""
+    rng = random.Random(seed)  # noqa: S311 - reproducible corpus, not crypto
+    return " BREAK ".join(
+        ", ".join(_tag(rng) for _ in range(rng.randint(1, 6))) for _ in range(segments)
+    )
+
+
+def build_corpus() -> dict[str, str]:
+    """Named benchmark prompts, from everyday sizes to adversarial inputs."""
+    return {
+        "tags_100": tag_prompt(100),
+        "tags_1k": tag_prompt(1_000),
+        "tags_10k": tag_prompt(10_000),
+        "tags_100k": tag_prompt(100_000),
+        "tags_1m": tag_prompt(LARGE_CASE_CHARS),
+        "nested_2000": nested_prompt(2_000),
+        "breaks_5000": break_prompt(5_000),
+        "escaped_10k": r"\(a\) " * 1_700,
+        "unbroken_100k": "x" * 100_000,
+    }
+
+
+def time_call(func: Callable[[], Any], repeat: int) -> float:
+    """Best per-call time in seconds, looping fast calls for stable numbers."""
+    timer = timeit.Timer(func)
+    loops = 1
+    while timer.timeit(number=loops) < MIN_TIMING_SECONDS:
+        loops *= 10
+    return min(timer.repeat(repeat=repeat, number=loops)) / loops
+
+
+def calibrate(repeat: int) -> float:
+    """
+    Time a fixed workload of the same kind as the counter's stages (string
+    splitting, dict lookups, small lists), independent of the code under
+    test. Taken before every case and once after the last one; the fastest
+    timing is kept, like each stage's.
+    """
+    rng = random.Random(CORPUS_SEED)  # noqa: S311 - reproducible corpus, not crypto
+    text = ", ".join(
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+        for _ in range(CALIBRATION_TAGS)
+    )
+    vocab = {word: index for index, word in enumerate(WORDS)}
+
+    def workload() -> int:
+        ids = []
+        for tag in text.split(","):
+            ids.extend(vocab.get(word, 0) for word in tag.split())
+        return sum(sorted(ids))
+
+    return time_call(workload, repeat)
+
+
+def run_case(
+    counter: Any, scanner: Any, text: str, stacks: list[str], repeat: int
+) -> dict[str, float]:
+    """Time every stage for one prompt; keys are stage or stack/stage."""
+
+    def preprocess() -> Any:
+        scanner.scan_prompt.cache_clear()
+        return counter._preprocess_prompt(text)
+
+    cleaned_text, _ = preprocess()
+
+    def split() -> Any:
+        scanner.scan_prompt.cache_clear()
+        return counter._split_on_break(cleaned_text)
+
+    segments = split()
+    results = {
+        "preprocess": time_call(preprocess, repeat),
+        "split_on_break": time_call(split, repeat),
+    }
+    for stack in stacks:
+        clip = make_stub_clip(stack)
+        token_streams = counter._tokenize_break_segments(clip, segments)
+        stages = {
+            "tokenize": lambda clip=clip: counter._tokenize_break_segments(
+                clip, segments
+            ),
+            "count": lambda streams=token_streams: counter._process_token_counts(
+                streams, "max_stream"
+            ),
+            "breakdown": lambda clip=clip, streams=token_streams: (
+                counter._build_token_breakdown(clip, streams, 0, BREAKDOWN_LIMIT)
+            ),
+        }
+        for stage, func in stages.items():
+            results[f"{stack}/{stage}"] = time_call(func, repeat)
+    return results
+
+
+def compare(
+    results: dict[str, float],
+    baseline: dict[str, float],
+    threshold: float,
+    min_delta_ms: float,
+    speed: float = 1.0,
+) -> list[str]:
+    """
+    Print a comparison table and return the keys that regressed.
+
+    speed is this machine's calibration time over the baseline's; baseline
+    timings are scaled by it before comparing.
+    """
+    regressions = []
+    print(f"\n{'stage':<40} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            print(f"{key:<40} {'-':>12} {current * 1000:>12.3f} {'new':>7}")
+            continue
+        expected = previous * speed
+        ratio = current / expected if expected > 0 else float("inf")
+        delta_ms = (current - expected) * 1000
+        regressed = ratio > threshold and delta_ms > min_delta_ms
+        if regressed:
+            regressions.append(key)
+        print(
+            f"{key:<40} {expected * 1000:>12.3f} {current * 1000:>12.3f} "
+            f"{ratio:>6.2f}x{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--comfyui",
+        default=os.environ.get("COMFYUI_PATH"),
+        help="ComfyUI checkout to import comfy_api from (default: $COMFYUI_PATH).",
+    )
+    parser.add_argument(
+        "--stacks",
+        default=",".join(STACKS),
+        help=f"Comma-separated stub tokenizer stacks ({', '.join(STACKS)}).",
+    )
+    parser.add_argument(
+        "--cases", default="", help="Comma-separated corpus cases (default: all)."
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="Skip the 1 MB and larger cases."
+    )
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_MS)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--json", type=Path, help="Write results to this JSON file.")
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store these results as the new baseline instead of comparing.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    counter = load_counter(args.comfyui)
+    scanner = sys.modules[f"{PACKAGE_NAME}.prompt_scanner"]
+
+    corpus = build_corpus()
+    selected = [name for name in args.cases.split(",") if name] or list(corpus)
+    unknown = set(selected) - set(corpus)
+    if unknown:
+        print(f"Unknown cases: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+    stacks = [name for name in args.stacks.split(",") if name]
+
+    calibration = calibrate(args.repeat)
+    results: dict[str, float] = {}
+    for name in selected:
+        text = corpus[name]
+        if args.quick and len(text) >= LARGE_CASE_CHARS:
+            continue
+        calibration = min(calibration, calibrate(args.repeat))
+        started = time.perf_counter()
+        for key, seconds in run_case(
+            counter, scanner, text, stacks, args.repeat
+        ).items():
+            results[f"{name}/{key}"] = seconds
+        print(
+            f"{name}: {len(text)} chars, {time.perf_counter() - started:.1f}s",
+            file=sys.stderr,
+        )
+
+    calibration = min(calibration, calibrate(args.repeat))
+    report = {
+        "meta": {
+            "calibration": calibration,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --update-baseline.")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    baseline_calibration = baseline["meta"].get("calibration")
+    if baseline_calibration:
+        speed = calibration / baseline_calibration
+        print(f"\nCalibration: {speed:.2f}x the baseline machine's time.")
+    else:
+        speed = 1.0
+        print("\nBaseline has no calibration; comparing raw timings.")
+    regressions = compare(
+        results, baseline["results"], args.threshold, args.min_delta_ms, speed
+    )
+    if regressions:
+        print(f"\n{len(regressions)} stage(s) regressed beyond {args.threshold}x.")
+        return 1
+    print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
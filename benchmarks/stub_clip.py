@@ -0,0 +1,142 @@
+"""
+Offline stand-in for a ComfyUI CLIP object, used by the token counter
+benchmarks. Only the tokenizer surface the counter touches is mimicked:
+clip.tokenize(text, return_word_ids=True) returning
+{stream_name: [batch, ...]} of (token_id, weight, word_id) tuples, plus the
+clip.tokenizer.<sub_tokenizer> attributes used for decoding.
+
+Tokenization is a cheap deterministic fake (words split into 4-character
+pieces hashed into the vocabulary), so timings measure the counter's own
+work rather than a real BPE implementation.
+"""
+
+from __future__ import annotations
+
+import zlib
+from typing import Any
+
+PIECE_LEN = 4  # Characters per fake sub-word token
+VOCAB_SIZE = 49408  # CLIP-sized vocabulary
+FIRST_WORD_TOKEN_ID = 16  # Ids below this are reserved for special tokens
+START_TOKEN_ID = 1
+END_TOKEN_ID = 2
+PAD_TOKEN_ID = 0
+
+
+class StubSubTokenizer:
+    """One tokenizer stream: CLIP-style fixed windows or unbounded (T5/Qwen3)."""
+
+    def __init__(self, max_length: int | None, has_start: bool = True) -> None:
+        self.max_length = max_length
+        self.has_start = has_start
+        self.vocab_size = VOCAB_SIZE
+        self.inv_vocab = {
+            START_TOKEN_ID: "<|startoftext|>",
+            END_TOKEN_ID: "<|endoftext|>",
+            PAD_TOKEN_ID: "<pad>",
+        }
+
+    def _word_tokens(self, word: str) -> list[int]:
+        ids = []
+        for start in range(0, len(word), PIECE_LEN):
+            piece = word[start : start + PIECE_LEN]
+            token_id = FIRST_WORD_TOKEN_ID + zlib.crc32(piece.encode("utf-8")) % (
+                VOCAB_SIZE - FIRST_WORD_TOKEN_ID
+            )
+            self.inv_vocab.setdefault(token_id, piece)
+            ids.append(token_id)
+        return ids
+
+    def tokenize_with_weights(
+        self,
+        text: str,
+        return_word_ids: bool = False,  # noqa: ARG002 - word ids are always returned
+        **kwargs: Any,  # noqa: ARG002
+    ) -> list[list[tuple]]:
+        tokens = []
+        word_id = 0
+        for word in text.replace("\n", " ").split(" "):
+            if not word:
+                continue
+            word_id += 1
+            tokens.extend(
+                (token_id, 1.0, word_id) for token_id in self._word_tokens(word)
+            )
+
+        if self.max_length is None:
+            batch = [(START_TOKEN_ID, 1.0, 0)] if self.has_start else []
+            return [[*batch, *tokens, (END_TOKEN_ID, 1.0, 0)]]
+
+        window = self.max_length - 2
+        batches = []
+        for start in range(0, max(len(tokens), 1), window):
+            batch = [(START_TOKEN_ID, 1.0, 0), *tokens[start : start + window]]
+            batch.append((END_TOKEN_ID, 1.0, 0))
+            batch.extend([(PAD_TOKEN_ID, 1.0, 0)] * (self.max_length - len(batch)))
+            batches.append(batch)
+        return batches
+
+    def decode(self, token_ids: list[int]) -> str:
+        return "".join(self.inv_vocab.get(token_id, "") for token_id in token_ids)
+
+
+class StubTokenizer:
+    """Wrapper holding one sub-tokenizer attribute per stream, like ComfyUI's."""
+
+    def __init__(self, streams: dict[str, StubSubTokenizer]) -> None:
+        self.stream_attrs = {}
+        for stream_name, sub_tokenizer in streams.items():
+            attr_name = (
+                f"clip_{stream_name}" if stream_name in {"l", "g"} else stream_name
+            )
+            setattr(self, attr_name, sub_tokenizer)
+            self.stream_attrs[stream_name] = attr_name
+
+    def tokenize_with_weights(
+        self, text: str, return_word_ids: bool = False, **kwargs: Any
+    ) -> dict[str, list[list[tuple]]]:
+        return {
+            stream_name: getattr(self, attr_name).tokenize_with_weights(
+                text, return_word_ids, **kwargs
+            )
+            for stream_name, attr_name in self.stream_attrs.items()
+        }
+
+
+class StubClip:
+    """Minimal CLIP object exposing tokenizer and tokenize()."""
+
+    def __init__(self, streams: dict[str, StubSubTokenizer]) -> None:
+        self.tokenizer = StubTokenizer(streams)
+        self.tokenizer_options: dict[str, Any] = {}
+
+    def tokenize(self, text: str, return_word_ids: bool = False, **kwargs: Any) -> Any:
+        return self.tokenizer.tokenize_with_weights(text, return_word_ids, **kwargs)
+
+
+def clip_stream() -> StubSubTokenizer:
+    return StubSubTokenizer(max_length=77)
+
+
+def make_stub_clip(stack: str) -> StubClip:
+    """Build a stand-in CLIP for a named encoder stack."""
+    stacks = {
+        "sd1": lambda: {"l": clip_stream()},
+        "sdxl": lambda: {"g": clip_stream(), "l": clip_stream()},
+        "flux": lambda: {"l": clip_stream(), "t5xxl": StubSubTokenizer(None, False)},
+        "sd3": lambda: {
+            "g": clip_stream(),
+            "l": clip_stream(),
+            "t5xxl": StubSubTokenizer(None, False),
+        },
+        "anima": lambda: {
+            "qwen3_06b": StubSubTokenizer(None, False),
+            "t5xxl": StubSubTokenizer(None, False),
+        },
+    }
+    if stack not in stacks:
+        raise ValueError(f"Unknown stack '{stack}', expected one of {sorted(stacks)}")
+    return StubClip(stacks[stack]())
+
+
+STACKS = ("sd1", "sdxl", "flux", "sd3", "anima")
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from contextlib import closing
+from typing import NamedTuple
+
+import folder_paths
+
+CACHE_DIR_ENV = "FENS_CACHE_DIR"  # Overrides the cache directory
+CACHE_SUBDIR = "fens_cache"  # Default cache directory inside ComfyUI's user dir
+CACHE_FILE = "caption_counts.sqlite3"
+LOOKUP_BATCH_SIZE = 500  # Paths per SELECT, below SQLite's bound-parameter limit
+SQLITE_TIMEOUT_SECONDS = 30.0  # Wait this long for another writer's lock
+# Bump when FensTokenCounter's counting rules change: a database written
+# under another version is emptied on open, so no stale count survives.
+COUNT_RULES_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS caption_counts (
+    path TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    context_limit INTEGER NOT NULL,
+    chunks INTEGER NOT NULL,
+    PRIMARY KEY (path, fingerprint, strategy)
+)
+"""
+_PRUNE_QUERY = "SELECT DISTINCT path FROM caption_counts WHERE path >= ? AND path < ?"
+_LOOKUP_QUERY = (
+    "SELECT path, mtime_ns, size, tokens, context_limit, chunks"
+    " FROM caption_counts WHERE fingerprint = ? AND strategy = ?"
+)
+
+
+class CaptionFile(NamedTuple):
+    """A caption file as found on disk; mtime_ns and size detect edits."""
+
+    path: str
+    mtime_ns: int
+    size: int
+
+
+def cache_directory() -> str:
+    """Cache directory: $FENS_CACHE_DIR, else <ComfyUI user dir>/fens_cache."""
+    override_dir = os.environ.get(CACHE_DIR_ENV)
+    if override_dir:
+        return override_dir
+    return os.path.join(folder_paths.get_user_directory(), CACHE_SUBDIR)
+
+
+class CaptionCountCache:
+    """
+    Persistent token counts of caption files in a local SQLite database.
+
+    An entry is keyed by file path, tokenizer fingerprint and count
+    strategy, and is only returned while the file's mtime and size are
+    unchanged, so a re-scan tokenizes just the files that were edited.
+    The database is tied to COUNT_RULES_VERSION, and entries of deleted
+    files are dropped by prune. Each call opens its own connection, so one
+    cache can be used from any thread.
+
+    Raises:
+        sqlite3.Error / OSError: From any method, if the database cannot
+            be created, read or written
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            (version,) = connection.execute("PRAGMA user_version").fetchone()
+            if version != COUNT_RULES_VERSION:
+                connection.execute("DROP TABLE IF EXISTS caption_counts")
+                # PRAGMA takes no bound parameters; the value is an int constant.
+                connection.execute(f"PRAGMA user_version = {COUNT_RULES_VERSION:d}")
+            connection.execute(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT_SECONDS)
+
+    def lookup(
+        self, files: list[CaptionFile], fingerprint: str, strategy: str
+    ) -> dict[str, tuple[int, int, int]]:
+        """
+        Cached (token_count, context_limit_tokens, chunk_count) of each file
+        whose entry matches its current mtime and size, keyed by path.
+        """
+        current = {file.path: (file.mtime_ns, file.size) for file in files}
+        paths = list(current)
+        found = {}
+        with closing(self._connect()) as connection:
+            for start in range(0, len(paths), LOOKUP_BATCH_SIZE):
+                batch = paths[start : start + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                # Only "?" placeholders are interpolated; values are bound.
+                query = f"{_LOOKUP_QUERY} AND path IN ({placeholders})"  # noqa: S608
+                rows = connection.execute(query, [fingerprint, strategy, *batch])
+                for path, mtime_ns, size, tokens, context_limit, chunks in rows:
+                    if current[path] == (mtime_ns, size):
+                        found[path] = (tokens, context_limit, chunks)
+        return found
+
+    def store(
+        self,
+        files: list[CaptionFile],
+        results: list[tuple[int, int, int]],
+        fingerprint: str,
+        strategy: str,
+    ) -> None:
+        """Save the counts of files (one result per file), replacing stale entries."""
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO caption_counts"
+                " (path, fingerprint, strategy, mtime_ns, size, tokens,"
+                " context_limit, chunks) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        file.path,
+                        fingerprint,
+                        strategy,
+                        file.mtime_ns,
+                        file.size,
+                        *result,
+                    )
+                    for file, result in zip(files, results, strict=True)
+                ],
+            )
+
+    def prune(self, root: str, present: set[str]) -> int:
+        """
+        Delete the entries under directory root whose file no longer exists.
+        present holds paths just found on disk, which need no check; files
+        skipped by the scan (other extensions, subdirectories) are kept
+        while they exist.
+
+        Returns:
+            Number of files whose entries were deleted.
+        """
+        prefix = os.path.join(root, "")
+        # Paths starting with prefix sort between it and the prefix with its
+        # last character (the separator) incremented.
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with closing(self._connect()) as connection, connection:
+            rows = connection.execute(_PRUNE_QUERY, (prefix, upper)).fetchall()
+            gone = [
+                (path,)
+                for (path,) in rows
+                if path not in present and not os.path.exists(path)
+            ]
+            connection.executemany("DELETE FROM caption_counts WHERE path = ?", gone)
+        return len(gone)
@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+import re
+from bisect import bisect_right
+from collections.abc import Callable
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from .prompt_scanner import scan_prompt, split_on_break_spans, tag_spans
+from .source_offsets import count_in_ranges, token_offsets
+from .token_arrays import TokenStream
+from .weight_attribution import WeightLayout
+
+DEFAULT_MAX_WORD_LENGTH = 8  # ComfyUI splits weighted spans this long or longer
+MIN_PADDED_TAIL = 2  # End token plus at least one padding slot
+_WORD_PATTERN = re.compile(r"[^\s,]+")
+
+
+class ChunkWindow(NamedTuple):
+    """Fixed batch layout of a CLIP-style stream."""
+
+    slots: int  # Slots per batch, e.g. 77
+    capacity: int  # Prompt tokens per batch, e.g. 75
+    has_end: bool
+    max_word_length: int
+
+
+class ChunkStats(NamedTuple):
+    """Per-batch figures of one stream, from one vectorized pass."""
+
+    tokens: np.ndarray  # Typed tokens per batch
+    padding: np.ndarray  # Padding slots per batch
+    first: np.ndarray  # Typed-token index of each batch's first token
+    last: np.ndarray  # Typed-token index of each batch's last token
+    segments: np.ndarray  # BREAK segment of each batch
+
+
+def chunk_window(stream: TokenStream, sub_tokenizer: Any = None) -> ChunkWindow | None:
+    """
+    The fixed window of a CLIP-style stream, or None for streams that are
+    not split into equal padded batches (T5, Qwen, Llama-style encoders).
+
+    Uses the sub-tokenizer's max_length / pad_to_max_length / start_token /
+    end_token when it has them, as ComfyUI's SDTokenizer does; otherwise
+    equal batch lengths with trailing padding are taken as a fixed window
+    with a start and an end token.
+    """
+    lengths = stream.batch_lengths
+    if not len(lengths) or bool((lengths != lengths[0]).any()):
+        return None
+    slots = int(lengths[0])
+    pad_to_max_length = getattr(sub_tokenizer, "pad_to_max_length", None)
+    max_length = getattr(sub_tokenizer, "max_length", None)
+    if pad_to_max_length is False or (
+        isinstance(max_length, int) and max_length != slots
+    ):
+        return None
+    # Without tokenizer metadata a single batch is only taken as padded when
+    # it ends in padding after the end token.
+    if pad_to_max_length is None and len(lengths) == 1:
+        tail = stream.word_ids[-2:]
+        if len(tail) < MIN_PADDED_TAIL or bool((tail > 0).any()):
+            return None
+    has_start = getattr(sub_tokenizer, "start_token", 0) is not None
+    has_end = getattr(sub_tokenizer, "end_token", 0) is not None
+    max_word_length = getattr(sub_tokenizer, "max_word_length", None)
+    return ChunkWindow(
+        slots,
+        slots - int(has_start) - int(has_end),
+        has_end,
+        (
+            max_word_length
+            if isinstance(max_word_length, int)
+            else DEFAULT_MAX_WORD_LENGTH
+        ),
+    )
+
+
+def chunk_stats(stream: TokenStream, window: ChunkWindow) -> ChunkStats:
+    """
+    Typed tokens, padding slots and first/last typed token of every batch,
+    without a Python loop over tokens.
+
+    Padding is what follows the end token of a batch; a batch without
+    typed tokens is all padding apart from its special tokens.
+    """
+    lengths = stream.batch_lengths.astype(np.int64)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    typed = np.flatnonzero(stream.word_ids > 0)
+    first = np.searchsorted(typed, starts)
+    stop = np.searchsorted(typed, ends)
+    tokens = stop - first
+    last = stop - 1
+    last_position = typed[np.clip(last, 0, max(len(typed) - 1, 0))] if len(typed) else 0
+    padding = np.where(
+        tokens > 0,
+        ends - 1 - last_position - int(window.has_end),
+        window.capacity,
+    )
+    segments = np.repeat(
+        np.arange(len(stream.segment_batch_counts())), stream.segment_batch_counts()
+    )
+    return ChunkStats(tokens, np.maximum(padding, 0), first, last, segments)
+
+
+def pack_chunks(group_sizes: list[int], window: ChunkWindow) -> int:
+    """
+    Batches ComfyUI's SDTokenizer fills with weighted spans of these token
+    counts: a span that does not fit is split when it is long, otherwise it
+    moves whole to a new batch and the rest of the batch is padded.
+    """
+    chunks, used = 1, 0
+    for size in group_sizes:
+        remaining = size
+        while remaining > 0:
+            if used + remaining <= window.capacity:
+                used += remaining
+                break
+            if size >= window.max_word_length:
+                remaining -= window.capacity - used
+            chunks += 1
+            used = 0
+    return chunks
+
+
+def _group_sizes(stream: TokenStream, stats: ChunkStats) -> list[list[int]]:
+    """Token count of each weighted span (run of one word id), per segment."""
+    typed = np.flatnonzero(stream.word_ids > 0)
+    word_ids = stream.word_ids[typed]
+    token_segments = np.repeat(stats.segments, stats.tokens)
+    starts = np.flatnonzero(
+        np.concatenate(
+            [
+                [True],
+                (word_ids[1:] != word_ids[:-1])
+                | (token_segments[1:] != token_segments[:-1]),
+            ]
+        )
+    )
+    sizes = np.diff(np.append(starts, len(typed)))
+    group_segments = token_segments[starts]
+    groups: list[list[int]] = [[] for _ in stream.segment_batch_counts()]
+    for segment, size in zip(group_segments.tolist(), sizes.tolist(), strict=True):
+        groups[segment].append(size)
+    return groups
+
+
+def _split_groups(sizes: list[int], tokens: int) -> tuple[list[int], list[int]]:
+    """Split span sizes after the first tokens tokens."""
+    before, after, seen = [], [], 0
+    for size in sizes:
+        if seen >= tokens:
+            after.append(size)
+        elif seen + size <= tokens:
+            before.append(size)
+        else:
+            before.append(tokens - seen)
+            after.append(seen + size - tokens)
+        seen += size
+    return before, after
+
+
+def _containing(
+    spans: list[tuple[int, int]], starts: list[int], first: int, second: int
+) -> int:
+    """Index of the span (starts = their start offsets) holding both offsets, or -1."""
+    index = bisect_right(starts, second) - 1
+    if index < 0 or first < 0:
+        return -1
+    start, end = spans[index]
+    return index if start <= first and second < end else -1
+
+
+def _splits(text: str, stats: ChunkStats, offsets: np.ndarray) -> list[dict[str, Any]]:
+    """Batch boundaries that fall inside a word or a tag."""
+    inside = np.flatnonzero(
+        (stats.tokens[:-1] > 0)
+        & (stats.tokens[1:] > 0)
+        & (stats.segments[:-1] == stats.segments[1:])
+    )
+    words = [match.span() for match in _WORD_PATTERN.finditer(text)]
+    tags = tag_spans(text)
+    word_starts = [start for start, _ in words]
+    tag_starts = [start for start, _ in tags]
+    splits = []
+    for chunk in inside.tolist():
+        before = int(offsets[stats.last[chunk]])
+        after = int(offsets[stats.first[chunk + 1]])
+        word = _containing(words, word_starts, before, after)
+        tag = _containing(tags, tag_starts, before, after)
+        if word < 0 and tag < 0:
+            continue
+        splits.append(
+            {
+                "after_chunk": chunk + 1,
+                "offset": after,
+                "word": text[slice(*words[word])] if word >= 0 else None,
+                "tag": text[slice(*tags[tag])] if tag >= 0 else None,
+                "tag_start": tags[tag][0] if tag >= 0 else None,
+            }
+        )
+    return splits
+
+
+def _suggestions(
+    text: str,
+    window: ChunkWindow,
+    segment_chunks: list[int],
+    group_sizes: list[list[int]],
+    *,
+    splits: list[dict[str, Any]],
+    offsets: np.ndarray,
+) -> list[dict[str, Any]]:
+    """
+    BREAK edits for one stream, each judged on its own.
+
+    ComfyUI fills batches greedily in prompt order, and that cannot be
+    beaten by forcing a boundary, so inserting BREAK never saves a batch.
+    Insertions are suggested where they keep a split tag whole without
+    adding a batch; removals where merging two segments saves batches.
+    Only segments whose packing pack_chunks reproduces are considered.
+    """
+    bounds = split_on_break_spans(text)
+    if len(bounds) != len(segment_chunks):
+        bounds = [(0, len(text))] if len(segment_chunks) == 1 else []
+    exact = [
+        index < len(bounds) and pack_chunks(sizes, window) == segment_chunks[index]
+        for index, sizes in enumerate(group_sizes)
+    ]
+    suggestions = []
+    suggested = set()
+    for split in splits:
+        tag_start = split["tag_start"]
+        if tag_start is None or tag_start in suggested:
+            continue
+        segment = next(
+            (i for i, (start, end) in enumerate(bounds) if start <= tag_start < end),
+            -1,
+        )
+        if segment < 0 or not exact[segment]:
+            continue
+        seg_start = bounds[segment][0]
+        tokens_before = count_in_ranges(offsets, [(seg_start, tag_start)])[0]
+        if tokens_before == 0:
+            continue
+        before, after = _split_groups(group_sizes[segment], tokens_before)
+        chunks = pack_chunks(before, window) + pack_chunks(after, window)
+        if chunks <= segment_chunks[segment]:
+            suggested.add(tag_start)
+            suggestions.append(
+                {
+                    "action": "insert_break",
+                    "offset": tag_start,
+                    "tag": split["tag"],
+                    "chunk_delta": chunks - segment_chunks[segment],
+                }
+            )
+    break_starts = [start for start, _ in scan_prompt(text).break_spans]
+    for segment in range(len(bounds) - 1):
+        if not (exact[segment] and exact[segment + 1]):
+            continue
+        merged = pack_chunks(group_sizes[segment] + group_sizes[segment + 1], window)
+        saves = segment_chunks[segment] + segment_chunks[segment + 1] - merged
+        position = bisect_right(break_starts, bounds[segment][1] - 1)
+        if saves > 0 and position < len(break_starts):
+            suggestions.append(
+                {
+                    "action": "remove_break",
+                    "offset": break_starts[position],
+                    "chunk_delta": -saves,
+                }
+            )
+    return suggestions
+
+
+def analyze_stream(
+    text: str,
+    stream: TokenStream,
+    window: ChunkWindow,
+    offsets: np.ndarray,
+) -> dict[str, Any]:
+    """
+    Chunk report for one fixed-window stream: tokens and padding per
+    batch, boundaries that split a word or tag, and BREAK suggestions.
+    offsets are the typed tokens' character offsets into text.
+    """
+    stats = chunk_stats(stream, window)
+    segment_chunks = stream.segment_batch_counts().tolist()
+    final = np.zeros(len(stats.tokens), dtype=bool)
+    final[np.cumsum(segment_chunks)[np.asarray(segment_chunks) > 0] - 1] = True
+    splits = _splits(text, stats, offsets)
+    group_sizes = _group_sizes(stream, stats)
+    return {
+        "slots": window.slots,
+        "capacity": window.capacity,
+        "chunks": [
+            {"segment": segment + 1, "tokens": tokens, "padding": padding}
+            for segment, tokens, padding in zip(
+                stats.segments.tolist(),
+                stats.tokens.tolist(),
+                stats.padding.tolist(),
+                strict=True,
+            )
+        ],
+        "padding": int(stats.padding.sum()),
+        "avoidable_padding": int(stats.padding[~final].sum()),
+        "splits": [
+            {key: value for key, value in split.items() if key != "tag_start"}
+            for split in splits
+        ],
+        "suggestions": _suggestions(
+            text,
+            window,
+            segment_chunks,
+            group_sizes,
+            splits=splits,
+            offsets=offsets,
+        ),
+    }
+
+
+def chunk_report(
+    text: str,
+    cleaned_text: str,
+    layout: WeightLayout,
+    streams: dict[str, TokenStream],
+    *,
+    sub_tokenizers: dict[str, Any],
+    decoders: dict[str, Callable[[Any], str | None]],
+) -> dict[str, Any]:
+    """
+    Chunk-boundary analysis of every stream. Streams without a fixed
+    window are reported as {"unbounded": true}. Arguments are as for
+    source_offsets.source_counts; character offsets refer to text.
+    """
+    results: dict[str, Any] = {}
+    for stream_name, stream in streams.items():
+        sub_tokenizer = sub_tokenizers.get(stream_name)
+        window = chunk_window(stream, sub_tokenizer)
+        if window is None:
+            results[stream_name] = {"unbounded": True}
+            continue
+        offsets = token_offsets(
+            text,
+            cleaned_text,
+            layout,
+            stream,
+            sub_tokenizer=sub_tokenizer,
+            decode=decoders[stream_name],
+        )
+        results[stream_name] = analyze_stream(text, stream, window, offsets)
+    return {"streams": results}
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import random
+import re
+from collections.abc import Iterator
+from itertools import product
+from typing import NamedTuple
+
+MAX_NESTING = 64  # Deeper {…} nesting is rejected instead of recursing further
+
+# ComfyUI's frontend strips /* block */ and // line comments before choosing.
+_COMMENT_PATTERN = re.compile(r"/\*[\s\S]*?\*/|//[^\n]*")
+_ESCAPABLE = "{}|\\"
+
+
+class Group(NamedTuple):
+    """A {a|b|c} alternation: one Sequence per option."""
+
+    options: tuple[Sequence, ...]
+
+
+Part = str | Group
+Sequence = tuple[Part, ...]
+
+
+def parse_template(text: str) -> Sequence:
+    """
+    Parse a dynamic prompt template into literal text and {a|b} groups.
+
+    Mirrors ComfyUI's frontend syntax: nested groups, "\\{", "\\}", "\\|"
+    and "\\\\" escapes, and comments removed first. An unmatched "{" or
+    "}" is kept as literal text, and "|" outside a group is literal.
+
+    Raises:
+        ValueError: If groups are nested deeper than MAX_NESTING
+            (unmatched braces are literal and never count)
+    """
+    text = _COMMENT_PATTERN.sub("", text)
+    return _parse(text, _paired_braces(text))
+
+
+def _paired_braces(text: str) -> set[int]:
+    """
+    Positions of the "{" and "}" that pair up into groups, matched with a
+    stack in one pass. Escaped braces are skipped, and braces left unpaired
+    are literal text.
+    """
+    paired = set()
+    opened = []
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if char == "\\" and index + 1 < len(text) and text[index + 1] in _ESCAPABLE:
+            index += 2
+            continue
+        if char == "{":
+            opened.append(index)
+        elif char == "}" and opened:
+            paired.update((opened.pop(), index))
+        index += 1
+    return paired
+
+
+def _parse(text: str, paired: set[int]) -> Sequence:
+    """Single parsing pass; only braces in paired open and close groups."""
+    # Each frame: (finished options, current option parts, literal buffer)
+    stack: list[tuple[list[Sequence], list[Part], list[str]]] = [([], [], [])]
+    index = 0
+    while index < len(text):
+        char = text[index]
+        options, parts, buffer = stack[-1]
+        if char == "\\" and index + 1 < len(text) and text[index + 1] in _ESCAPABLE:
+            buffer.append(text[index + 1])
+            index += 2
+            continue
+        if char == "{" and index in paired:
+            if len(stack) > MAX_NESTING:
+                raise ValueError(f"Template nests groups deeper than {MAX_NESTING}.")
+            stack.append(([], [], []))
+        elif char == "|" and len(stack) > 1:
+            options.append(_close_parts(parts, buffer))
+            stack[-1] = (options, [], [])
+        elif char == "}" and index in paired:
+            options.append(_close_parts(parts, buffer))
+            stack.pop()
+            _, outer_parts, outer_buffer = stack[-1]
+            _flush(outer_parts, outer_buffer)
+            outer_parts.append(Group(tuple(options)))
+        else:
+            buffer.append(char)
+        index += 1
+
+    _, parts, buffer = stack[0]
+    return _close_parts(parts, buffer)
+
+
+def _flush(parts: list[Part], buffer: list[str]) -> None:
+    if buffer:
+        parts.append("".join(buffer))
+        buffer.clear()
+
+
+def _close_parts(parts: list[Part], buffer: list[str]) -> Sequence:
+    _flush(parts, buffer)
+    return tuple(parts)
+
+
+def count_expansions(sequence: Sequence, memo: dict[int, int] | None = None) -> int:
+    """Number of distinct choice paths through the template (may be huge)."""
+    memo = {} if memo is None else memo
+    total = 1
+    for part in sequence:
+        if isinstance(part, Group):
+            key = id(part)
+            if key not in memo:
+                memo[key] = sum(
+                    count_expansions(option, memo) for option in part.options
+                )
+            total *= memo[key]
+    return total
+
+
+def iter_expansions(
+    sequence: Sequence, memo: dict[int, list[str]] | None = None
+) -> Iterator[str]:
+    """
+    Every expansion of the template, in choice order.
+
+    The expansion list of each group is built once and reused wherever the
+    group appears in the product, so shared sub-expansions are not
+    re-expanded per combination.
+    """
+    memo = {} if memo is None else memo
+    choices = [
+        [part] if isinstance(part, str) else _group_expansions(part, memo)
+        for part in sequence
+    ]
+    for combination in product(*choices):
+        yield "".join(combination)
+
+
+def _group_expansions(group: Group, memo: dict[int, list[str]]) -> list[str]:
+    key = id(group)
+    if key not in memo:
+        memo[key] = [
+            text for option in group.options for text in iter_expansions(option, memo)
+        ]
+    return memo[key]
+
+
+def sample_expansion(
+    sequence: Sequence, rng: random.Random, counts: dict[int, int]
+) -> str:
+    """
+    One expansion drawn uniformly over all choice paths: each option is
+    picked with probability proportional to its own number of expansions.
+    """
+    pieces = []
+    for part in sequence:
+        if isinstance(part, str):
+            pieces.append(part)
+            continue
+        weights = [count_expansions(option, counts) for option in part.options]
+        option = rng.choices(part.options, weights=weights)[0]
+        pieces.append(sample_expansion(option, rng, counts))
+    return "".join(pieces)
+
+
+def extreme_expansion(sequence: Sequence, longest: bool) -> str:
+    """
+    The expansion that picks the longest (or shortest) option text in every
+    group - a cheap candidate for the token-count extremes when sampling.
+    """
+    pieces = []
+    for part in sequence:
+        if isinstance(part, str):
+            pieces.append(part)
+            continue
+        options = [extreme_expansion(option, longest) for option in part.options]
+        pieces.append(max(options, key=len) if longest else min(options, key=len))
+    return "".join(pieces)
@@ -0,0 +1,433 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+from typing import Any
+
+import folder_paths
+from comfy.utils import ProgressBar
+from comfy_api.latest import io
+from typing_extensions import override
+
+from .caption_cache import CACHE_FILE, CaptionCountCache, CaptionFile, cache_directory
+from .token_cache import tokenizer_fingerprint
+from .token_common import percentile, summarize_counts
+from .token_pool import count_prompts
+
+REPORT_PERCENTILES = (50, 90, 95, 99)
+MAX_LISTED_FILES = 20  # Over-limit files named in Details; the JSON lists all
+
+
+class FensCaptionScanner(io.ComfyNode):
+    """
+    Counts tokens for every caption file in a directory, e.g. a training
+    dataset, and reports percentiles, histograms and the files over a limit.
+    Integrates tightly with ComfyUI V3 node API and provides UI-friendly output.
+    """
+
+    @classmethod
+    @override
+    def define_schema(cls) -> io.Schema:
+        return io.Schema(
+            node_id="FensCaptionScanner",
+            display_name="Fens Caption Dataset Scanner",
+            category="Fens_Simple_Nodes/Utility",
+            search_aliases=["caption scan", "dataset tokens", "caption token count"],
+            description="Count tokens for every caption file in a directory and report percentiles, a histogram, context window tiers and the files over a token limit. Counts are cached on disk, so re-scans only tokenize changed files.",
+            inputs=[
+                io.Clip.Input(
+                    "clip",
+                    display_name="CLIP",
+                    tooltip="ComfyUI CLIP object (text encoder stack) from the current workflow.",
+                ),
+                io.String.Input(
+                    "directory",
+                    display_name="Directory",
+                    default="",
+                    tooltip="Caption directory to scan. Relative paths are resolved against the ComfyUI input directory.",
+                ),
+                io.Int.Input(
+                    "token_limit",
+                    display_name="Token Limit",
+                    default=75,
+                    min=1,
+                    max=1000000,
+                    tooltip="Captions with more typed tokens than this are listed as over the limit (75/150/225 = one/two/three CLIP windows).",
+                ),
+                io.String.Input(
+                    "extensions",
+                    display_name="Extensions",
+                    default=".txt",
+                    advanced=True,
+                    tooltip="Comma-separated caption file extensions to scan.",
+                ),
+                io.Boolean.Input(
+                    "recursive",
+                    display_name="Recursive",
+                    default=True,
+                    advanced=True,
+                    tooltip="Also scan subdirectories.",
+                ),
+                io.Combo.Input(
+                    "count_strategy",
+                    display_name="Count Strategy",
+                    options=["max_stream", "sum_streams"],
+                    default="max_stream",
+                    advanced=True,
+                    tooltip="How to aggregate counts across tokenizer branches (e.g. l/g/t5xxl): max_stream = largest branch count, sum_streams = sum of all branches.",
+                ),
+                io.Int.Input(
+                    "workers",
+                    display_name="Workers",
+                    default=0,
+                    min=0,
+                    max=64,
+                    advanced=True,
+                    tooltip="Worker processes used for tokenization (0 = auto, 1 = in-process). Each worker holds its own tokenizer copy.",
+                ),
+                io.Int.Input(
+                    "histogram_bin_width",
+                    display_name="Histogram Bin Width",
+                    default=25,
+                    min=1,
+                    max=100000,
+                    advanced=True,
+                    tooltip="Width in tokens of each histogram bin in the report.",
+                ),
+                io.Boolean.Input(
+                    "use_disk_cache",
+                    display_name="Use Disk Cache",
+                    default=True,
+                    advanced=True,
+                    tooltip="Keep counts in a SQLite file keyed by path, modification time, size and tokenizer, so re-scans only tokenize new or changed captions.",
+                ),
+            ],
+            outputs=[
+                io.String.Output(
+                    "report_json",
+                    display_name="Report JSON",
+                    tooltip="JSON with statistics, percentiles, context window tiers, a token histogram and every file over the limit.",
+                ),
+                io.String.Output(
+                    "over_limit_files",
+                    display_name="Over Limit Files",
+                    tooltip="Paths of captions over the token limit, one per line, largest first.",
+                ),
+                io.Int.Output(
+                    "file_count",
+                    display_name="File Count",
+                    tooltip="Number of caption files counted.",
+                ),
+                io.Int.Output(
+                    "p95_tokens",
+                    display_name="P95 Tokens",
+                    tooltip="95th percentile (nearest rank) of per-file token counts.",
+                ),
+                io.Int.Output(
+                    "over_limit_count",
+                    display_name="Over Limit",
+                    tooltip="Number of captions with more tokens than the token limit.",
+                ),
+                io.String.Output(
+                    "details",
+                    display_name="Details",
+                    tooltip="Human-readable summary of the scan.",
+                ),
+            ],
+            is_experimental=False,
+        )
+
+    @classmethod
+    def _resolve_directory(cls, directory: str) -> str:
+        """Expand ~ and resolve relative paths against ComfyUI's input directory."""
+        path = os.path.expanduser(directory.strip())
+        if not os.path.isabs(path):
+            path = os.path.join(folder_paths.get_input_directory(), path)
+        return os.path.realpath(path)
+
+    @classmethod
+    def _find_captions(
+        cls, root: str, extensions: tuple[str, ...], recursive: bool
+    ) -> list[CaptionFile]:
+        """Caption files under root in sorted path order, with their mtime and size."""
+        found = []
+        for current, directories, names in os.walk(root):
+            directories.sort()
+            if not recursive:
+                directories.clear()
+            for name in sorted(names):
+                if not name.lower().endswith(extensions):
+                    continue
+                path = os.path.join(current, name)
+                try:
+                    stat = os.stat(path)
+                except OSError as e:
+                    logging.warning(
+                        "FensCaptionScanner: Could not stat %s. %s", path, e
+                    )
+                    continue
+                found.append(CaptionFile(path, stat.st_mtime_ns, stat.st_size))
+        return found
+
+    @classmethod
+    def _read_captions(
+        cls, files: list[CaptionFile]
+    ) -> tuple[list[CaptionFile], list[str], list[str]]:
+        """
+        Read caption text as UTF-8 (undecodable bytes replaced).
+
+        Returns:
+            Tuple of (read_files, texts, unreadable_paths)
+        """
+        read_files, texts, unreadable = [], [], []
+        for file in files:
+            try:
+                with open(file.path, encoding="utf-8", errors="replace") as f:
+                    texts.append(f.read())
+            except OSError as e:
+                logging.warning(
+                    "FensCaptionScanner: Could not read %s. %s", file.path, e
+                )
+                unreadable.append(file.path)
+                continue
+            read_files.append(file)
+        return read_files, texts, unreadable
+
+    @classmethod
+    def _open_cache(cls, fingerprint: str) -> CaptionCountCache | None:
+        """The shared on-disk cache, or None when it cannot be used."""
+        if not fingerprint:
+            return None
+        try:
+            return CaptionCountCache(os.path.join(cache_directory(), CACHE_FILE))
+        except (sqlite3.Error, OSError) as e:
+            logging.warning("FensCaptionScanner: Disk cache unavailable. %s", e)
+            return None
+
+    @classmethod
+    def _count_files(
+        cls,
+        clip: Any,
+        root: str,
+        files: list[CaptionFile],
+        *,
+        count_strategy: str,
+        workers: int,
+        use_disk_cache: bool,
+    ) -> tuple[dict[str, tuple[int, int, int]], list[str], int, int]:
+        """
+        Count every file, taking unchanged files from the disk cache and
+        tokenizing the rest on the shared process pool. Cache entries of
+        files deleted from root are dropped afterwards.
+
+        Returns:
+            Tuple of (results by path, unreadable paths, cached file count,
+            processes used)
+        """
+        fingerprint = tokenizer_fingerprint(clip)
+        cache = cls._open_cache(fingerprint) if use_disk_cache else None
+        results: dict[str, tuple[int, int, int]] = {}
+        if cache is not None:
+            try:
+                results = cache.lookup(files, fingerprint, count_strategy)
+            except sqlite3.Error as e:
+                logging.warning("FensCaptionScanner: Could not read disk cache. %s", e)
+                cache = None
+        cached = len(results)
+        pending = [file for file in files if file.path not in results]
+        pending, texts, unreadable = cls._read_captions(pending)
+        processes_used = 1
+        if pending:
+            pbar = ProgressBar(len(pending))
+            counts, processes_used = count_prompts(
+                clip,
+                texts,
+                count_strategy,
+                workers,
+                progress=pbar.update_absolute,
+            )
+            results.update(
+                (file.path, count) for file, count in zip(pending, counts, strict=True)
+            )
+            if cache is not None:
+                try:
+                    cache.store(pending, counts, fingerprint, count_strategy)
+                except sqlite3.Error as e:
+                    logging.warning(
+                        "FensCaptionScanner: Could not write disk cache. %s", e
+                    )
+        if cache is not None:
+            try:
+                cache.prune(root, {file.path for file in files})
+            except sqlite3.Error as e:
+                logging.warning("FensCaptionScanner: Could not prune disk cache. %s", e)
+        return results, unreadable, cached, processes_used
+
+    @classmethod
+    def _histogram(cls, ordered: list[int], bin_width: int) -> list[dict[str, int]]:
+        """Files per bin_width-token bin, from 0 to the largest count."""
+        if not ordered:
+            return []
+        counts = [0] * (ordered[-1] // bin_width + 1)
+        for tokens in ordered:
+            counts[tokens // bin_width] += 1
+        return [
+            {"start": index * bin_width, "end": (index + 1) * bin_width, "files": files}
+            for index, files in enumerate(counts)
+        ]
+
+    @classmethod
+    def _report(
+        cls,
+        root: str,
+        results: dict[str, tuple[int, int, int]],
+        *,
+        token_limit: int,
+        bin_width: int,
+    ) -> dict[str, Any]:
+        """Statistics, context window tiers, histogram and over-limit files."""
+        ordered = sorted(tokens for tokens, _, _ in results.values())
+        stats = summarize_counts(ordered, token_limit)
+        for pct in REPORT_PERCENTILES:
+            stats[f"p{pct}"] = percentile(ordered, pct)
+        windows: dict[int, int] = {}
+        for _, context_limit, _ in results.values():
+            windows[context_limit] = windows.get(context_limit, 0) + 1
+        over_limit = sorted(
+            (
+                {
+                    "path": os.path.relpath(path, root),
+                    "tokens": tokens,
+                    "chunks": chunks,
+                }
+                for path, (tokens, _, chunks) in results.items()
+                if tokens > token_limit
+            ),
+            key=lambda entry: (-entry["tokens"], entry["path"]),
+        )
+        return {
+            "directory": root,
+            "token_limit": token_limit,
+            "stats": stats,
+            "context_limits": {
+                str(limit): files for limit, files in sorted(windows.items())
+            },
+            "histogram": cls._histogram(ordered, bin_width),
+            "over_limit": over_limit,
+        }
+
+    @classmethod
+    def _details(
+        cls,
+        report: dict[str, Any],
+        *,
+        count_strategy: str,
+        scan_counts: dict[str, int],
+    ) -> str:
+        stats = report["stats"]
+        details = " | ".join(
+            [
+                f"Files: {stats['count']}",
+                f"Min: {stats['min']}",
+                f"Max: {stats['max']}",
+                f"Mean: {stats['mean']:.2f}",
+                *(f"P{pct}: {stats[f'p{pct}']}" for pct in REPORT_PERCENTILES),
+                f"Over {report['token_limit']}: {stats['over_limit']}",
+                f"Strategy: {count_strategy}",
+                f"Cached: {scan_counts['cached']}",
+                f"Tokenized: {scan_counts['tokenized']}",
+                f"Workers: {scan_counts['workers']}",
+            ]
+        )
+        if scan_counts["unreadable"]:
+            details = f"{details} | Unreadable: {scan_counts['unreadable']}"
+        tiers = ", ".join(
+            f"{limit}: {files}" for limit, files in report["context_limits"].items()
+        )
+        if tiers:
+            details = f"{details}\nContext limits: {tiers}"
+        listed = report["over_limit"][:MAX_LISTED_FILES]
+        if listed:
+            lines = [f"  {entry['path']}: {entry['tokens']}" for entry in listed]
+            hidden = len(report["over_limit"]) - len(listed)
+            if hidden:
+                lines.append(f"  … {hidden} more")
+            details = f"{details}\n\nOver limit:\n" + "\n".join(lines)
+        return details
+
+    @classmethod
+    @override
+    def execute(
+        cls,
+        clip: Any,
+        directory: str = "",
+        token_limit: int = 75,
+        extensions: str = ".txt",
+        recursive: bool = True,
+        count_strategy: str = "max_stream",
+        workers: int = 0,
+        histogram_bin_width: int = 25,
+        use_disk_cache: bool = True,
+    ) -> io.NodeOutput:
+        """
+        Count every caption file in the directory and aggregate the results.
+
+        Returns:
+            tuple: (report_json, over_limit_files, file_count, p95,
+                    over_limit_count, details)
+        """
+        if clip is None:
+            msg = "No CLIP input connected."
+            logging.warning("FensCaptionScanner: %s", msg)
+            return io.NodeOutput("{}", "", 0, 0, 0, msg)
+        if not directory or not directory.strip():
+            return io.NodeOutput("{}", "", 0, 0, 0, "No directory provided.")
+
+        root = cls._resolve_directory(directory)
+        if not os.path.isdir(root):
+            msg = f"Directory not found: {root}"
+            logging.error("FensCaptionScanner: %s", msg)
+            return io.NodeOutput("{}", "", 0, 0, 0, msg)
+
+        suffixes = tuple(
+            suffix if suffix.startswith(".") else f".{suffix}"
+            for suffix in (part.strip().lower() for part in extensions.split(","))
+            if suffix
+        )
+        files = cls._find_captions(root, suffixes or (".txt",), recursive)
+        if not files:
+            return io.NodeOutput("{}", "", 0, 0, 0, f"No caption files in {root}.")
+
+        results, unreadable, cached, processes_used = cls._count_files(
+            clip,
+            root,
+            files,
+            count_strategy=count_strategy,
+            workers=workers,
+            use_disk_cache=use_disk_cache,
+        )
+        report = cls._report(
+            root, results, token_limit=token_limit, bin_width=histogram_bin_width
+        )
+        report["unreadable"] = [os.path.relpath(path, root) for path in unreadable]
+        details = cls._details(
+            report,
+            count_strategy=count_strategy,
+            scan_counts={
+                "cached": cached,
+                "tokenized": len(results) - cached,
+                "workers": processes_used,
+                "unreadable": len(unreadable),
+            },
+        )
+        stats = report["stats"]
+        return io.NodeOutput(
+            json.dumps(report, separators=(",", ":")),
+            "\n".join(entry["path"] for entry in report["over_limit"]),
+            stats["count"],
+            stats["p95"],
+            stats["over_limit"],
+            details,
+        )
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import logging
+from typing import Any
+
+from comfy_api.latest import io
+from typing_extensions import override
+
+from .fens_token_counter import FensTokenCounter, FensTokens
+from .token_arrays import as_token_stream
+from .token_common import PretokenizedPrompt
+
+
+class FensEncodeTokens(io.ComfyNode):
+    """
+    Encodes the tokens output of Fens Token Counter into conditioning, so
+    the prompt is tokenized once per run instead of once per node.
+    Integrates tightly with ComfyUI V3 node API and provides UI-friendly output.
+    """
+
+    @classmethod
+    @override
+    def define_schema(cls) -> io.Schema:
+        return io.Schema(
+            node_id="FensEncodeTokens",
+            display_name="Fens Encode Tokens",
+            category="Fens_Simple_Nodes/Utility",
+            search_aliases=["encode tokens", "pretokenized", "text encode tokens"],
+            description="Encode the Tokens output of Fens Token Counter with a CLIP model, skipping the second tokenization a CLIP Text Encode node would do.",
+            inputs=[
+                io.Clip.Input(
+                    "clip",
+                    display_name="CLIP",
+                    tooltip="The CLIP model used to encode. Use the same CLIP as the counter; with a different tokenizer the prompt is tokenized again.",
+                ),
+                FensTokens.Input(
+                    "tokens",
+                    display_name="Tokens",
+                    tooltip="The Tokens output of Fens Token Counter.",
+                ),
+            ],
+            outputs=[
+                io.Conditioning.Output(
+                    "conditioning",
+                    display_name="Conditioning",
+                    tooltip="Conditioning for the prompt, as CLIP Text Encode would produce it.",
+                ),
+            ],
+            is_experimental=False,
+        )
+
+    @classmethod
+    def _token_batches(
+        cls, clip: Any, tokens: PretokenizedPrompt
+    ) -> dict[str, list[list[Any]]]:
+        """
+        The batches to encode: the counter's streams when they were made by
+        an identical tokenizer stack, otherwise a fresh tokenization of the
+        prompt with the same BREAK handling.
+        """
+        if tokens.matches(clip):
+            return tokens.to_batches()
+        logging.info(
+            "FensEncodeTokens: Counted tokens cannot be reused (different tokenizer or escaped parentheses); tokenizing the prompt again."
+        )
+        token_streams = FensTokenCounter._tokenize_prompt(
+            clip, tokens.text, tokens.break_count
+        )
+        return {
+            stream_name: as_token_stream(stream).to_batches()
+            for stream_name, stream in token_streams.items()
+        }
+
+    @classmethod
+    @override
+    def execute(cls, clip: Any, tokens: PretokenizedPrompt | None) -> io.NodeOutput:
+        """
+        Encode pre-tokenized prompt tokens.
+
+        Raises:
+            RuntimeError: If the CLIP or tokens input is missing, as ComfyUI's
+                own encode nodes do, since no conditioning can be produced.
+
+        Returns:
+            tuple: (conditioning,)
+        """
+        if clip is None:
+            raise RuntimeError(
+                "ERROR: clip input is invalid: None\n\nIf the clip is from a checkpoint loader node your checkpoint does not contain a valid clip or text encoder model."
+            )
+        if tokens is None:
+            raise RuntimeError(
+                "ERROR: tokens input is empty. Check the Details output of the Fens Token Counter that feeds this node."
+            )
+        return io.NodeOutput(
+            clip.encode_from_tokens_scheduled(cls._token_batches(clip, tokens))
+        )
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any
+
+from comfy_api.latest import io
+from typing_extensions import override
+
+from .fens_token_counter import FensTokenCounter
+from .token_arrays import TokenStream, summarize_stream
+from .token_cache import tokenizer_fingerprint
+from .token_common import map_prompts
+
+MIN_CLIP_INPUTS = 2
+MAX_CLIP_INPUTS = 8
+ENCODER_LABEL_WIDTH = 28  # Encoder column width of the Details table
+
+
+class FensMultiClipTokenCounter(io.ComfyNode):
+    """
+    Counts one prompt with several CLIP stacks side by side, tokenizing for
+    all of them concurrently from a single preprocessing and BREAK split.
+    Integrates tightly with ComfyUI V3 node API and provides UI-friendly output.
+    """
+
+    @classmethod
+    @override
+    def define_schema(cls) -> io.Schema:
+        return io.Schema(
+            node_id="FensMultiClipTokenCounter",
+            display_name="Fens Token Counter (Multi-CLIP)",
+            category="Fens_Simple_Nodes/Utility",
+            search_aliases=["token", "tokens", "compare clip", "compare encoders"],
+            description="Count the same prompt with several CLIP stacks (e.g. SDXL, Flux, Anima) in one run and compare tokens, context limits and chunks per encoder.",
+            inputs=[
+                io.Autogrow.Input(
+                    "clips",
+                    template=io.Autogrow.TemplatePrefix(
+                        io.Clip.Input(
+                            "clip",
+                            tooltip="ComfyUI CLIP object (text encoder stack) to compare. A new slot appears when one is connected.",
+                        ),
+                        prefix="clip",
+                        min=MIN_CLIP_INPUTS,
+                        max=MAX_CLIP_INPUTS,
+                    ),
+                ),
+                io.String.Input(
+                    "text",
+                    display_name="Prompt Text",
+                    multiline=True,
+                    dynamic_prompts=True,
+                    tooltip="The text to be counted.",
+                    optional=True,
+                ),
+                io.Combo.Input(
+                    "count_strategy",
+                    display_name="Count Strategy",
+                    options=["max_stream", "sum_streams"],
+                    default="max_stream",
+                    advanced=True,
+                    tooltip="How to aggregate counts across each encoder's tokenizer branches (e.g. l/g/t5xxl): max_stream = largest branch count, sum_streams = sum of all branches.",
+                ),
+                io.Boolean.Input(
+                    "use_cache",
+                    display_name="Use Tokenization Cache",
+                    default=True,
+                    advanced=True,
+                    tooltip="Reuse tokenizer output for BREAK segments already counted with the same tokenizer stack.",
+                ),
+            ],
+            outputs=[
+                io.Int.Output(
+                    "max_tokens",
+                    display_name="Max Tokens",
+                    tooltip="Largest typed token count among the connected encoders.",
+                ),
+                io.Int.Output(
+                    "max_chunks",
+                    display_name="Max Chunks",
+                    tooltip="Largest chunk count among the connected encoders.",
+                ),
+                io.String.Output(
+                    "comparison_json",
+                    display_name="Comparison JSON",
+                    tooltip="Per encoder: input slot, tokenizer, tokens, context limit and chunks, plus the same per stream.",
+                ),
+                io.String.Output(
+                    "details",
+                    display_name="Details",
+                    tooltip="Comparison table of tokens, context limits and chunks per encoder.",
+                ),
+            ],
+            is_experimental=False,
+        )
+
+    @classmethod
+    def _encoder_report(
+        cls, token_streams: dict[str, TokenStream], count_strategy: str
+    ) -> dict[str, Any]:
+        """Combined and per-stream counts of one encoder's token streams."""
+        tokens, context_limit, chunks = FensTokenCounter._process_token_counts(
+            token_streams, count_strategy
+        )
+        streams = {}
+        for stream_name, stream in token_streams.items():
+            summary = summarize_stream(stream)
+            streams[stream_name] = {
+                "tokens": summary.prompt_tokens,
+                "context_limit": summary.context_limit_tokens,
+                "chunks": summary.chunk_count,
+            }
+        return {
+            "tokens": tokens,
+            "context_limit": context_limit,
+            "chunks": chunks,
+            "streams": streams,
+        }
+
+    @classmethod
+    def _compare(
+        cls,
+        clips: dict[str, Any],
+        text: str,
+        count_strategy: str,
+        use_cache: bool,
+    ) -> dict[str, Any]:
+        """
+        Count text with every CLIP stack.
+
+        The prompt is preprocessed and split on BREAK once for all stacks.
+        Stacks with the same tokenizer fingerprint tokenize identically, so
+        each distinct stack is tokenized once, and distinct stacks are
+        tokenized concurrently. A stack that fails is reported with its
+        error instead of failing the whole comparison.
+
+        Returns:
+            JSON-ready comparison report.
+        """
+        cleaned_text, _ = FensTokenCounter._preprocess_prompt(text)
+        segments = FensTokenCounter._split_on_break(cleaned_text)
+
+        first_slot: dict[str, str] = {}
+        slot_keys = {}
+        for slot, clip in clips.items():
+            # Stacks without a fingerprint cannot be told apart; never merge them.
+            key = tokenizer_fingerprint(clip) or f"#{slot}"
+            slot_keys[slot] = key
+            first_slot.setdefault(key, slot)
+
+        def count(key: str) -> dict[str, Any]:
+            clip = clips[first_slot[key]]
+            fingerprint = key if use_cache and not key.startswith("#") else None
+            try:
+                token_streams = FensTokenCounter._tokenize_break_segments(
+                    clip, segments, fingerprint
+                )
+                if not token_streams:
+                    return {"error": "Tokenizer returned no token streams."}
+                return cls._encoder_report(token_streams, count_strategy)
+            except (ValueError, TypeError) as e:
+                logging.error(
+                    "FensMultiClipTokenCounter: %s failed. %s", first_slot[key], e
+                )
+                return {"error": f"Error: {e}"}
+
+        keys = list(first_slot)
+        reports = dict(zip(keys, map_prompts(count, keys), strict=True))
+
+        encoders = []
+        for slot, clip in clips.items():
+            key = slot_keys[slot]
+            same_as = first_slot[key]
+            tokenizer = getattr(clip, "tokenizer", None)
+            encoders.append(
+                {
+                    "input": slot,
+                    "tokenizer": type(
+                        clip if tokenizer is None else tokenizer
+                    ).__name__,
+                    "same_as": same_as if same_as != slot else None,
+                    **reports[key],
+                }
+            )
+        return {
+            "count_strategy": count_strategy,
+            "segments": len(segments),
+            "unique": len(keys),
+            "encoders": encoders,
+        }
+
+    @classmethod
+    def _format_details(cls, report: dict[str, Any]) -> str:
+        encoders = report["encoders"]
+        counted = [encoder for encoder in encoders if "error" not in encoder]
+        tokens = [encoder["tokens"] for encoder in counted] or [0]
+        chunks = [encoder["chunks"] for encoder in counted] or [0]
+        lines = [
+            " | ".join(
+                [
+                    f"Tokens: {min(tokens)}-{max(tokens)}",
+                    f"Chunks: {min(chunks)}-{max(chunks)}",
+                    f"Encoders: {len(encoders)} ({report['unique']} unique)",
+                    f"Strategy: {report['count_strategy']}",
+                ]
+            ),
+            "",
+            f"{'Encoder':<{ENCODER_LABEL_WIDTH}} {'Tokens':>7} {'Context':>8} {'Chunks':>7}  Streams",
+        ]
+        for encoder in encoders:
+            label = f"{encoder['input']} {encoder['tokenizer']}"
+            if "error" in encoder:
+                lines.append(f"{label:<{ENCODER_LABEL_WIDTH}} {encoder['error']}")
+                continue
+            streams = ", ".join(
+                f"{stream_name} {stream['tokens']}"
+                for stream_name, stream in encoder["streams"].items()
+            )
+            lines.append(
+                f"{label:<{ENCODER_LABEL_WIDTH}} {encoder['tokens']:>7} "
+                f"{encoder['context_limit']:>8} {encoder['chunks']:>7}  {streams}"
+            )
+        return "\n".join(lines)
+
+    @classmethod
+    @override
+    def execute(
+        cls,
+        clips: io.Autogrow.Type,
+        text: str | None = None,
+        count_strategy: str = "max_stream",
+        use_cache: bool = True,
+    ) -> io.NodeOutput:
+        """
+        Count the prompt with each connected CLIP and compare the results.
+
+        Returns:
+            tuple: (max_tokens, max_chunks, comparison_json, details)
+        """
+        connected = {
+            slot: clip for slot, clip in (clips or {}).items() if clip is not None
+        }
+        if not connected:
+            msg = "No CLIP input connected."
+            logging.warning("FensMultiClipTokenCounter: %s", msg)
+            return io.NodeOutput(0, 0, "{}", msg)
+
+        if not text or not text.strip():
+            return io.NodeOutput(0, 0, "{}", "No prompt text provided.")
+
+        report = cls._compare(connected, text, count_strategy, use_cache)
+        counted = [encoder for encoder in report["encoders"] if "error" not in encoder]
+        return io.NodeOutput(
+            max((encoder["tokens"] for encoder in counted), default=0),
+            max((encoder["chunks"] for encoder in counted), default=0),
+            json.dumps(report, ensure_ascii=False, separators=(",", ":")),
+            cls._format_details(report),
+        )
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any
+
+from comfy.utils import ProgressBar
+from comfy_api.latest import io
+from typing_extensions import override
+
+from .token_common import parse_prompt_list, summarize_counts
+from .token_pool import count_prompts
+
+
+class FensTokenBatchCounter(io.ComfyNode):
+    """
+    Counts tokens for a whole list of prompts in one execution and reports
+    per-prompt counts plus aggregate statistics.
+    Integrates tightly with ComfyUI V3 node API and provides UI-friendly output.
+    """
+
+    @classmethod
+    @override
+    def define_schema(cls) -> io.Schema:
+        return io.Schema(
+            node_id="FensTokenBatchCounter",
+            display_name="Fens Token Batch Counter",
+            category="Fens_Simple_Nodes/Utility",
+            search_aliases=["batch token count", "count tokens batch", "prompt audit"],
+            description="Count tokens for many prompts at once (newline-delimited or JSON array) and report min/max/mean/p95 and how many exceed a token limit.",
+            inputs=[
+                io.Clip.Input(
+                    "clip",
+                    display_name="CLIP",
+                    tooltip="ComfyUI CLIP object (text encoder stack) from the current workflow.",
+                ),
+                io.String.Input(
+                    "prompts",
+                    display_name="Prompts",
+                    multiline=True,
+                    tooltip="Prompts to count: one per line, or a JSON array of strings.",
+                ),
+                io.Combo.Input(
+                    "input_format",
+                    display_name="Input Format",
+                    options=["auto", "lines", "json"],
+                    default="auto",
+                    tooltip="auto = JSON array if the text starts with '[', otherwise one prompt per line.",
+                ),
+                io.Int.Input(
+                    "token_limit",
+                    display_name="Token Limit",
+                    default=75,
+                    min=1,
+                    max=1000000,
+                    tooltip="Prompts with more typed tokens than this are counted as over the limit (75 = one CLIP 77-token window).",
+                ),
+                io.Combo.Input(
+                    "count_strategy",
+                    display_name="Count Strategy",
+                    options=["max_stream", "sum_streams"],
+                    default="max_stream",
+                    advanced=True,
+                    tooltip="How to aggregate counts across tokenizer branches (e.g. l/g/t5xxl): max_stream = largest branch count, sum_streams = sum of all branches.",
+                ),
+                io.Int.Input(
+                    "workers",
+                    display_name="Workers",
+                    default=0,
+                    min=0,
+                    max=64,
+                    advanced=True,
+                    tooltip="Worker processes used for tokenization (0 = auto, 1 = in-process). Each worker holds its own tokenizer copy.",
+                ),
+            ],
+            outputs=[
+                io.String.Output(
+                    "counts_json",
+                    display_name="Counts JSON",
+                    tooltip="JSON array with tokens, context limit, chunks and over-limit flag for each prompt.",
+                ),
+                io.Int.Output(
+                    "min_tokens",
+                    display_name="Min Tokens",
+                    tooltip="Smallest per-prompt token count.",
+                ),
+                io.Int.Output(
+                    "max_tokens",
+                    display_name="Max Tokens",
+                    tooltip="Largest per-prompt token count.",
+                ),
+                io.Float.Output(
+                    "mean_tokens",
+                    display_name="Mean Tokens",
+                    tooltip="Average per-prompt token count.",
+                ),
+                io.Int.Output(
+                    "p95_tokens",
+                    display_name="P95 Tokens",
+                    tooltip="95th percentile (nearest rank) of per-prompt token counts.",
+                ),
+                io.Int.Output(
+                    "over_limit_count",
+                    display_name="Over Limit",
+                    tooltip="Number of prompts with more tokens than the token limit.",
+                ),
+                io.String.Output(
+                    "details",
+                    display_name="Details",
+                    tooltip="Human-readable summary of the batch statistics.",
+                ),
+            ],
+            is_experimental=False,
+        )
+
+    @classmethod
+    @override
+    def execute(
+        cls,
+        clip: Any,
+        prompts: str = "",
+        input_format: str = "auto",
+        token_limit: int = 75,
+        count_strategy: str = "max_stream",
+        workers: int = 0,
+    ) -> io.NodeOutput:
+        """
+        Count every prompt in the batch and aggregate the results.
+
+        Returns:
+            tuple: (counts_json, min, max, mean, p95, over_limit_count, details)
+        """
+        if clip is None:
+            msg = "No CLIP input connected."
+            logging.warning("FensTokenBatchCounter: %s", msg)
+            return io.NodeOutput("[]", 0, 0, 0.0, 0, 0, msg)
+
+        try:
+            prompt_list = parse_prompt_list(prompts or "", input_format)
+        except ValueError as e:
+            msg = f"Error: {e}"
+            logging.error("FensTokenBatchCounter: %s", msg)
+            return io.NodeOutput("[]", 0, 0, 0.0, 0, 0, msg)
+
+        if not prompt_list:
+            return io.NodeOutput("[]", 0, 0, 0.0, 0, 0, "No prompts provided.")
+
+        pbar = ProgressBar(len(prompt_list))
+        results, processes_used = count_prompts(
+            clip,
+            prompt_list,
+            count_strategy,
+            workers,
+            progress=pbar.update_absolute,
+        )
+
+        per_prompt = [
+            {
+                "index": index,
+                "tokens": tokens,
+                "context_limit": context_limit,
+                "chunks": chunks,
+                "over_limit": tokens > token_limit,
+            }
+            for index, (tokens, context_limit, chunks) in enumerate(results)
+        ]
+        stats = summarize_counts([tokens for tokens, _, _ in results], token_limit)
+
+        details = " | ".join(
+            [
+                f"Prompts: {stats['count']}",
+                f"Min: {stats['min']}",
+                f"Max: {stats['max']}",
+                f"Mean: {stats['mean']:.2f}",
+                f"P95: {stats['p95']}",
+                f"Over {token_limit}: {stats['over_limit']}",
+                f"Strategy: {count_strategy}",
+                f"Workers: {processes_used}",
+            ]
+        )
+
+        return io.NodeOutput(
+            json.dumps(per_prompt, separators=(",", ":")),
+            stats["min"],
+            stats["max"],
+            float(stats["mean"]),
+            stats["p95"],
+            stats["over_limit"],
+            details,
+        )
@@ -1,12 +1,68 @@
 from __future__ import annotations
 
+import asyncio
+import functools
+import json
 import logging
-import re
+import threading
+from collections.abc import Callable, Iterable
 from typing import Any
 
 from comfy_api.latest import io
 from typing_extensions import override
 
+from .chunk_analysis import chunk_report
+from .prompt_scanner import (
+    Composition,
+    parse_parentheses_spans,
+    piece_spans,
+    scan_prompt,
+    split_composition,
+    split_on_break,
+    split_on_break_spans,
+    unescape_offsets,
+    weight_tree,
+)
+from .source_offsets import limit_offset, source_counts, token_offsets
+from .token_arrays import (
+    TokenStream,
+    as_token_stream,
+    compact_streams,
+    summarize_stream,
+    visible_positions,
+)
+from .token_cache import (
+    SEGMENT_CACHE,
+    TOKENIZE_CACHE,
+    estimate_streams_bytes,
+    get_decode_table,
+    tokenizer_fingerprint,
+)
+from .token_common import (
+    CancellableClip,
+    ConcurrentStreamClip,
+    LimitScan,
+    PretokenizedPrompt,
+    map_prompts,
+    raise_if_cancelled,
+)
+from .token_estimator import (
+    CALIBRATION_TEXT,
+    ESTIMATOR_STORE,
+    StreamEstimate,
+    StreamModel,
+    build_stream_model,
+    estimate_stream,
+    pretokenize,
+    stream_window,
+)
+from .token_metrics import PHASE_METRICS, PhaseTimer, metrics_directory
+from .weight_attribution import attribute_stream, build_layout
+
+# Pre-tokenized prompt (a PretokenizedPrompt) passed from the counter to
+# FensEncodeTokens.
+FensTokens = io.Custom("FENS_TOKENS")
+
 
 class FensTokenCounter(io.ComfyNode):
     """
@@ -52,6 +108,97 @@ class FensTokenCounter(io.ComfyNode):
                     advanced=True,
                     tooltip="Append a per-token breakdown (id, decoded text, weight, word id) for each stream to the Details output.",
                 ),
+                io.Int.Input(
+                    "breakdown_offset",
+                    display_name="Breakdown Offset",
+                    default=0,
+                    min=0,
+                    max=10000000,
+                    advanced=True,
+                    tooltip="Skip this many tokens per stream before the breakdown window starts.",
+                ),
+                io.Int.Input(
+                    "breakdown_limit",
+                    display_name="Breakdown Limit",
+                    default=256,
+                    min=0,
+                    max=10000000,
+                    advanced=True,
+                    tooltip="Maximum tokens listed per stream in the breakdown (0 = no limit). Tokens outside the window are summarised as '… N more'.",
+                ),
+                io.Boolean.Input(
+                    "use_cache",
+                    display_name="Use Tokenization Cache",
+                    default=True,
+                    advanced=True,
+                    tooltip="Reuse tokenizer output for prompts already counted with the same tokenizer stack. Cache hit/miss counters are shown in the Details output.",
+                ),
+                io.Boolean.Input(
+                    "concurrent_streams",
+                    display_name="Concurrent Streams",
+                    default=False,
+                    advanced=True,
+                    tooltip="Tokenize each tokenizer branch (e.g. l/g/t5xxl) on its own thread. Speeds up multi-encoder stacks whose tokenizers release the GIL (HF fast tokenizers); results are identical.",
+                ),
+                io.Boolean.Input(
+                    "show_timings",
+                    display_name="Show Timings",
+                    default=False,
+                    advanced=True,
+                    tooltip="Time each phase (preprocess, tokenize, count, breakdown) and add the timings to the Details output.",
+                ),
+                io.Combo.Input(
+                    "metrics_export",
+                    display_name="Metrics Export",
+                    options=["none", "prometheus", "json"],
+                    default="none",
+                    advanced=True,
+                    tooltip="Write rolling per-phase timing histograms after each run, as Prometheus text (fens_token_counter.prom) or JSON, to <user dir>/fens_metrics or $FENS_METRICS_DIR.",
+                ),
+                io.Boolean.Input(
+                    "weight_attribution",
+                    display_name="Weight Attribution",
+                    default=False,
+                    advanced=True,
+                    tooltip="Attribute tokens to each weighted phrase ((text:1.3), (text)) and report tokens per weight bucket, from the same tokenization pass. Adds a summary to Details and fills the Weight Attribution JSON output.",
+                ),
+                io.Boolean.Input(
+                    "source_counts",
+                    display_name="Source Counts",
+                    default=False,
+                    advanced=True,
+                    tooltip="Map tokens back to the characters of the prompt and count them per line and per comma-separated tag, from the same tokenization pass. Adds a summary to Details and fills the Source Counts JSON output.",
+                ),
+                io.Boolean.Input(
+                    "chunk_analysis",
+                    display_name="Chunk Analysis",
+                    default=False,
+                    advanced=True,
+                    tooltip="For CLIP-style streams, report padding per 75-token chunk, words and tags split across chunk boundaries, and BREAK edits that keep tags whole or save chunks. Adds a summary to Details and fills the Chunk Analysis JSON output.",
+                ),
+                io.Int.Input(
+                    "stop_after_tokens",
+                    display_name="Stop After Tokens",
+                    default=0,
+                    min=0,
+                    max=10000000,
+                    advanced=True,
+                    tooltip="0 = off. Otherwise tokenize the prompt in pieces and stop as soon as the count goes over this many tokens, reporting the character where it did. Keeps huge prompts fast and memory use bounded; context limit, chunks and the other outputs are then left empty.",
+                ),
+                io.Boolean.Input(
+                    "estimate",
+                    display_name="Estimate Mode",
+                    default=False,
+                    advanced=True,
+                    tooltip="Estimate the count without tokenizing, from a word-length model calibrated once per tokenizer and saved to disk. Returns the estimate with a 95% interval, and counts exactly only when the interval crosses a chunk boundary. Fills the Estimate JSON output.",
+                ),
+                io.Boolean.Input(
+                    "composition",
+                    display_name="Composition Mode",
+                    default=False,
+                    advanced=True,
+                    tooltip="Count AND / CAT / AVG sub-prompts the way prompt-control style encoders encode them: each on its own, identical ones tokenized once, concurrently. Directive calls (STYLE(...), SDXL(...), ...) are not counted as text. Fills the Composition JSON output.",
+                ),
             ],
             outputs=[
                 io.Int.Output(
@@ -79,13 +226,58 @@ class FensTokenCounter(io.ComfyNode):
                     display_name="Prompt Echo",
                     tooltip="The input prompt (multiline string).",
                 ),
+                io.String.Output(
+                    "token_breakdown",
+                    display_name="Token Breakdown JSON",
+                    tooltip="The breakdown window as compact columnar JSON (positions, ids, text, weights, word ids per stream). Empty object unless Show Token Breakdown is enabled.",
+                ),
+                io.String.Output(
+                    "weight_attribution",
+                    display_name="Weight Attribution JSON",
+                    tooltip="Weighted spans and phrases with character offsets, plus per stream the tokens per weight bucket, span and phrase. Empty object unless Weight Attribution is enabled.",
+                ),
+                FensTokens.Output(
+                    "tokens",
+                    display_name="Tokens",
+                    tooltip="The counted tokens (BREAK segments merged), for Fens Encode Tokens to encode without tokenizing the prompt again.",
+                ),
+                io.String.Output(
+                    "source_counts",
+                    display_name="Source Counts JSON",
+                    tooltip="Token counts per line and per comma-separated tag for each stream, plus each token's character offset in the prompt. Empty object unless Source Counts is enabled.",
+                ),
+                io.String.Output(
+                    "chunk_analysis",
+                    display_name="Chunk Analysis JSON",
+                    tooltip="Per stream: tokens and padding per chunk, chunk boundaries that split a word or tag, and suggested BREAK edits. Empty object unless Chunk Analysis is enabled.",
+                ),
+                io.String.Output(
+                    "composition",
+                    display_name="Composition JSON",
+                    tooltip="Per sub-prompt: span, AND part, CAT/AVG join, weight, tokens, context limit and chunks, plus the encoder passes the composition needs. Empty object unless Composition Mode is on and the prompt composes.",
+                ),
+                io.String.Output(
+                    "estimate",
+                    display_name="Estimate JSON",
+                    tooltip="The estimate with its 95% interval, chunks and context limit, overall and per stream, and whether the prompt was counted exactly instead. Empty object unless Estimate Mode is enabled.",
+                ),
             ],
             is_experimental=False,
         )
 
     EXPECTED_TOKEN_COUNT = 3
     MIN_TOKEN_WEIGHT_TUPLE_LEN = 2  # Minimum length for a (token_id, weight) tuple
-    MIN_WEIGHT_SEGMENT_LEN = 2  # Minimum length for weight syntax: "(x)"
+    MAX_WEIGHT_GROUP_LINES = 32  # Weighted phrases listed per stream in Details
+    MAX_PHRASE_CHARS = 48  # Longer phrases are shortened in Details
+    MAX_SOURCE_LINES = 32  # Prompt lines listed per stream in Details
+    TOP_TAG_COUNT = 3  # Largest tags listed per stream in Details
+    MAX_CHUNK_LINES = 16  # Chunks, splits and suggestions listed per stream
+    BREAK_CONTEXT_CHARS = 16  # Prompt text shown on each side of a BREAK
+    # Stop After Tokens pieces: the first covers about this many characters
+    # per allowed token, later ones double up to MAX_PIECE_CHARS.
+    PIECE_CHARS_PER_TOKEN = 8
+    MIN_PIECE_CHARS = 256
+    MAX_PIECE_CHARS = 65536
 
     @classmethod
     def _escape_important(cls, text: str) -> str:
@@ -112,69 +304,21 @@ class FensTokenCounter(io.ComfyNode):
         Used to extract weight-syntax segments from the prompt.
         Returns list of segments like ["text", "(weighted:1.5)", "more text"]
         """
-        result = []
-        current_item = ""
-        nesting_level = 0
-        for char in string:
-            if char == "(":
-                if nesting_level == 0:
-                    if current_item:
-                        result.append(current_item)
-                        current_item = "("
-                    else:
-                        current_item = "("
-                else:
-                    current_item += char
-                nesting_level += 1
-            elif char == ")":
-                nesting_level -= 1
-                if nesting_level == 0:
-                    result.append(current_item + ")")
-                    current_item = ""
-                else:
-                    current_item += char
-            else:
-                current_item += char
-        if current_item:
-            result.append(current_item)
-        return result
+        return [string[start:end] for start, end in parse_parentheses_spans(string)]
 
     @classmethod
     def _token_weights(
         cls, string: str, current_weight: float = 1.0
     ) -> list[tuple[str, float]]:
         """
-        Parse weight syntax from prompt text.
-        (text:weight) syntax applies a multiplier to the text tokens.
+        Parse weight syntax from prompt text the way ComfyUI does.
+        (text:weight) sets the weight of its text, bare (text) multiplies the
+        enclosing weight by 1.1, groups nest and escaped parentheses are text.
         Returns list of (text, weight) tuples where weight is the final multiplier.
         Note: Weights don't add tokens, they modify embedding strength.
         """
-        parsed = cls._parse_parentheses(string)
-        out = []
-        for segment in parsed:
-            weight = current_weight
-            if (
-                len(segment) >= cls.MIN_WEIGHT_SEGMENT_LEN
-                and segment[0] == "("
-                and segment[-1] == ")"
-            ):
-                # Check for weight syntax like (text:1.5)
-                inner = segment[1:-1]
-                colon_idx = inner.rfind(":")
-                if colon_idx > 0:
-                    try:
-                        weight = float(inner[colon_idx + 1 :])
-                        text = inner[:colon_idx]
-                        out.append((text, weight))
-                    except ValueError:
-                        # Malformed weight, treat whole thing as text
-                        out.append((segment, current_weight))
-                else:
-                    # Just parentheses, no weight
-                    out.append((inner, current_weight))
-            else:
-                out.append((segment, current_weight))
-        return out
+        tree = weight_tree(string, current_weight)
+        return [(string[span.start : span.end], span.weight) for span in tree.spans]
 
     @classmethod
     def _preprocess_prompt(cls, text: str) -> tuple[str, dict[str, Any]]:
@@ -187,42 +331,16 @@ class FensTokenCounter(io.ComfyNode):
                 - has_escaped_parens: Whether escaped parens are present
                 - special_functions: List of detected special functions
         """
+        # Single pass over the prompt for BREAK operations (BREAK on its own,
+        # not "breaking" or "rebreak"), escaped parentheses and special
+        # functions (with optional parentheses: "TE()" or just "TE").
+        scan = scan_prompt(text)
         analysis = {
-            "break_count": 0,
-            "has_escaped_parens": False,
-            "special_functions": [],
+            "break_count": len(scan.break_spans),
+            "has_escaped_parens": scan.has_escaped_parens,
+            "special_functions": list(scan.special_functions),
         }
 
-        # Check for escaped parentheses
-        if "\\(" in text or "\\)" in text:
-            analysis["has_escaped_parens"] = True
-
-        # Count BREAK operations - must be BREAK on its own (not "breaking" or "rebreak")
-        # Uses word boundaries and checks context
-        # Use lookbehind to avoid consuming whitespace and allow overlapping matches
-        break_pattern = r"(?:^|(?<=\s))BREAK(?=\s|$|[,;:])"
-        break_matches = re.findall(break_pattern, text, re.IGNORECASE | re.MULTILINE)
-        analysis["break_count"] = len(break_matches)
-
-        # Detect special functions
-        # Functions can have optional parentheses: "TE()" or just "TE" alone as keyword
-        special_functions = [
-            "TE",
-            "CAT",
-            "AVG",
-            "AND",
-            "STYLE",
-            "SDXL",
-            "SHUFFLE",
-            "SHIFT",
-            "CUT",
-        ]
-        for func in special_functions:
-            # Match function name followed by either ( or whitespace/punctuation/end
-            pattern = rf"(?:^|\s|[,;(]){func}(?:\s*\(|(?:\s|$|[,;)]))"
-            if re.search(pattern, text, re.IGNORECASE):
-                analysis["special_functions"].append(func)
-
         # First escape important characters
         cleaned = cls._escape_important(text)
 
@@ -232,7 +350,9 @@ class FensTokenCounter(io.ComfyNode):
         return cleaned, analysis
 
     @classmethod
-    def _count_stream_prompt_tokens(cls, stream_batches: list[list[Any]]) -> int:
+    def _count_stream_prompt_tokens(
+        cls, stream_batches: TokenStream | list[list[Any]]
+    ) -> int:
         """
         Count non-special tokens in a stream batch.
 
@@ -240,26 +360,14 @@ class FensTokenCounter(io.ComfyNode):
         We count entries with positive word_id to filter out special tokens
         like start/end/padding tokens (which have word_id <= 0).
         """
-        total = 0
-        for batch in stream_batches:
-            for token_item in batch:
-                if (
-                    isinstance(token_item, (tuple, list))
-                    and len(token_item) >= cls.EXPECTED_TOKEN_COUNT
-                ):
-                    word_id = token_item[2]
-                    if isinstance(word_id, int) and word_id > 0:
-                        total += 1
-                elif isinstance(token_item, int):
-                    total += 1
-                else:
-                    total += 1
-        return total
+        return summarize_stream(stream_batches).prompt_tokens
 
     @classmethod
-    def _stream_context_limit_tokens(cls, stream_batches: list[list[Any]]) -> int:
+    def _stream_context_limit_tokens(
+        cls, stream_batches: TokenStream | list[list[Any]]
+    ) -> int:
         """Count total tokens (including padding/special) in all batches."""
-        return sum(len(batch) for batch in stream_batches)
+        return summarize_stream(stream_batches).context_limit_tokens
 
     @classmethod
     def _resolve_sub_tokenizer(cls, clip: Any, stream_name: str) -> Any | None:
@@ -293,9 +401,17 @@ class FensTokenCounter(io.ComfyNode):
         (e.g. unsupported tokenizer object, or the id isn't an int - it
         could be a raw embedding tensor for custom/textual-inversion
         embeddings, which has no vocab entry).
+
+        Goes through the cached dense decode table first, so after the
+        table is built a decode is a single list index.
         """
         if sub_tokenizer is None or not isinstance(token_id, int):
             return None
+        table = get_decode_table(sub_tokenizer)
+        if table is not None and 0 <= token_id < len(table):
+            token_str = table[token_id]
+            if token_str is not None:
+                return token_str
         inv_vocab = getattr(sub_tokenizer, "inv_vocab", None)
         if inv_vocab is not None:
             token_str = inv_vocab.get(token_id)
@@ -309,48 +425,322 @@ class FensTokenCounter(io.ComfyNode):
                 return None
         return None
 
+    @classmethod
+    def _token_decoder(cls, sub_tokenizer: Any) -> Callable[[Any], str | None]:
+        """
+        Decode function for one sub-tokenizer that resolves the decode table
+        once, for decoding many tokens (see _decode_token_id).
+        """
+        table = get_decode_table(sub_tokenizer) or ()
+
+        def decode(token_id: Any) -> str | None:
+            if isinstance(token_id, int) and 0 <= token_id < len(table):
+                token_str = table[token_id]
+                if token_str is not None:
+                    return token_str
+            return cls._decode_token_id(sub_tokenizer, token_id)
+
+        return decode
+
+    @classmethod
+    def _unpack_token_item(cls, token_item: Any) -> tuple[Any, Any, Any]:
+        """Split a token entry into (token_id, weight, word_id), tolerating bare ids."""
+        if (
+            isinstance(token_item, (tuple, list))
+            and len(token_item) >= cls.EXPECTED_TOKEN_COUNT
+        ):
+            return token_item[0], token_item[1], token_item[2]
+        if (
+            isinstance(token_item, (tuple, list))
+            and len(token_item) >= cls.MIN_TOKEN_WEIGHT_TUPLE_LEN
+        ):
+            return token_item[0], token_item[1], None
+        return token_item, 1.0, None
+
+    @classmethod
+    def _token_breakdown_rows(
+        cls,
+        clip: Any,
+        token_streams: dict[str, TokenStream],
+        offset: int = 0,
+        limit: int = 0,
+    ) -> dict[str, tuple[int, list[tuple[int, Any, str | None, Any, Any]]]]:
+        """
+        Collect the breakdown window for every stream.
+
+        Special/padding tokens are skipped; offset/limit then select a window
+        of the remaining tokens (limit 0 = no cap). Only tokens inside the
+        window are read from the stream's columns and decoded, so showing a
+        small window of a huge stream stays cheap.
+
+        Returns:
+            {stream_name: (visible_token_total, rows)} where each row is
+            (slot_position, token_id, decoded_text, weight, word_id).
+        """
+        breakdown = {}
+        for stream_name, stream_batches in token_streams.items():
+            stream = as_token_stream(stream_batches)
+            positions = visible_positions(stream)
+            end = offset + limit if limit > 0 else len(positions)
+            window = positions[offset:end]
+            sub_tokenizer = cls._resolve_sub_tokenizer(clip, stream_name)
+            table = get_decode_table(sub_tokenizer) or ()
+            rows = []
+            columns = zip(
+                stream.token_ids[window].tolist(),
+                stream.weights[window].tolist(),
+                stream.word_ids[window].tolist(),
+                strict=True,
+            )
+            for position, entry in zip(window.tolist(), columns, strict=True):
+                # Entries the columns cannot hold keep their original object
+                token_id, weight, word_id = cls._unpack_token_item(
+                    stream.objects.get(position, entry)
+                )
+                decoded = (
+                    table[token_id]
+                    if isinstance(token_id, int) and 0 <= token_id < len(table)
+                    else None
+                )
+                if decoded is None:
+                    decoded = cls._decode_token_id(sub_tokenizer, token_id)
+                rows.append((position, token_id, decoded, weight, word_id))
+            breakdown[stream_name] = (len(positions), rows)
+        return breakdown
+
+    @classmethod
+    def _format_token_breakdown(
+        cls,
+        breakdown: dict[str, tuple[int, list[tuple[int, Any, str | None, Any, Any]]]],
+        offset: int = 0,
+    ) -> str:
+        """Render breakdown rows as text, summarising tokens outside the window."""
+        lines = []
+        for stream_name, (total, rows) in breakdown.items():
+            lines.append(f"[{stream_name}]")
+            skipped_before = min(offset, total)
+            if skipped_before:
+                lines.append(f"  … {skipped_before} earlier")
+            for position, token_id, decoded, weight, word_id in rows:
+                decoded_str = repr(decoded) if decoded is not None else "?"
+                lines.append(
+                    f"  [{position}] id={token_id} text={decoded_str} weight={weight} word_id={word_id}"
+                )
+            remaining = total - skipped_before - len(rows)
+            if remaining > 0:
+                lines.append(f"  … {remaining} more")
+        return "\n".join(lines)
+
+    @classmethod
+    def _token_breakdown_json(
+        cls,
+        breakdown: dict[str, tuple[int, list[tuple[int, Any, str | None, Any, Any]]]],
+        offset: int = 0,
+        limit: int = 0,
+    ) -> str:
+        """
+        Render breakdown rows as compact columnar JSON:
+        {"offset", "limit", "streams": {name: {"total", "positions", "ids",
+        "text", "weights", "word_ids"}}}. Values that are not plain JSON
+        scalars (e.g. embedding tensors used as token ids) become null.
+        """
+
+        def scalar(value: Any) -> Any:
+            return value if isinstance(value, (int, float, str)) else None
+
+        streams = {}
+        for stream_name, (total, rows) in breakdown.items():
+            streams[stream_name] = {
+                "total": total,
+                "positions": [row[0] for row in rows],
+                "ids": [scalar(row[1]) for row in rows],
+                "text": [row[2] for row in rows],
+                "weights": [scalar(row[3]) for row in rows],
+                "word_ids": [scalar(row[4]) for row in rows],
+            }
+        return json.dumps(
+            {"offset": offset, "limit": limit, "streams": streams},
+            separators=(",", ":"),
+        )
+
     @classmethod
     def _build_token_breakdown(
-        cls, clip: Any, token_streams: dict[str, list[list[Any]]]
+        cls,
+        clip: Any,
+        token_streams: dict[str, TokenStream],
+        offset: int = 0,
+        limit: int = 0,
     ) -> str:
         """
         Build a human-readable per-token breakdown for every stream: each
         real (non-padding) token's id, decoded text, weight, and word id.
         """
-        lines = []
+        breakdown = cls._token_breakdown_rows(clip, token_streams, offset, limit)
+        return cls._format_token_breakdown(breakdown, offset)
+
+    @classmethod
+    def _weight_attribution(
+        cls,
+        clip: Any,
+        text: str,
+        break_count: int,
+        token_streams: dict[str, TokenStream],
+    ) -> dict[str, Any]:
+        """
+        Attribute typed tokens to the weighted spans and phrases of a prompt
+        for every stream. The weight syntax is parsed once (and cached) and
+        the already tokenized streams are reused, so no extra tokenizer
+        calls are made.
+
+        Returns:
+            {"spans": [...], "groups": [...], "streams": {name: {"buckets",
+            "span_tokens", "group_tokens", "unattributed",
+            "weights_disabled"}}} with character offsets into text and
+            bucket keys formatted like "1.1".
+        """
+        layout = build_layout(text, break_count)
+        streams = {}
         for stream_name, stream_batches in token_streams.items():
-            sub_tokenizer = cls._resolve_sub_tokenizer(clip, stream_name)
-            lines.append(f"[{stream_name}]")
-            position = 0
-            for batch in stream_batches:
-                for token_item in batch:
-                    if (
-                        isinstance(token_item, (tuple, list))
-                        and len(token_item) >= cls.EXPECTED_TOKEN_COUNT
-                    ):
-                        token_id, weight, word_id = (
-                            token_item[0],
-                            token_item[1],
-                            token_item[2],
-                        )
-                    elif (
-                        isinstance(token_item, (tuple, list))
-                        and len(token_item) >= cls.MIN_TOKEN_WEIGHT_TUPLE_LEN
-                    ):
-                        token_id, weight, word_id = token_item[0], token_item[1], None
-                    else:
-                        token_id, weight, word_id = token_item, 1.0, None
-
-                    if isinstance(word_id, int) and word_id <= 0:
-                        position += 1
-                        continue  # skip special/padding tokens in the breakdown
+            attribution = attribute_stream(
+                text,
+                as_token_stream(stream_batches),
+                layout,
+                cls._resolve_sub_tokenizer(clip, stream_name),
+            )
+            attribution["buckets"] = {
+                f"{weight:g}": tokens
+                for weight, tokens in attribution["buckets"].items()
+            }
+            streams[stream_name] = attribution
+        return {
+            "spans": [span._asdict() for span in layout.spans],
+            "groups": [group._asdict() for group in layout.groups],
+            "streams": streams,
+        }
 
-                    decoded = cls._decode_token_id(sub_tokenizer, token_id)
-                    decoded_str = repr(decoded) if decoded is not None else "?"
-                    lines.append(
-                        f"  [{position}] id={token_id} text={decoded_str} weight={weight} word_id={word_id}"
+    @classmethod
+    def _format_weight_attribution(cls, attribution: dict[str, Any], text: str) -> str:
+        """Render tokens per weight bucket and per weighted phrase as text."""
+        groups = attribution["groups"]
+        lines = []
+        for stream_name, stream in attribution["streams"].items():
+            total = sum(stream["buckets"].values())
+            buckets = ", ".join(
+                f"{weight}: {tokens} ({tokens / total:.0%})"
+                for weight, tokens in stream["buckets"].items()
+            )
+            lines.append(f"[{stream_name}] tokens per weight: {buckets or 'none'}")
+            if stream["weights_disabled"]:
+                lines.append("  (this tokenizer ignores weight syntax)")
+                continue
+            for group, tokens in list(zip(groups, stream["group_tokens"], strict=True))[
+                : cls.MAX_WEIGHT_GROUP_LINES
+            ]:
+                phrase = cls._shorten(text[group["start"] : group["end"]])
+                indent = "  " * group["depth"]
+                lines.append(
+                    f"{indent}{phrase!r} @{group['start']} x{group['weight']:g}: {tokens} tokens"
+                )
+            if len(groups) > cls.MAX_WEIGHT_GROUP_LINES:
+                lines.append(
+                    f"  … {len(groups) - cls.MAX_WEIGHT_GROUP_LINES} more phrases"
+                )
+            if stream["unattributed"]:
+                lines.append(f"  {stream['unattributed']} tokens not attributed")
+        return "\n".join(lines)
+
+    @classmethod
+    def _shorten(cls, phrase: str) -> str:
+        """Shorten a prompt excerpt for Details."""
+        if len(phrase) > cls.MAX_PHRASE_CHARS:
+            return phrase[: cls.MAX_PHRASE_CHARS - 1] + "…"
+        return phrase
+
+    @classmethod
+    def _format_source_counts(cls, counts: dict[str, Any]) -> str:
+        """Render tokens per prompt line and the largest tags as text."""
+        lines = []
+        for stream_name, stream in counts["streams"].items():
+            lines.append(
+                f"[{stream_name}] {len(counts['lines'])} lines, {len(counts['tags'])} tags"
+            )
+            listed = [
+                (line, tokens)
+                for line, tokens in zip(counts["lines"], stream["lines"], strict=True)
+                if line["text"].strip()
+            ]
+            for line, tokens in listed[: cls.MAX_SOURCE_LINES]:
+                lines.append(
+                    f"  line {line['line']}: {tokens} tokens {cls._shorten(line['text'].strip())!r}"
+                )
+            if len(listed) > cls.MAX_SOURCE_LINES:
+                lines.append(f"  … {len(listed) - cls.MAX_SOURCE_LINES} more lines")
+            largest = sorted(
+                zip(counts["tags"], stream["tags"], strict=True),
+                key=lambda tag_tokens: -tag_tokens[1],
+            )[: cls.TOP_TAG_COUNT]
+            if largest:
+                tags = ", ".join(
+                    f"{cls._shorten(tag['text'])!r}: {tokens}"
+                    for tag, tokens in largest
+                )
+                lines.append(f"  largest tags: {tags}")
+            if stream["unplaced"]:
+                lines.append(f"  {stream['unplaced']} tokens not placed")
+        return "\n".join(lines)
+
+    @classmethod
+    def _limited(cls, items: list[str], noun: str) -> list[str]:
+        """The first MAX_CHUNK_LINES items, plus a line counting the rest."""
+        if len(items) <= cls.MAX_CHUNK_LINES:
+            return items
+        hidden = len(items) - cls.MAX_CHUNK_LINES
+        return [*items[: cls.MAX_CHUNK_LINES], f"  … {hidden} more {noun}"]
+
+    @classmethod
+    def _format_chunk_report(cls, report: dict[str, Any], text: str) -> str:
+        """Render chunk padding, boundary splits and BREAK suggestions as text."""
+        lines = []
+        for stream_name, stream in report["streams"].items():
+            if stream.get("unbounded"):
+                lines.append(f"[{stream_name}] no fixed chunks")
+                continue
+            lines.append(
+                f"[{stream_name}] {stream['capacity']} tokens per chunk, "
+                f"{len(stream['chunks'])} chunks, {stream['padding']} padding slots "
+                f"({stream['avoidable_padding']} before a chunk boundary)"
+            )
+            chunks = [
+                f"  chunk {index} (segment {chunk['segment']}): {chunk['tokens']} tokens, {chunk['padding']} padding"
+                for index, chunk in enumerate(stream["chunks"], start=1)
+            ]
+            splits = [
+                f"  split after chunk {split['after_chunk']} @{split['offset']}: "
+                + " in ".join(
+                    f"{kind} {cls._shorten(split[kind])!r}"
+                    for kind in ("word", "tag")
+                    if split[kind] is not None
+                    and (kind == "word" or split["tag"] != split["word"])
+                )
+                for split in stream["splits"]
+            ]
+            suggestions = []
+            for suggestion in stream["suggestions"]:
+                offset = suggestion["offset"]
+                if suggestion["action"] == "insert_break":
+                    suggestions.append(
+                        f"  suggest: BREAK before {cls._shorten(suggestion['tag'])!r} @{offset} (chunks {suggestion['chunk_delta']:+d})"
+                    )
+                else:
+                    start = max(offset - cls.BREAK_CONTEXT_CHARS, 0)
+                    end = offset + len("BREAK") + cls.BREAK_CONTEXT_CHARS
+                    context = text[start:end]
+                    suggestions.append(
+                        f"  suggest: remove BREAK @{offset} {context!r} (chunks {suggestion['chunk_delta']:+d})"
                     )
-                    position += 1
+            lines.extend(cls._limited(chunks, "chunks"))
+            lines.extend(cls._limited(splits, "splits"))
+            lines.extend(cls._limited(suggestions, "suggestions"))
         return "\n".join(lines)
 
     @classmethod
@@ -362,16 +752,35 @@ class FensTokenCounter(io.ComfyNode):
         Returns:
             List of text segments split at BREAK boundaries.
         """
-        # Split on BREAK with word boundaries
-        break_pattern = r"(?:^|\s)BREAK(?=\s|$|[,;:])"
-        segments = re.split(break_pattern, text, flags=re.IGNORECASE | re.MULTILINE)
-        # Filter out empty segments
-        return [seg.strip() for seg in segments if seg.strip()]
+        return split_on_break(text)
+
+    @classmethod
+    def _tokenize_segment(
+        cls, clip: Any, segment: str, fingerprint: str | None = None
+    ) -> Any:
+        """
+        Tokenize a single BREAK segment, reusing the per-segment cache when a
+        tokenizer fingerprint is given. Unchanged segments of an edited
+        prompt are then served from the cache and only edited, inserted or
+        removed segments reach the tokenizer.
+        """
+        if fingerprint is None:
+            return clip.tokenize(segment, return_word_ids=True)
+        key = (fingerprint, segment)
+        cached = SEGMENT_CACHE.get(key)
+        if cached is not None:
+            return cached
+        segment_streams = clip.tokenize(segment, return_word_ids=True)
+        if isinstance(segment_streams, dict) and segment_streams:
+            SEGMENT_CACHE.put(
+                key, segment_streams, estimate_streams_bytes(segment_streams)
+            )
+        return segment_streams
 
     @classmethod
     def _tokenize_break_segments(
-        cls, clip: Any, segments: list[str]
-    ) -> dict[str, list[list[Any]]]:
+        cls, clip: Any, segments: list[str], fingerprint: str | None = None
+    ) -> dict[str, TokenStream]:
         """
         Tokenize each BREAK-separated segment independently and merge the
         resulting batches per stream, mirroring how BREAK is actually
@@ -387,24 +796,558 @@ class FensTokenCounter(io.ComfyNode):
         since that's what they actually produce - no per-architecture
         special-casing required.
 
+        When a tokenizer fingerprint is given, segments are tokenized
+        incrementally through the per-segment cache (see _tokenize_segment).
+
+        The merged batches are converted to compact TokenStreams once, after
+        merging; converting each (often tiny) segment separately would cost
+        more in per-call overhead than it saves.
+
         Returns:
-            Merged dict of {stream_name: [batch, batch, ...]} across all segments.
+            Merged dict of {stream_name: TokenStream} across all segments,
+            holding the segments' batches in order and recording how many
+            batches each segment contributed.
         """
         merged: dict[str, list[list[Any]]] = {}
-        for segment in segments:
+        segment_batches: dict[str, list[int]] = {}
+        for index, segment in enumerate(segments):
             if not segment:
                 continue
-            segment_streams = clip.tokenize(segment, return_word_ids=True)
+            segment_streams = cls._tokenize_segment(clip, segment, fingerprint)
             if not isinstance(segment_streams, dict):
                 continue
             for stream_name, batches in segment_streams.items():
                 merged.setdefault(stream_name, []).extend(batches)
-        return merged
+                if stream_name not in segment_batches:
+                    segment_batches[stream_name] = [0] * len(segments)
+                segment_batches[stream_name][index] = len(batches)
+        return compact_streams(merged, segment_batches)
+
+    @classmethod
+    def _tokenize_prompt(
+        cls,
+        clip: Any,
+        cleaned_text: str,
+        break_count: int,
+        fingerprint: str | None = None,
+    ) -> dict[str, TokenStream]:
+        """
+        Tokenize a preprocessed prompt into {stream_name: TokenStream}.
+
+        With BREAK present, each segment is tokenized independently so
+        chunking/padding reflects what the tokenizer actually does per
+        segment, rather than guessing at a fixed-window size. Passing a
+        tokenizer fingerprint enables per-segment cache reuse.
+        """
+        if break_count > 0:
+            segments = cls._split_on_break(cleaned_text)
+            return cls._tokenize_break_segments(clip, segments, fingerprint)
+        return compact_streams(clip.tokenize(cleaned_text, return_word_ids=True))
+
+    @classmethod
+    def _tokenize_prompt_cached(
+        cls, clip: Any, cleaned_text: str, break_count: int
+    ) -> tuple[dict[str, TokenStream], bool]:
+        """
+        Tokenize through the shared LRU cache, keyed by the tokenizer stack
+        fingerprint plus the preprocessed prompt text.
+
+        Cached results are shared between runs, so callers must treat the
+        returned streams as read-only.
+
+        Returns:
+            Tuple of (token_streams, cache_hit)
+        """
+        fingerprint = tokenizer_fingerprint(clip)
+        key = (fingerprint, cleaned_text)
+        cached = TOKENIZE_CACHE.get(key)
+        if cached is not None:
+            return cached, True
+        token_streams = cls._tokenize_prompt(
+            clip, cleaned_text, break_count, fingerprint
+        )
+        if isinstance(token_streams, dict) and token_streams:
+            TOKENIZE_CACHE.put(
+                key, token_streams, estimate_streams_bytes(token_streams)
+            )
+        return token_streams, False
+
+    @classmethod
+    def _limit_offset(
+        cls,
+        clip: Any,
+        piece: str,
+        token_streams: dict[str, TokenStream],
+        counted: dict[str, int],
+        *,
+        limit: int,
+        count_strategy: str,
+    ) -> int:
+        """
+        Character offset in piece of the token that takes the count over
+        limit, given the tokens each stream counted before the piece.
+        """
+        inputs = cls._offset_inputs(clip, token_streams)
+        layout = build_layout(piece, 0)
+        offsets = {
+            name: token_offsets(
+                piece,
+                piece,
+                layout,
+                stream,
+                sub_tokenizer=inputs["sub_tokenizers"][name],
+                decode=inputs["decoders"][name],
+            )
+            for name, stream in inputs["streams"].items()
+        }
+        return limit_offset(
+            offsets, counted, limit, sum_streams=count_strategy == "sum_streams"
+        )
+
+    @classmethod
+    def _count_until_limit(
+        cls,
+        clip: Any,
+        cleaned_text: str,
+        break_count: int,
+        limit: int,
+        count_strategy: str = "max_stream",
+    ) -> LimitScan:
+        """
+        Count a preprocessed prompt piece by piece, stopping as soon as the
+        count goes over limit.
+
+        Pieces end at whitespace outside weight groups, within BREAK
+        segments, so they parse and tokenize as they would in the whole
+        prompt. Typed-token counts add up exactly for tokenizers that
+        tokenize words independently (CLIP BPE, ComfyUI's word-split
+        tokenizers). Only one piece's tokens are held at a time and the
+        cache is bypassed, so memory stays bounded for any prompt size.
+        """
+        segments = (
+            split_on_break_spans(cleaned_text)
+            if break_count > 0
+            else [(0, len(cleaned_text))]
+        )
+        first_chars = min(
+            max(limit * cls.PIECE_CHARS_PER_TOKEN, cls.MIN_PIECE_CHARS),
+            cls.MAX_PIECE_CHARS,
+        )
+        totals: dict[str, int] = {}
+        pieces = 0
+        piece_streams = None
+        for seg_start, seg_end in segments:
+            for start, end in piece_spans(
+                cleaned_text, seg_start, seg_end, first_chars, cls.MAX_PIECE_CHARS
+            ):
+                piece = cleaned_text[start:end]
+                piece_streams = compact_streams(
+                    clip.tokenize(piece, return_word_ids=True)
+                )
+                pieces += 1
+                if not isinstance(piece_streams, dict) or not piece_streams:
+                    continue
+                counted = dict(totals)
+                for name, stream in piece_streams.items():
+                    totals[name] = (
+                        totals.get(name, 0) + summarize_stream(stream).prompt_tokens
+                    )
+                token_count = (
+                    sum(totals.values())
+                    if count_strategy == "sum_streams"
+                    else max(totals.values())
+                )
+                if token_count > limit:
+                    offset = cls._limit_offset(
+                        clip,
+                        piece,
+                        piece_streams,
+                        counted,
+                        limit=limit,
+                        count_strategy=count_strategy,
+                    )
+                    return LimitScan(
+                        True, token_count, start + max(offset, 0), pieces, None
+                    )
+        whole = pieces == 1 and break_count == 0 and isinstance(piece_streams, dict)
+        token_count = (
+            sum(totals.values())
+            if count_strategy == "sum_streams"
+            else max(totals.values(), default=0)
+        )
+        return LimitScan(
+            False, token_count, -1, pieces, piece_streams if whole else None
+        )
+
+    @classmethod
+    def _stopped_outputs(
+        cls,
+        text: str,
+        analysis: dict[str, Any],
+        scan: LimitScan,
+        *,
+        limit: int,
+        count_strategy: str,
+        timer: PhaseTimer,
+        show_timings: bool,
+    ) -> tuple[int, int, int, str, str, str, str, None, str, str, str, str]:
+        """
+        Outputs of a run stopped at the limit. Details report the character
+        of the prompt as typed where the count went over; context limit
+        and chunk count are not known and are 0.
+        """
+        offset = scan.offset
+        if analysis["has_escaped_parens"]:
+            # Unescaping at most halves the text, so a prefix is enough.
+            offset = unescape_offsets(text[: 2 * offset + 2])[offset]
+        details_parts = [
+            f"Prompt tokens: {scan.token_count}+ (stopped early)",
+            f"Over limit {limit} at char {offset}",
+            f"Pieces tokenized: {scan.pieces}",
+            f"Strategy: {count_strategy}",
+        ]
+        if analysis["break_count"] > 0:
+            details_parts.append(f"BREAK ops: {analysis['break_count']}")
+        timer.finish()
+        details = cls._compose_details(
+            details_parts, timer.format() if show_timings else "", {}
+        )
+        return (
+            scan.token_count,
+            0,
+            0,
+            details,
+            text,
+            "{}",
+            "{}",
+            None,
+            "{}",
+            "{}",
+            "{}",
+            "{}",
+        )
+
+    @classmethod
+    def _tokenize_for_count(
+        cls,
+        clip: Any,
+        cleaned_text: str,
+        break_count: int,
+        *,
+        use_cache: bool,
+        stop_after_tokens: int,
+        count_strategy: str,
+    ) -> tuple[dict[str, TokenStream] | None, bool, LimitScan | None]:
+        """
+        Tokenize for a full count, after a limit scan when stop_after_tokens
+        is set. A scan that goes over the limit ends the run; one that
+        tokenized the whole prompt in one piece is reused.
+
+        Returns:
+            Tuple of (token_streams, cache_hit, limit_scan); token_streams is
+            None when the scan went over the limit
+        """
+        limit_scan = None
+        if stop_after_tokens > 0:
+            limit_scan = cls._count_until_limit(
+                clip, cleaned_text, break_count, stop_after_tokens, count_strategy
+            )
+            if limit_scan.over_limit:
+                return None, False, limit_scan
+            if limit_scan.token_streams is not None:
+                return limit_scan.token_streams, False, limit_scan
+        if use_cache:
+            token_streams, cache_hit = cls._tokenize_prompt_cached(
+                clip, cleaned_text, break_count
+            )
+            return token_streams, cache_hit, limit_scan
+        return cls._tokenize_prompt(clip, cleaned_text, break_count), False, limit_scan
+
+    @classmethod
+    def _composition_report(
+        cls,
+        clip: Any,
+        composition: Composition,
+        *,
+        count_strategy: str,
+        use_cache: bool,
+    ) -> dict[str, Any]:
+        """
+        Count every sub-prompt on its own, tokenizing each distinct text once
+        and distinct texts concurrently.
+
+        Encoder passes are the chunks of every sub-prompt (per text encoder,
+        as for the chunk count); identical sub-prompts still need their own
+        passes unless the encoder caches them, so both figures are given.
+        """
+        unique = list(dict.fromkeys(part.text for part in composition.sub_prompts))
+        counts = dict(
+            zip(
+                unique,
+                map_prompts(
+                    functools.partial(
+                        cls._count_prompt,
+                        clip,
+                        count_strategy=count_strategy,
+                        use_cache=use_cache,
+                    ),
+                    unique,
+                ),
+                strict=True,
+            )
+        )
+        first_index: dict[str, int] = {}
+        sub_prompts = []
+        for index, part in enumerate(composition.sub_prompts):
+            tokens, context_limit, chunks = counts[part.text]
+            sub_prompts.append(
+                {
+                    **part._asdict(),
+                    "tokens": tokens,
+                    "context_limit": context_limit,
+                    "chunks": chunks,
+                    "same_as": first_index.get(part.text),
+                }
+            )
+            first_index.setdefault(part.text, index)
+        return {
+            "sub_prompts": sub_prompts,
+            "directives": list(composition.directives),
+            "unique": len(unique),
+            "encoder_passes": sum(part["chunks"] for part in sub_prompts),
+            "unique_encoder_passes": sum(chunks for _, _, chunks in counts.values()),
+        }
+
+    @classmethod
+    def _format_composition(cls, report: dict[str, Any]) -> str:
+        """Details section listing each sub-prompt with its count."""
+        lines = []
+        for index, part in enumerate(report["sub_prompts"]):
+            if not part["join"]:
+                label = f"AND {part['group'] + 1}"
+                if part["weight"] != 1.0:
+                    label = f"{label} x{part['weight']:g}"
+            elif part["join"] == "AVG":
+                label = f"AVG {part['weight']:g}"
+            else:
+                label = part["join"]
+            line = (
+                f"  #{index + 1} {label} '{cls._shorten(part['text'])}': "
+                f"{part['tokens']} tokens, {part['chunks']} chunks"
+            )
+            if part["same_as"] is not None:
+                line = f"{line} (same as #{part['same_as'] + 1})"
+            lines.append(line)
+        lines = cls._limited(lines, "sub-prompts")
+        if report["directives"]:
+            directives = ", ".join(cls._shorten(d) for d in report["directives"])
+            lines.append(f"  directives: {directives}")
+        return "\n".join(lines)
+
+    @classmethod
+    def _composition_outputs(
+        cls,
+        clip: Any,
+        text: str,
+        composition: Composition,
+        *,
+        count_strategy: str,
+        use_cache: bool,
+        timer: PhaseTimer,
+        show_timings: bool,
+    ) -> tuple[int, int, int, str, str, str, str, None, str, str, str, str]:
+        """
+        Outputs of a composed prompt: total tokens over all sub-prompts, the
+        largest sub-prompt context limit, and encoder passes as the chunk
+        count. The other outputs describe a single encoded prompt, which a
+        composition is not, so they are empty.
+        """
+        with timer.phase("tokenize"):
+            report = cls._composition_report(
+                clip, composition, count_strategy=count_strategy, use_cache=use_cache
+            )
+        parts = report["sub_prompts"]
+        token_count = sum(part["tokens"] for part in parts)
+        context_limit = max(part["context_limit"] for part in parts)
+        details_parts = [
+            f"Prompt tokens: {token_count}",
+            f"Context limit: {context_limit}",
+            f"Chunks: {report['encoder_passes']}",
+            f"Strategy: {count_strategy}",
+            f"Sub-prompts: {len(parts)} ({report['unique']} unique)",
+            f"Encoder passes: {report['encoder_passes']} "
+            f"({report['unique_encoder_passes']} unique)",
+        ]
+        timer.finish()
+        details = cls._compose_details(
+            details_parts,
+            timer.format() if show_timings else "",
+            {"Composition": cls._format_composition(report)},
+        )
+        return (
+            token_count,
+            context_limit,
+            report["encoder_passes"],
+            details,
+            text,
+            "{}",
+            "{}",
+            None,
+            "{}",
+            "{}",
+            json.dumps(report, separators=(",", ":")),
+            "{}",
+        )
+
+    @classmethod
+    def _calibrate_estimator(cls, clip: Any) -> dict[str, StreamModel]:
+        """
+        Fit the estimator's stream models by tokenizing each distinct piece
+        of the calibration corpus on its own (once per tokenizer stack).
+        """
+        piece_counts: dict[str, dict[str, int]] = {}
+        windows: dict[str, dict[str, Any]] = {}
+        for piece in sorted(set(pretokenize(CALIBRATION_TEXT))):
+            token_streams = compact_streams(clip.tokenize(piece, return_word_ids=True))
+            if not isinstance(token_streams, dict):
+                continue
+            for stream_name, stream in token_streams.items():
+                counts = piece_counts.setdefault(stream_name, {})
+                counts[piece] = summarize_stream(stream).prompt_tokens
+                if stream_name not in windows:
+                    windows[stream_name] = stream_window(
+                        stream, cls._resolve_sub_tokenizer(clip, stream_name)
+                    )
+        return {
+            stream_name: build_stream_model(counts, windows[stream_name])
+            for stream_name, counts in piece_counts.items()
+        }
+
+    @classmethod
+    def _estimate_report(
+        cls, clip: Any, text: str, count_strategy: str
+    ) -> dict[str, Any]:
+        """
+        Estimate of every stream plus the figures combined as count_strategy
+        combines exact counts. "exact" is set when some stream's interval
+        crosses a chunk boundary, so the prompt has to be tokenized.
+        """
+        models = ESTIMATOR_STORE.models(
+            tokenizer_fingerprint(clip),
+            functools.partial(cls._calibrate_estimator, clip),
+        )
+        streams = {
+            stream_name: estimate_stream(model, text)
+            for stream_name, model in models.items()
+        }
+        report: dict[str, Any] = {
+            field: cls._combine_estimates(streams.values(), field, count_strategy)
+            for field in StreamEstimate._fields
+        }
+        report["exact"] = any(
+            item.chunks_low != item.chunks_high for item in streams.values()
+        )
+        report["streams"] = {
+            stream_name: item._asdict() for stream_name, item in streams.items()
+        }
+        return report
+
+    @classmethod
+    def _combine_estimates(
+        cls, estimates: Iterable[StreamEstimate], field: str, count_strategy: str
+    ) -> int:
+        """One estimate field over all streams, combined like exact counts."""
+        values = [getattr(estimate, field) for estimate in estimates]
+        if not values:
+            return 0
+        return sum(values) if count_strategy == "sum_streams" else max(values)
+
+    @classmethod
+    def _estimate_part(cls, report: dict[str, Any]) -> str:
+        """Details field for an estimate that was replaced by an exact count."""
+        return (
+            f"Estimate: ~{report['tokens']} ({report['low']}-{report['high']}) "
+            "crosses a chunk boundary, counted exactly"
+        )
+
+    @classmethod
+    def _json_or_empty(cls, report: dict[str, Any] | None) -> str:
+        return json.dumps(report, separators=(",", ":")) if report else "{}"
+
+    @classmethod
+    def _shortcut_outputs(
+        cls,
+        clip: Any,
+        text: str,
+        *,
+        composition: bool,
+        estimate: bool,
+        count_strategy: str,
+        use_cache: bool,
+        timer: PhaseTimer,
+        show_timings: bool,
+    ) -> tuple[tuple[Any, ...] | None, dict[str, Any] | None]:
+        """
+        Outputs of the modes that answer without a full tokenization: a
+        composed prompt, or an estimate whose interval stays within its
+        chunk count.
+
+        Returns:
+            Tuple of (outputs or None to count exactly, estimate report or
+            None when no estimate was made)
+        """
+        composed = split_composition(text) if composition else None
+        if composed is not None and (
+            len(composed.sub_prompts) > 1 or composed.directives
+        ):
+            outputs = cls._composition_outputs(
+                clip,
+                text,
+                composed,
+                count_strategy=count_strategy,
+                use_cache=use_cache,
+                timer=timer,
+                show_timings=show_timings,
+            )
+            return outputs, None
+        if not estimate:
+            return None, None
+        with timer.phase("estimate"):
+            report = cls._estimate_report(clip, text, count_strategy)
+        if report["exact"]:
+            return None, report
+        details_parts = [
+            f"Prompt tokens: ~{report['tokens']} "
+            f"(95%: {report['low']}-{report['high']})",
+            f"Context limit: {report['context_limit']}",
+            f"Chunks: {report['chunks']}",
+            f"Strategy: {count_strategy}",
+            "Estimated without tokenizing",
+        ]
+        timer.finish()
+        details = cls._compose_details(
+            details_parts, timer.format() if show_timings else "", {}
+        )
+        outputs = (
+            report["tokens"],
+            report["context_limit"],
+            report["chunks"],
+            details,
+            text,
+            "{}",
+            "{}",
+            None,
+            "{}",
+            "{}",
+            "{}",
+            cls._json_or_empty(report),
+        )
+        return outputs, report
 
     @classmethod
     def _process_token_counts(
         cls,
-        token_streams: dict[str, list[list[Any]]],
+        token_streams: dict[str, TokenStream],
         count_strategy: str,
     ) -> tuple[int, int, int]:
         """
@@ -413,17 +1356,15 @@ class FensTokenCounter(io.ComfyNode):
         Returns:
             Tuple of (token_count, context_limit_tokens, chunk_count)
         """
-        prompt_counts = [
-            cls._count_stream_prompt_tokens(stream_batches)
+        # All three figures come from vectorized reductions over each
+        # stream's compact columns (raw batches are converted on the fly).
+        summaries = [
+            summarize_stream(stream_batches)
             for stream_batches in token_streams.values()
         ]
-        context_limits = [
-            cls._stream_context_limit_tokens(stream_batches)
-            for stream_batches in token_streams.values()
-        ]
-        chunk_counts = [
-            len(stream_batches) for stream_batches in token_streams.values()
-        ]
+        prompt_counts = [summary.prompt_tokens for summary in summaries]
+        context_limits = [summary.context_limit_tokens for summary in summaries]
+        chunk_counts = [summary.chunk_count for summary in summaries]
 
         if count_strategy == "sum_streams":
             token_count = sum(prompt_counts)
@@ -442,97 +1383,551 @@ class FensTokenCounter(io.ComfyNode):
         return token_count, context_limit_tokens, chunk_count
 
     @classmethod
-    @override
-    def execute(
+    def _count_prompt(
         cls,
         clip: Any,
-        text: str | None = None,
+        text: str,
+        count_strategy: str = "max_stream",
+        use_cache: bool = True,
+    ) -> tuple[int, int, int]:
+        """
+        Count a single prompt without building any Details text.
+
+        Returns:
+            Tuple of (token_count, context_limit_tokens, chunk_count), all 0
+            for empty text or when the tokenizer returns no streams.
+        """
+        if not text or not text.strip():
+            return 0, 0, 0
+        cleaned_text, analysis = cls._preprocess_prompt(text)
+        if use_cache:
+            token_streams, _ = cls._tokenize_prompt_cached(
+                clip, cleaned_text, analysis["break_count"]
+            )
+        else:
+            token_streams = cls._tokenize_prompt(
+                clip, cleaned_text, analysis["break_count"]
+            )
+        if not isinstance(token_streams, dict) or not token_streams:
+            return 0, 0, 0
+        return cls._process_token_counts(token_streams, count_strategy)
+
+    @classmethod
+    def _summary_parts(
+        cls,
+        token_count: int,
+        context_limit_tokens: int,
+        chunk_count: int,
+        count_strategy: str,
+        analysis: dict[str, Any],
+    ) -> list[str]:
+        """Build the " | "-joined summary fields shown in the Details output."""
+        details_parts = [
+            f"Prompt tokens: {token_count}",
+            f"Context limit: {context_limit_tokens}",
+            f"Chunks: {chunk_count}",
+            f"Strategy: {count_strategy}",
+        ]
+
+        if analysis["break_count"] > 0:
+            details_parts.append(f"BREAK ops: {analysis['break_count']}")
+        if analysis["has_escaped_parens"]:
+            details_parts.append("Has escaped parens: Yes")
+        if analysis["special_functions"]:
+            func_str = ", ".join(analysis["special_functions"])
+            details_parts.append(f"Functions: {func_str}")
+        return details_parts
+
+    @classmethod
+    def _cache_parts(cls, cache_hit: bool, break_count: int) -> list[str]:
+        """Details fields reporting tokenization cache use."""
+        parts = [
+            f"Cache: {'hit' if cache_hit else 'miss'} "
+            f"({TOKENIZE_CACHE.hits} hits / {TOKENIZE_CACHE.misses} misses)"
+        ]
+        if break_count > 0:
+            parts.append(
+                f"Segment cache: {SEGMENT_CACHE.hits} hits / "
+                f"{SEGMENT_CACHE.misses} misses"
+            )
+        return parts
+
+    @classmethod
+    def _breakdown_outputs(
+        cls,
+        clip: Any,
+        token_streams: dict[str, TokenStream],
+        offset: int,
+        limit: int,
+    ) -> tuple[str, str]:
+        """The breakdown window as (Details text, columnar JSON)."""
+        rows = cls._token_breakdown_rows(clip, token_streams, offset, limit)
+        return (
+            cls._format_token_breakdown(rows, offset),
+            cls._token_breakdown_json(rows, offset, limit),
+        )
+
+    @classmethod
+    def _weight_outputs(
+        cls,
+        clip: Any,
+        cleaned_text: str,
+        break_count: int,
+        token_streams: dict[str, TokenStream],
+    ) -> tuple[str, str]:
+        """Weight attribution as (Details text, JSON)."""
+        attribution = cls._weight_attribution(
+            clip, cleaned_text, break_count, token_streams
+        )
+        return (
+            cls._format_weight_attribution(attribution, cleaned_text),
+            json.dumps(attribution, separators=(",", ":")),
+        )
+
+    @classmethod
+    def _offset_inputs(
+        cls, clip: Any, token_streams: dict[str, TokenStream]
+    ) -> dict[str, Any]:
+        """Streams, sub-tokenizers and decoders for the offset-based analyses."""
+        sub_tokenizers = {
+            name: cls._resolve_sub_tokenizer(clip, name) for name in token_streams
+        }
+        return {
+            "streams": {
+                name: as_token_stream(stream) for name, stream in token_streams.items()
+            },
+            "sub_tokenizers": sub_tokenizers,
+            "decoders": {
+                name: cls._token_decoder(sub_tokenizer)
+                for name, sub_tokenizer in sub_tokenizers.items()
+            },
+        }
+
+    @classmethod
+    def _source_outputs(
+        cls,
+        clip: Any,
+        text: str,
+        cleaned_text: str,
+        break_count: int,
+        token_streams: dict[str, TokenStream],
+    ) -> tuple[str, str]:
+        """Per-line and per-tag token counts as (Details text, JSON)."""
+        counts = source_counts(
+            text,
+            cleaned_text,
+            build_layout(cleaned_text, break_count),
+            **cls._offset_inputs(clip, token_streams),
+        )
+        return cls._format_source_counts(counts), json.dumps(
+            counts, ensure_ascii=False, separators=(",", ":")
+        )
+
+    @classmethod
+    def _chunk_outputs(
+        cls,
+        clip: Any,
+        text: str,
+        cleaned_text: str,
+        break_count: int,
+        token_streams: dict[str, TokenStream],
+    ) -> tuple[str, str]:
+        """Chunk-boundary analysis as (Details text, JSON)."""
+        report = chunk_report(
+            text,
+            cleaned_text,
+            build_layout(cleaned_text, break_count),
+            **cls._offset_inputs(clip, token_streams),
+        )
+        return cls._format_chunk_report(report, text), json.dumps(
+            report, ensure_ascii=False, separators=(",", ":")
+        )
+
+    @classmethod
+    def _pretokenized(
+        cls,
+        clip: Any,
+        text: str,
+        cleaned_text: str,
+        break_count: int,
+        token_streams: dict[str, TokenStream],
+    ) -> PretokenizedPrompt:
+        """
+        Package the counted streams for FensEncodeTokens. Preprocessing
+        unescapes \\( and \\), so when it changed the prompt the counted
+        tokens are not what the encoder should see and only the text is
+        passed on, to be tokenized again.
+        """
+        return PretokenizedPrompt(
+            text,
+            break_count,
+            tokenizer_fingerprint(clip),
+            token_streams if cleaned_text == text else None,
+        )
+
+    @classmethod
+    def _optional_section(
+        cls,
+        enabled: bool,
+        timer: PhaseTimer,
+        phase: str,
+        cancel_event: threading.Event | None,
+        build: Callable[[], tuple[str, str]],
+    ) -> tuple[str, str]:
+        """
+        Run an optional analysis as a timed phase, returning its (Details
+        text, JSON), or ("", "{}") when it is disabled.
+        """
+        if not enabled:
+            return "", "{}"
+        raise_if_cancelled(cancel_event)
+        with timer.phase(phase):
+            return build()
+
+    @classmethod
+    def _compose_details(
+        cls, details_parts: list[str], timings: str, sections: dict[str, str]
+    ) -> str:
+        """Join the summary fields, the timings line and any non-empty sections."""
+        details = " | ".join(details_parts)
+        if timings:
+            details = f"{details}\n{timings}"
+        for title, body in sections.items():
+            if body:
+                details = f"{details}\n\n{title}:\n{body}"
+        return details
+
+    @classmethod
+    def _record_timings(
+        cls, timer: PhaseTimer, show_timings: bool, metrics_export: str
+    ) -> None:
+        """
+        Add an instrumented run's phase timings to the rolling histograms and
+        export them. Runs without timings or export enabled are not recorded.
+        """
+        if not show_timings and metrics_export == "none":
+            return
+        PHASE_METRICS.record(timer.durations)
+        if metrics_export == "none":
+            return
+        try:
+            PHASE_METRICS.export(metrics_export, metrics_directory())
+        except (OSError, ValueError) as e:
+            logging.warning("FensTokenCounter: Could not export metrics. %s", e)
+
+    @classmethod
+    def _count_outputs(
+        cls,
+        clip: Any,
+        text: str | None,
+        *,
         count_strategy: str = "max_stream",
         show_token_breakdown: bool = False,
-    ) -> io.NodeOutput:
+        breakdown_offset: int = 0,
+        breakdown_limit: int = 256,
+        use_cache: bool = True,
+        concurrent_streams: bool = False,
+        show_timings: bool = False,
+        metrics_export: str = "none",
+        weight_attribution: bool = False,
+        source_counts: bool = False,
+        chunk_analysis: bool = False,
+        stop_after_tokens: int = 0,
+        composition: bool = False,
+        estimate: bool = False,
+        cancel_event: threading.Event | None = None,
+    ) -> tuple[
+        int, int, int, str, str, str, str, PretokenizedPrompt | None, str, str, str, str
+    ]:
         """
-        Count prompt tokens and context window usage for a given text and CLIP object.
+        Shared implementation behind execute, also used by the companion
+        counter nodes. Runs synchronously; when cancel_event is given it is
+        checked before each tokenizer call and before building the
+        breakdown, raising TokenizationCancelledError once set.
 
-        Features:
-        - Handles escape sequences (\\( and \\) for literal parentheses)
-        - Accounts for weight syntax ((text:weight) - weights don't add tokens)
-        - On BREAK, tokenizes each segment independently so padding/chunking
-          matches what the active tokenizer actually does per segment
-          (correct for both fixed-window encoders like CLIP and unbounded
-          encoders like Qwen3/T5/Llama-style text encoders)
-        - Supports multi-encoder models (SD1, SDXL, Flux, Anima, etc.)
-        - Shows chunk count and context window usage
-        - Optionally appends a per-token breakdown (id, decoded text,
-          weight, word id) per stream to the Details output
+        With stop_after_tokens, the prompt is first counted piece by piece
+        and the run stops as soon as the count goes over it (see
+        _count_until_limit); prompts within the limit are counted in full.
+
+        With composition, a prompt that splits into sub-prompts (see
+        split_composition) is counted per sub-prompt instead and the other
+        options do not apply.
+
+        With estimate, the count is estimated from a calibrated word-length
+        model (see token_estimator) and the prompt is only tokenized when
+        the estimate's interval crosses a chunk boundary.
+
+        With show_timings or a metrics_export format, each phase is timed,
+        recorded in the shared rolling histograms and, for an export format,
+        written to the metrics directory.
 
         Returns:
-            tuple: (total_tokens, context_limit, chunk_count, details, text_echo)
+            tuple: (total_tokens, context_limit, chunk_count, details, text_echo,
+                    token_breakdown_json, weight_attribution_json, tokens,
+                    source_counts_json, chunk_analysis_json, composition_json,
+                    estimate_json)
         """
         if clip is None:
             msg = "No CLIP input connected."
             logging.warning("FensTokenCounter: %s", msg)
-            return io.NodeOutput(0, 0, 0, msg, text or "")
+            return (0, 0, 0, msg, text or "", "{}", "{}", None, "{}", "{}", "{}", "{}")
 
         if not text or not text.strip():
             msg = "No prompt text provided."
-            return io.NodeOutput(0, 0, 0, msg, text or "")
+            return (0, 0, 0, msg, text or "", "{}", "{}", None, "{}", "{}", "{}", "{}")
 
+        timer = PhaseTimer()
         try:
             # Preprocess to detect special syntax
-            cleaned_text, analysis = cls._preprocess_prompt(text)
+            with timer.phase("preprocess"):
+                cleaned_text, analysis = cls._preprocess_prompt(text)
             break_count = analysis["break_count"]
+            tokenize_clip = (
+                ConcurrentStreamClip(clip, cls._resolve_sub_tokenizer)
+                if concurrent_streams
+                else clip
+            )
+            if cancel_event is not None:
+                tokenize_clip = CancellableClip(tokenize_clip, cancel_event)
 
-            if break_count > 0:
-                # Tokenize each BREAK-separated segment independently so
-                # chunking/padding reflects what the tokenizer actually does
-                # per segment, rather than guessing at a fixed-window size.
-                segments = cls._split_on_break(cleaned_text)
-                token_streams = cls._tokenize_break_segments(clip, segments)
-            else:
-                token_streams = clip.tokenize(cleaned_text, return_word_ids=True)
+            outputs, estimate_report = cls._shortcut_outputs(
+                tokenize_clip,
+                text,
+                composition=composition,
+                estimate=estimate,
+                count_strategy=count_strategy,
+                use_cache=use_cache,
+                timer=timer,
+                show_timings=show_timings,
+            )
+            if outputs is None:
+                with timer.phase("tokenize"):
+                    token_streams, cache_hit, limit_scan = cls._tokenize_for_count(
+                        tokenize_clip,
+                        cleaned_text,
+                        break_count,
+                        use_cache=use_cache,
+                        stop_after_tokens=stop_after_tokens,
+                        count_strategy=count_strategy,
+                    )
+                if limit_scan is not None and limit_scan.over_limit:
+                    outputs = cls._stopped_outputs(
+                        text,
+                        analysis,
+                        limit_scan,
+                        limit=stop_after_tokens,
+                        count_strategy=count_strategy,
+                        timer=timer,
+                        show_timings=show_timings,
+                    )
+            if outputs is not None:
+                cls._record_timings(timer, show_timings, metrics_export)
+                return outputs
 
             if not isinstance(token_streams, dict) or not token_streams:
                 msg = "Tokenizer returned no token streams."
-                return io.NodeOutput(0, 0, 0, msg, text)
+                return (0, 0, 0, msg, text, "{}", "{}", None, "{}", "{}", "{}", "{}")
 
             # Get token counts and chunk information
-            final_token_count, context_limit_tokens, chunk_count = (
-                cls._process_token_counts(token_streams, count_strategy)
-            )
+            with timer.phase("count"):
+                final_token_count, context_limit_tokens, chunk_count = (
+                    cls._process_token_counts(token_streams, count_strategy)
+                )
 
             # Build output details
-            details_parts = [
-                f"Prompt tokens: {final_token_count}",
-                f"Context limit: {context_limit_tokens}",
-                f"Chunks: {chunk_count}",
-                f"Strategy: {count_strategy}",
-            ]
-
-            if break_count > 0:
-                details_parts.append(f"BREAK ops: {break_count}")
-            if analysis["has_escaped_parens"]:
-                details_parts.append("Has escaped parens: Yes")
-            if analysis["special_functions"]:
-                func_str = ", ".join(analysis["special_functions"])
-                details_parts.append(f"Functions: {func_str}")
+            details_parts = cls._summary_parts(
+                final_token_count,
+                context_limit_tokens,
+                chunk_count,
+                count_strategy,
+                analysis,
+            )
+            if use_cache:
+                details_parts.extend(cls._cache_parts(cache_hit, break_count))
+            if limit_scan is not None:
+                details_parts.append(f"Within limit {stop_after_tokens}")
+            if estimate_report is not None:
+                details_parts.append(cls._estimate_part(estimate_report))
 
-            details = " | ".join(details_parts)
+            breakdown, breakdown_json = cls._optional_section(
+                show_token_breakdown,
+                timer,
+                "breakdown",
+                cancel_event,
+                functools.partial(
+                    cls._breakdown_outputs,
+                    clip,
+                    token_streams,
+                    breakdown_offset,
+                    breakdown_limit,
+                ),
+            )
+            weight_summary, weight_json = cls._optional_section(
+                weight_attribution,
+                timer,
+                "weights",
+                cancel_event,
+                functools.partial(
+                    cls._weight_outputs, clip, cleaned_text, break_count, token_streams
+                ),
+            )
+            source_summary, source_json = cls._optional_section(
+                source_counts,
+                timer,
+                "sources",
+                cancel_event,
+                functools.partial(
+                    cls._source_outputs,
+                    clip,
+                    text,
+                    cleaned_text,
+                    break_count,
+                    token_streams,
+                ),
+            )
+            chunk_summary, chunk_json = cls._optional_section(
+                chunk_analysis,
+                timer,
+                "chunks",
+                cancel_event,
+                functools.partial(
+                    cls._chunk_outputs,
+                    clip,
+                    text,
+                    cleaned_text,
+                    break_count,
+                    token_streams,
+                ),
+            )
 
-            if show_token_breakdown:
-                breakdown = cls._build_token_breakdown(clip, token_streams)
-                if breakdown:
-                    details = f"{details}\n\nToken breakdown:\n{breakdown}"
+            timer.finish()
+            details = cls._compose_details(
+                details_parts,
+                timer.format() if show_timings else "",
+                {
+                    "Weight attribution": weight_summary,
+                    "Source counts": source_summary,
+                    "Chunk boundaries": chunk_summary,
+                    "Token breakdown": breakdown,
+                },
+            )
+            cls._record_timings(timer, show_timings, metrics_export)
 
-            return io.NodeOutput(
+            return (
                 final_token_count,
                 context_limit_tokens,
                 chunk_count,
                 details,
                 text,
+                breakdown_json,
+                weight_json,
+                cls._pretokenized(clip, text, cleaned_text, break_count, token_streams),
+                source_json,
+                chunk_json,
+                "{}",
+                cls._json_or_empty(estimate_report),
             )
         except (ValueError, TypeError) as e:
             msg = f"Error: {e}"
             logging.error("FensTokenCounter: Failed to tokenize text. %s", msg)
-            return io.NodeOutput(0, 0, 0, msg, text or "")
+            return (0, 0, 0, msg, text or "", "{}", "{}", None, "{}", "{}", "{}", "{}")
         except Exception:
             raise
+
+    @classmethod
+    @override
+    async def execute(
+        cls,
+        clip: Any,
+        text: str | None = None,
+        count_strategy: str = "max_stream",
+        show_token_breakdown: bool = False,
+        breakdown_offset: int = 0,
+        breakdown_limit: int = 256,
+        use_cache: bool = True,
+        concurrent_streams: bool = False,
+        show_timings: bool = False,
+        metrics_export: str = "none",
+        weight_attribution: bool = False,
+        source_counts: bool = False,
+        chunk_analysis: bool = False,
+        stop_after_tokens: int = 0,
+        composition: bool = False,
+        estimate: bool = False,
+    ) -> io.NodeOutput:
+        """
+        Count prompt tokens and context window usage for a given text and CLIP object.
+
+        Features:
+        - Handles escape sequences (\\( and \\) for literal parentheses)
+        - Accounts for weight syntax ((text:weight) - weights don't add tokens)
+        - On BREAK, tokenizes each segment independently so padding/chunking
+          matches what the active tokenizer actually does per segment
+          (correct for both fixed-window encoders like CLIP and unbounded
+          encoders like Qwen3/T5/Llama-style text encoders)
+        - Supports multi-encoder models (SD1, SDXL, Flux, Anima, etc.)
+        - Shows chunk count and context window usage
+        - Optionally appends a per-token breakdown (id, decoded text,
+          weight, word id) per stream to the Details output, paginated by
+          offset/limit and also returned as columnar JSON
+        - Caches tokenizer output per tokenizer stack and prompt so
+          re-queued prompts skip tokenization entirely
+        - Optionally tokenizes the branches of multi-encoder stacks
+          concurrently on a thread pool
+        - Runs tokenization and breakdown building on an executor thread,
+          so long prompts never block the server's event loop; cancelling
+          the execution stops the worker at its next tokenizer call
+        - Optionally times each phase (preprocess, tokenize, count,
+          breakdown), shows the timings in Details and exports rolling
+          histograms as Prometheus text or JSON
+        - Optionally attributes tokens to weighted phrases and weight
+          buckets, reusing the same tokenization
+        - Outputs the counted tokens so Fens Encode Tokens can encode them
+          without a second tokenization pass
+        - Optionally maps tokens back to prompt characters and counts them
+          per line and per comma-separated tag, reusing the same tokenization
+        - Optionally analyses CLIP-style chunks: padding per chunk, words
+          and tags split across chunk boundaries, and BREAK edits that keep
+          tags whole or save chunks
+        - Optionally stops counting as soon as a token limit is exceeded,
+          tokenizing huge prompts piece by piece with bounded memory
+        - Optionally counts AND / CAT / AVG sub-prompts separately, as
+          composition-aware encoders encode them, tokenizing identical
+          sub-prompts once and distinct ones concurrently
+        - Optionally estimates the count without tokenizing, with a 95%
+          interval, counting exactly only when the interval crosses a
+          chunk boundary
+
+        Returns:
+            tuple: (total_tokens, context_limit, chunk_count, details, text_echo,
+                    token_breakdown_json, weight_attribution_json, tokens,
+                    source_counts_json, chunk_analysis_json, composition_json,
+                    estimate_json)
+        """
+        cancel_event = threading.Event()
+        count = functools.partial(
+            cls._count_outputs,
+            clip,
+            text,
+            count_strategy=count_strategy,
+            show_token_breakdown=show_token_breakdown,
+            breakdown_offset=breakdown_offset,
+            breakdown_limit=breakdown_limit,
+            use_cache=use_cache,
+            concurrent_streams=concurrent_streams,
+            show_timings=show_timings,
+            metrics_export=metrics_export,
+            weight_attribution=weight_attribution,
+            source_counts=source_counts,
+            chunk_analysis=chunk_analysis,
+            stop_after_tokens=stop_after_tokens,
+            composition=composition,
+            estimate=estimate,
+            cancel_event=cancel_event,
+        )
+        try:
+            outputs = await asyncio.get_running_loop().run_in_executor(None, count)
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+        return io.NodeOutput(*outputs)
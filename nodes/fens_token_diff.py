@@ -0,0 +1,356 @@
+from __future__ import annotations
+
+import json
+import logging
+from difflib import SequenceMatcher
+from typing import Any
+
+import numpy as np
+from comfy_api.latest import io
+from typing_extensions import override
+
+from .fens_token_counter import FensTokenCounter
+from .token_arrays import TokenStream, summarize_stream
+from .token_cache import tokenizer_fingerprint
+
+MAX_SPAN_TEXT = 200  # Decoded span text is cut to this many characters
+MAX_DETAIL_SPANS = 3  # Added/removed spans listed per stream in Details
+# Word-boundary markers used by common vocabularies: CLIP BPE ("</w>"),
+# SentencePiece ("▁") and byte-level BPE ("Ġ", "Ċ").
+_WORD_MARKERS = {"</w>": " ", "▁": " ", "Ġ": " ", "Ċ": "\n"}
+
+
+class FensTokenDiff(io.ComfyNode):
+    """
+    Compares the token usage of two prompt revisions: per-stream token and
+    chunk deltas plus the token spans that were added or removed.
+    Integrates tightly with ComfyUI V3 node API and provides UI-friendly output.
+    """
+
+    @classmethod
+    @override
+    def define_schema(cls) -> io.Schema:
+        return io.Schema(
+            node_id="FensTokenDiff",
+            display_name="Fens Token Diff",
+            category="Fens_Simple_Nodes/Utility",
+            search_aliases=["token diff", "prompt diff", "compare prompts", "a/b"],
+            description="Compare two prompt revisions with the same CLIP: per-stream token and chunk deltas plus the token spans that were added or removed.",
+            inputs=[
+                io.Clip.Input(
+                    "clip",
+                    display_name="CLIP",
+                    tooltip="ComfyUI CLIP object (text encoder stack) from the current workflow.",
+                ),
+                io.String.Input(
+                    "text_a",
+                    display_name="Prompt A",
+                    multiline=True,
+                    dynamic_prompts=True,
+                    tooltip="The original prompt revision.",
+                    optional=True,
+                ),
+                io.String.Input(
+                    "text_b",
+                    display_name="Prompt B",
+                    multiline=True,
+                    dynamic_prompts=True,
+                    tooltip="The edited prompt revision. Deltas are reported as B minus A.",
+                    optional=True,
+                ),
+                io.Combo.Input(
+                    "count_strategy",
+                    display_name="Count Strategy",
+                    options=["max_stream", "sum_streams"],
+                    default="max_stream",
+                    advanced=True,
+                    tooltip="How to aggregate counts across tokenizer branches (e.g. l/g/t5xxl) for the Token/Chunk Delta outputs: max_stream = largest branch count, sum_streams = sum of all branches.",
+                ),
+            ],
+            outputs=[
+                io.Int.Output(
+                    "token_delta",
+                    display_name="Token Delta",
+                    tooltip="Typed tokens of B minus typed tokens of A.",
+                ),
+                io.Int.Output(
+                    "chunk_delta",
+                    display_name="Chunk Delta",
+                    tooltip="Chunks of B minus chunks of A.",
+                ),
+                io.String.Output(
+                    "diff_json",
+                    display_name="Diff JSON",
+                    tooltip="Per-stream token/chunk counts and deltas with the added and removed token spans (typed-token position, length, decoded text).",
+                ),
+                io.String.Output(
+                    "details",
+                    display_name="Details",
+                    tooltip="Human-readable summary of the token and chunk changes.",
+                ),
+            ],
+            is_experimental=False,
+        )
+
+    @classmethod
+    def _segments(cls, text: str) -> list[str]:
+        """BREAK segments of a preprocessed prompt (a single one without BREAK)."""
+        if not text or not text.strip():
+            return []
+        cleaned_text, _ = FensTokenCounter._preprocess_prompt(text)
+        return FensTokenCounter._split_on_break(cleaned_text)
+
+    @classmethod
+    def _shared_segment_counts(
+        cls, segments_a: list[str], segments_b: list[str]
+    ) -> tuple[int, int]:
+        """Number of identical leading and trailing BREAK segments."""
+        limit = min(len(segments_a), len(segments_b))
+        prefix = 0
+        while prefix < limit and segments_a[prefix] == segments_b[prefix]:
+            prefix += 1
+        suffix = 0
+        while (
+            suffix < limit - prefix
+            and segments_a[-1 - suffix] == segments_b[-1 - suffix]
+        ):
+            suffix += 1
+        return prefix, suffix
+
+    @classmethod
+    def _typed_tokens(cls, stream: TokenStream | None) -> list[Any]:
+        """Ids of counted tokens (word_id > 0 or untracked), padding excluded."""
+        if stream is None:
+            return []
+        positions = np.flatnonzero(stream.word_ids > 0)
+        token_ids = stream.token_ids[positions].tolist()
+        for position, token_item in stream.objects.items():
+            index = int(np.searchsorted(positions, position))
+            if index < len(positions) and positions[index] == position:
+                token_id, _, _ = FensTokenCounter._unpack_token_item(token_item)
+                # Embedding tensors are unhashable; compare them as one marker
+                token_ids[index] = token_id if isinstance(token_id, int) else None
+        return token_ids
+
+    @classmethod
+    def _decode_span(cls, sub_tokenizer: Any, token_ids: list[Any]) -> str:
+        pieces = []
+        for token_id in token_ids:
+            decoded = FensTokenCounter._decode_token_id(sub_tokenizer, token_id)
+            pieces.append(decoded if decoded is not None else "?")
+        text = "".join(pieces)
+        for marker, replacement in _WORD_MARKERS.items():
+            text = text.replace(marker, replacement)
+        text = " ".join(text.split())
+        return text if len(text) <= MAX_SPAN_TEXT else text[:MAX_SPAN_TEXT] + "…"
+
+    @classmethod
+    def _token_spans(
+        cls,
+        sub_tokenizer: Any,
+        tokens_a: list[Any],
+        tokens_b: list[Any],
+        offset: int,
+    ) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        """
+        Removed (from A) and added (in B) token spans between two typed-token
+        sequences. offset is the typed-token position where both start.
+
+        The common token prefix and suffix are skipped in linear time before
+        the quadratic-worst-case matcher runs, so a local edit in a long
+        segment only aligns the tokens around the edit.
+        """
+        limit = min(len(tokens_a), len(tokens_b))
+        prefix = 0
+        while prefix < limit and tokens_a[prefix] == tokens_b[prefix]:
+            prefix += 1
+        suffix = 0
+        while (
+            suffix < limit - prefix and tokens_a[-1 - suffix] == tokens_b[-1 - suffix]
+        ):
+            suffix += 1
+        tokens_a = tokens_a[prefix : len(tokens_a) - suffix]
+        tokens_b = tokens_b[prefix : len(tokens_b) - suffix]
+        offset += prefix
+
+        removed, added = [], []
+        matcher = SequenceMatcher(None, tokens_a, tokens_b, autojunk=False)
+        for tag, a_start, a_end, b_start, b_end in matcher.get_opcodes():
+            if tag in {"delete", "replace"}:
+                removed.append(
+                    {
+                        "position": offset + a_start,
+                        "tokens": a_end - a_start,
+                        "text": cls._decode_span(
+                            sub_tokenizer, tokens_a[a_start:a_end]
+                        ),
+                    }
+                )
+            if tag in {"insert", "replace"}:
+                added.append(
+                    {
+                        "position": offset + b_start,
+                        "tokens": b_end - b_start,
+                        "text": cls._decode_span(
+                            sub_tokenizer, tokens_b[b_start:b_end]
+                        ),
+                    }
+                )
+        return removed, added
+
+    @classmethod
+    def _merge_streams(cls, *parts: dict[str, TokenStream]) -> dict[str, TokenStream]:
+        """Concatenate {stream: TokenStream} parts in order, per stream."""
+        merged: dict[str, list[TokenStream]] = {}
+        for streams in parts:
+            for stream_name, stream in streams.items():
+                merged.setdefault(stream_name, []).append(stream)
+        return {
+            stream_name: TokenStream.concat(streams)
+            for stream_name, streams in merged.items()
+        }
+
+    @classmethod
+    def _diff(
+        cls, clip: Any, text_a: str, text_b: str, count_strategy: str
+    ) -> tuple[int, int, dict[str, Any]]:
+        """
+        Tokenize both revisions, sharing the work for unchanged regions.
+
+        Identical leading/trailing BREAK segments are tokenized once and
+        reused for both sides, and every other segment goes through the
+        per-segment cache, so segments that merely moved (or a revision
+        counted before) are not tokenized again. Only the differing
+        segments in the middle are diffed token by token.
+
+        Returns:
+            Tuple of (token_delta, chunk_delta, diff) where diff is the
+            JSON-ready report.
+        """
+        fingerprint = tokenizer_fingerprint(clip)
+        segments_a = cls._segments(text_a)
+        segments_b = cls._segments(text_b)
+        prefix, suffix = cls._shared_segment_counts(segments_a, segments_b)
+
+        def tokenize(segments: list[str]) -> dict[str, list[list[Any]]]:
+            return FensTokenCounter._tokenize_break_segments(
+                clip, segments, fingerprint
+            )
+
+        head = tokenize(segments_a[:prefix])
+        tail = tokenize(segments_a[len(segments_a) - suffix :])
+        changed_a = tokenize(segments_a[prefix : len(segments_a) - suffix])
+        changed_b = tokenize(segments_b[prefix : len(segments_b) - suffix])
+        streams_a = cls._merge_streams(head, changed_a, tail)
+        streams_b = cls._merge_streams(head, changed_b, tail)
+
+        stream_reports = {}
+        for stream_name in dict.fromkeys([*streams_a, *streams_b]):
+            summary_a = summarize_stream(streams_a.get(stream_name, []))
+            summary_b = summarize_stream(streams_b.get(stream_name, []))
+            removed, added = cls._token_spans(
+                FensTokenCounter._resolve_sub_tokenizer(clip, stream_name),
+                cls._typed_tokens(changed_a.get(stream_name)),
+                cls._typed_tokens(changed_b.get(stream_name)),
+                len(cls._typed_tokens(head.get(stream_name))),
+            )
+            stream_reports[stream_name] = {
+                "tokens_a": summary_a.prompt_tokens,
+                "tokens_b": summary_b.prompt_tokens,
+                "token_delta": summary_b.prompt_tokens - summary_a.prompt_tokens,
+                "chunks_a": summary_a.chunk_count,
+                "chunks_b": summary_b.chunk_count,
+                "chunk_delta": summary_b.chunk_count - summary_a.chunk_count,
+                "removed": removed,
+                "added": added,
+            }
+
+        tokens_a, _, chunks_a = (
+            FensTokenCounter._process_token_counts(streams_a, count_strategy)
+            if streams_a
+            else (0, 0, 0)
+        )
+        tokens_b, _, chunks_b = (
+            FensTokenCounter._process_token_counts(streams_b, count_strategy)
+            if streams_b
+            else (0, 0, 0)
+        )
+        diff = {
+            "count_strategy": count_strategy,
+            "tokens_a": tokens_a,
+            "tokens_b": tokens_b,
+            "chunks_a": chunks_a,
+            "chunks_b": chunks_b,
+            "segments": {
+                "a": len(segments_a),
+                "b": len(segments_b),
+                "shared": prefix + suffix,
+            },
+            "streams": stream_reports,
+        }
+        return tokens_b - tokens_a, chunks_b - chunks_a, diff
+
+    @classmethod
+    def _format_details(
+        cls, token_delta: int, chunk_delta: int, diff: dict[str, Any]
+    ) -> str:
+        segments = diff["segments"]
+        lines = [
+            " | ".join(
+                [
+                    f"Tokens: {diff['tokens_a']} → {diff['tokens_b']} ({token_delta:+d})",
+                    f"Chunks: {diff['chunks_a']} → {diff['chunks_b']} ({chunk_delta:+d})",
+                    f"Segments: {segments['a']} → {segments['b']} ({segments['shared']} shared)",
+                    f"Strategy: {diff['count_strategy']}",
+                ]
+            )
+        ]
+        for stream_name, report in diff["streams"].items():
+            lines.append(
+                f"[{stream_name}] tokens {report['token_delta']:+d}, chunks {report['chunk_delta']:+d}"
+            )
+            for sign, key in (("-", "removed"), ("+", "added")):
+                spans = report[key]
+                for span in spans[:MAX_DETAIL_SPANS]:
+                    lines.append(
+                        f"  {sign} @{span['position']} ({span['tokens']} tokens): {span['text']!r}"
+                    )
+                if len(spans) > MAX_DETAIL_SPANS:
+                    lines.append(f"  … {len(spans) - MAX_DETAIL_SPANS} more {key}")
+        return "\n".join(lines)
+
+    @classmethod
+    @override
+    def execute(
+        cls,
+        clip: Any,
+        text_a: str | None = None,
+        text_b: str | None = None,
+        count_strategy: str = "max_stream",
+    ) -> io.NodeOutput:
+        """
+        Diff the token usage of Prompt B against Prompt A.
+
+        Returns:
+            tuple: (token_delta, chunk_delta, diff_json, details)
+        """
+        if clip is None:
+            msg = "No CLIP input connected."
+            logging.warning("FensTokenDiff: %s", msg)
+            return io.NodeOutput(0, 0, "{}", msg)
+
+        try:
+            token_delta, chunk_delta, diff = cls._diff(
+                clip, text_a or "", text_b or "", count_strategy
+            )
+        except (ValueError, TypeError) as e:
+            msg = f"Error: {e}"
+            logging.error("FensTokenDiff: %s", msg)
+            return io.NodeOutput(0, 0, "{}", msg)
+
+        return io.NodeOutput(
+            token_delta,
+            chunk_delta,
+            json.dumps(diff, ensure_ascii=False, separators=(",", ":")),
+            cls._format_details(token_delta, chunk_delta, diff),
+        )
@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import json
+import logging
+import random
+from collections import Counter
+from typing import Any
+
+from comfy.utils import ProgressBar
+from comfy_api.latest import io
+from typing_extensions import override
+
+from .dynamic_prompt import (
+    count_expansions,
+    extreme_expansion,
+    iter_expansions,
+    parse_template,
+    sample_expansion,
+)
+from .fens_token_counter import FensTokenCounter
+from .token_common import summarize_counts
+
+
+class FensTokenRangeCounter(io.ComfyNode):
+    """
+    Counts tokens over every expansion of a dynamic prompt template
+    ({a|b|c} groups) and reports the min, max and distribution.
+    Integrates tightly with ComfyUI V3 node API and provides UI-friendly output.
+    """
+
+    @classmethod
+    @override
+    def define_schema(cls) -> io.Schema:
+        return io.Schema(
+            node_id="FensTokenRangeCounter",
+            display_name="Fens Dynamic Prompt Token Range",
+            category="Fens_Simple_Nodes/Utility",
+            search_aliases=[
+                "dynamic prompt tokens",
+                "wildcard token range",
+                "token range",
+                "expansion count",
+            ],
+            description="Expand the {a|b|c} groups of a dynamic prompt template and report the min/max/mean/p95 token count over all expansions, sampling when there are too many to enumerate.",
+            inputs=[
+                io.Clip.Input(
+                    "clip",
+                    display_name="CLIP",
+                    tooltip="ComfyUI CLIP object (text encoder stack) from the current workflow.",
+                ),
+                io.String.Input(
+                    "template",
+                    display_name="Template",
+                    multiline=True,
+                    dynamic_prompts=False,
+                    tooltip="Dynamic prompt template. {a|b|c} picks one option, groups may nest, and \\{ \\} \\| escape literal characters. The template is analysed as written, not expanded by the frontend.",
+                ),
+                io.Int.Input(
+                    "token_limit",
+                    display_name="Token Limit",
+                    default=75,
+                    min=1,
+                    max=1000000,
+                    tooltip="Expansions with more typed tokens than this are counted as over the limit (75 = one CLIP 77-token window).",
+                ),
+                io.Int.Input(
+                    "max_expansions",
+                    display_name="Max Expansions",
+                    default=1000,
+                    min=1,
+                    max=100000,
+                    tooltip="Templates with up to this many expansions are counted exhaustively; larger ones are sampled this many times.",
+                ),
+                io.Int.Input(
+                    "seed",
+                    display_name="Sample Seed",
+                    default=0,
+                    min=0,
+                    max=0xFFFFFFFF,
+                    advanced=True,
+                    tooltip="Seed for the random sample drawn when the template has more than Max Expansions expansions.",
+                ),
+                io.Combo.Input(
+                    "count_strategy",
+                    display_name="Count Strategy",
+                    options=["max_stream", "sum_streams"],
+                    default="max_stream",
+                    advanced=True,
+                    tooltip="How to aggregate counts across tokenizer branches (e.g. l/g/t5xxl): max_stream = largest branch count, sum_streams = sum of all branches.",
+                ),
+            ],
+            outputs=[
+                io.Int.Output(
+                    "min_tokens",
+                    display_name="Min Tokens",
+                    tooltip="Smallest token count of any counted expansion.",
+                ),
+                io.Int.Output(
+                    "max_tokens",
+                    display_name="Max Tokens",
+                    tooltip="Largest token count of any counted expansion.",
+                ),
+                io.Float.Output(
+                    "mean_tokens",
+                    display_name="Mean Tokens",
+                    tooltip="Average token count over the counted expansions.",
+                ),
+                io.Int.Output(
+                    "p95_tokens",
+                    display_name="P95 Tokens",
+                    tooltip="95th percentile (nearest rank) of the expansion token counts.",
+                ),
+                io.String.Output(
+                    "longest_prompt",
+                    display_name="Longest Expansion",
+                    tooltip="An expansion with the largest token count.",
+                ),
+                io.String.Output(
+                    "distribution_json",
+                    display_name="Distribution JSON",
+                    tooltip="JSON object with the statistics, a token-count histogram and the shortest and longest expansions.",
+                ),
+                io.String.Output(
+                    "details",
+                    display_name="Details",
+                    tooltip="Human-readable summary of the token range and how it was computed.",
+                ),
+            ],
+            is_experimental=False,
+        )
+
+    @classmethod
+    def _candidate_prompts(
+        cls,
+        template: Any,
+        total_expansions: int,
+        max_expansions: int,
+        seed: int,
+        group_counts: dict[int, int],
+    ) -> tuple[list[str], list[str]]:
+        """
+        Expansions to count.
+
+        Returns:
+            (expansions, extremes): every expansion when there are at most
+            max_expansions of them, otherwise max_expansions uniform samples.
+            extremes holds the longest-option and shortest-option expansions
+            when sampling, so the reported range covers the likely worst
+            case even if no sample hits it; they are not part of the
+            distribution.
+        """
+        if total_expansions <= max_expansions:
+            return list(iter_expansions(template)), []
+        rng = random.Random(seed)  # noqa: S311 - reproducible sample, not crypto
+        samples = [
+            sample_expansion(template, rng, group_counts) for _ in range(max_expansions)
+        ]
+        extremes = [
+            extreme_expansion(template, longest=True),
+            extreme_expansion(template, longest=False),
+        ]
+        return samples, extremes
+
+    @classmethod
+    def _count_range(
+        cls,
+        clip: Any,
+        template_text: str,
+        token_limit: int = 75,
+        max_expansions: int = 1000,
+        *,
+        seed: int = 0,
+        count_strategy: str = "max_stream",
+    ) -> tuple[int, int, float, int, str, str, str]:
+        """
+        Count the token range of a dynamic prompt template.
+
+        Each distinct expansion text is counted once per run through
+        FensTokenCounter's cached tokenization path; BREAK segments shared
+        between expansions are tokenized once via the segment cache, and
+        repeated runs hit the prompt cache.
+
+        Returns:
+            tuple: (min, max, mean, p95, longest_prompt, distribution_json, details)
+        """
+        template = parse_template(template_text)
+        group_counts: dict[int, int] = {}
+        total_expansions = count_expansions(template, group_counts)
+        prompts, extremes = cls._candidate_prompts(
+            template, total_expansions, max_expansions, seed, group_counts
+        )
+        sampled = bool(extremes)
+
+        counts: dict[str, int] = {}
+        pbar = ProgressBar(len(prompts) + len(extremes))
+        for index, prompt in enumerate(prompts + extremes):
+            if prompt not in counts:
+                counts[prompt] = FensTokenCounter._count_prompt(
+                    clip, prompt, count_strategy
+                )[0]
+            pbar.update_absolute(index + 1)
+
+        prompt_counts = [counts[prompt] for prompt in prompts]
+        stats = summarize_counts(prompt_counts, token_limit)
+        shortest = min(counts, key=counts.__getitem__)
+        longest = max(counts, key=counts.__getitem__)
+        stats["min"] = counts[shortest]
+        stats["max"] = counts[longest]
+
+        histogram = Counter(prompt_counts)
+        distribution = {
+            "expansions": total_expansions,
+            "counted": len(prompts),
+            "distinct": len(counts),
+            "sampled": sampled,
+            "seed": seed if sampled else None,
+            **stats,
+            "histogram": {
+                str(tokens): histogram[tokens] for tokens in sorted(histogram)
+            },
+            "shortest_prompt": shortest,
+            "longest_prompt": longest,
+        }
+        coverage = f"sampled {len(prompts)}, seed {seed}" if sampled else "all counted"
+        details = " | ".join(
+            [
+                f"Expansions: {total_expansions} ({coverage})",
+                f"Range: {stats['min']}-{stats['max']} tokens",
+                f"Mean: {stats['mean']:.2f}",
+                f"P95: {stats['p95']}",
+                f"Over {token_limit}: {stats['over_limit']}/{stats['count']}",
+                f"Distinct prompts tokenized: {len(counts)}",
+                f"Strategy: {count_strategy}",
+            ]
+        )
+        if sampled:
+            details += " | Min/max are over the sample plus the shortest/longest-option expansions"
+        return (
+            stats["min"],
+            stats["max"],
+            float(stats["mean"]),
+            stats["p95"],
+            longest,
+            json.dumps(distribution, ensure_ascii=False),
+            details,
+        )
+
+    @classmethod
+    @override
+    def execute(
+        cls,
+        clip: Any,
+        template: str = "",
+        token_limit: int = 75,
+        max_expansions: int = 1000,
+        seed: int = 0,
+        count_strategy: str = "max_stream",
+    ) -> io.NodeOutput:
+        """
+        Count the token range over the template's expansions.
+
+        Returns:
+            tuple: (min, max, mean, p95, longest_prompt, distribution_json, details)
+        """
+        if clip is None:
+            msg = "No CLIP input connected."
+            logging.warning("FensTokenRangeCounter: %s", msg)
+            return io.NodeOutput(0, 0, 0.0, 0, "", "{}", msg)
+        if not template or not template.strip():
+            return io.NodeOutput(0, 0, 0.0, 0, "", "{}", "No template provided.")
+
+        try:
+            return io.NodeOutput(
+                *cls._count_range(
+                    clip,
+                    template,
+                    token_limit,
+                    max_expansions,
+                    seed=seed,
+                    count_strategy=count_strategy,
+                )
+            )
+        except (ValueError, TypeError) as e:
+            msg = f"Error: {e}"
+            logging.error("FensTokenRangeCounter: %s", msg)
+            return io.NodeOutput(0, 0, 0.0, 0, "", "{}", msg)
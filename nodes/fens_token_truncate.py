@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import logging
+import re
+from typing import Any
+
+from comfy_api.latest import io
+from typing_extensions import override
+
+from .fens_token_counter import FensTokenCounter
+
+# Candidate cut points: the start of each separator run (group "cut"). Comma
+# mode also cuts at line breaks, since multi-line prompts rarely end lines
+# with commas. Parentheses are matched too, so cuts inside weight groups can
+# be skipped; escaped characters are consumed first and never count.
+_BOUNDARY_PATTERNS = {
+    "comma": re.compile(r"\\.|(?P<paren>[()])|(?P<cut>\s*[,\n])"),
+    "word": re.compile(r"\\.|(?P<paren>[()])|(?P<cut>\s+|\s*,)"),
+}
+_TRAILING_SEPARATORS = " \t\r\n,"
+
+
+class FensTokenTruncate(io.ComfyNode):
+    """
+    Trims a prompt to the longest prefix that fits a token budget, cut at a
+    comma or word boundary, and returns the dropped remainder.
+    Integrates tightly with ComfyUI V3 node API and provides UI-friendly output.
+    """
+
+    @classmethod
+    @override
+    def define_schema(cls) -> io.Schema:
+        return io.Schema(
+            node_id="FensTokenTruncate",
+            display_name="Fens Token Budget Truncate",
+            category="Fens_Simple_Nodes/Utility",
+            search_aliases=["truncate", "token budget", "fit prompt", "trim prompt"],
+            description="Cut a prompt to the longest prefix that fits a token budget (e.g. one 77-token CLIP window), at comma or word boundaries, and output the dropped remainder.",
+            inputs=[
+                io.Clip.Input(
+                    "clip",
+                    display_name="CLIP",
+                    tooltip="ComfyUI CLIP object (text encoder stack) from the current workflow.",
+                ),
+                io.String.Input(
+                    "text",
+                    display_name="Prompt Text",
+                    multiline=True,
+                    dynamic_prompts=True,
+                    tooltip="The prompt to fit into the token budget.",
+                    optional=True,
+                ),
+                io.Int.Input(
+                    "token_budget",
+                    display_name="Token Budget",
+                    default=75,
+                    min=1,
+                    max=1000000,
+                    tooltip="Maximum typed tokens the kept prefix may use (75 = one CLIP 77-token window).",
+                ),
+                io.Combo.Input(
+                    "boundary",
+                    display_name="Cut At",
+                    options=["comma", "word"],
+                    default="comma",
+                    tooltip="comma = cut between comma-separated tags or lines (falls back to words if even the first tag is too long), word = cut between words.",
+                ),
+                io.Combo.Input(
+                    "count_strategy",
+                    display_name="Count Strategy",
+                    options=["max_stream", "sum_streams"],
+                    default="max_stream",
+                    advanced=True,
+                    tooltip="How to aggregate counts across tokenizer branches (e.g. l/g/t5xxl): max_stream = largest branch count, sum_streams = sum of all branches.",
+                ),
+            ],
+            outputs=[
+                io.String.Output(
+                    "text",
+                    display_name="Fitted Text",
+                    tooltip="The longest prefix of the prompt that fits the token budget.",
+                ),
+                io.String.Output(
+                    "remainder",
+                    display_name="Remainder",
+                    tooltip="The part of the prompt that was cut off (empty if everything fits).",
+                ),
+                io.Int.Output(
+                    "total_tokens",
+                    display_name="Fitted Tokens",
+                    tooltip="Typed token count of the fitted text.",
+                ),
+                io.String.Output(
+                    "details",
+                    display_name="Details",
+                    tooltip="Human-readable summary of the cut: kept and original token counts and how many pieces and prefixes were counted.",
+                ),
+            ],
+            is_experimental=False,
+        )
+
+    @classmethod
+    def _boundaries(cls, text: str, boundary: str) -> list[int]:
+        """
+        Candidate prefix end positions in ascending order, always ending with
+        len(text). Positions inside parentheses are skipped, so a cut never
+        splits a weight group; depth is tracked as in piece_spans. A
+        position directly after another separator would give the same
+        trimmed prefix as an earlier one, so it is skipped too.
+        """
+        positions = []
+        depth = 0
+        for match in _BOUNDARY_PATTERNS[boundary].finditer(text):
+            paren = match.group("paren")
+            if paren == "(":
+                depth += 1
+            elif paren == ")":
+                depth = max(depth - 1, 0)
+            elif (
+                match.group("cut") is not None
+                and depth == 0
+                and match.start() > 0
+                and text[match.start() - 1] not in _TRAILING_SEPARATORS
+            ):
+                positions.append(match.start())
+        positions.append(len(text))
+        return positions
+
+    @classmethod
+    def _piece_fit(
+        cls,
+        count_piece: Any,
+        text: str,
+        positions: list[int],
+        token_budget: int,
+    ) -> int:
+        """
+        Index of the last position whose prefix fits by summing the counts
+        of the pieces between consecutive positions (-1 = none fits).
+
+        Like FensTokenCounter._count_until_limit, this counts each piece
+        once and stops at the first prefix over the budget, so only the kept
+        part of a long prompt is tokenized. Pieces start outside weight
+        groups, so each parses as it would in the whole prompt, and the
+        sums are exact for tokenizers that tokenize words independently.
+        """
+        total = 0
+        start = 0
+        for index, position in enumerate(positions):
+            total += count_piece(text[start:position])
+            if total > token_budget:
+                return index - 1
+            start = position
+        return len(positions) - 1
+
+    @classmethod
+    def _fit_prefix(
+        cls,
+        count_tokens: Any,
+        text: str,
+        positions: list[int],
+        token_budget: int,
+    ) -> tuple[int, int] | None:
+        """
+        Binary-search the last position whose prefix fits the budget.
+
+        Token counts grow with the prefix, so the fitting positions form a
+        leading run and O(log n) counts locate its end.
+
+        Returns:
+            (position, token_count) of the longest fitting prefix, or None
+            when not even the first candidate fits.
+        """
+        best = None
+        low, high = 0, len(positions) - 1
+        while low <= high:
+            middle = (low + high) // 2
+            tokens = count_tokens(text[: positions[middle]])
+            if tokens <= token_budget:
+                best = (positions[middle], tokens)
+                low = middle + 1
+            else:
+                high = middle - 1
+        return best
+
+    @classmethod
+    def _count(cls, clip: Any, text: str, count_strategy: str) -> int:
+        """Typed tokens of text through the counter's cached path (0 if blank)."""
+        if not text.strip():
+            return 0
+        return FensTokenCounter._count_prompt(clip, text, count_strategy)[0]
+
+    @classmethod
+    def _confirm_fit(
+        cls,
+        count_tokens: Any,
+        text: str,
+        positions: list[int],
+        index: int,
+        token_budget: int,
+    ) -> tuple[int, int] | None:
+        """
+        Check the piece-sum estimate positions[index] with exact counts and
+        binary-search past it when it is off.
+
+        Returns:
+            (position, token_count) of the longest fitting prefix, or None
+            when not even the first candidate fits.
+        """
+        if index >= 0:
+            tokens = count_tokens(text[: positions[index]])
+            if tokens > token_budget:
+                return cls._fit_prefix(
+                    count_tokens, text, positions[:index], token_budget
+                )
+            fit = (positions[index], tokens)
+        else:
+            fit = None
+        if index + 1 < len(positions):
+            later = cls._fit_prefix(
+                count_tokens, text, positions[index + 1 :], token_budget
+            )
+            if later is not None:
+                return later
+        return fit
+
+    @classmethod
+    def _split_text(cls, text: str, position: int) -> tuple[str, str]:
+        """Split at position, trimming separators on both sides of the cut."""
+        return (
+            text[:position].rstrip(_TRAILING_SEPARATORS),
+            text[position:].lstrip(_TRAILING_SEPARATORS),
+        )
+
+    @classmethod
+    def _truncate(
+        cls,
+        clip: Any,
+        text: str,
+        token_budget: int,
+        boundary: str = "comma",
+        count_strategy: str = "max_stream",
+    ) -> tuple[str, str, int, str]:
+        """
+        Fit text into token_budget tokens.
+
+        Candidate prefixes are first sized from per-piece counts (see
+        _piece_fit); pieces go through FensTokenCounter's cached
+        tokenization path, so re-running with another budget or an edited
+        prompt only tokenizes pieces that changed. The chosen cut is then
+        confirmed with exact prefix counts, memoised per run, and a binary
+        search settles it for tokenizers whose piece counts do not add up.
+
+        Returns:
+            tuple: (fitted_text, remainder, fitted_tokens, details)
+        """
+        counts: dict[str, int] = {}
+
+        def count_tokens(prefix: str) -> int:
+            prefix = prefix.rstrip(_TRAILING_SEPARATORS)
+            if prefix not in counts:
+                counts[prefix] = cls._count(clip, prefix, count_strategy)
+            return counts[prefix]
+
+        # Counts are of the trimmed text, so that is what a fitting prompt
+        # returns: the trailing separators are tokens too.
+        total_tokens = count_tokens(text)
+        if total_tokens <= token_budget:
+            details = f"Fits: {total_tokens}/{token_budget} tokens | Nothing cut"
+            return text.rstrip(_TRAILING_SEPARATORS), "", total_tokens, details
+
+        pieces_counted = 0
+
+        def count_piece(piece: str) -> int:
+            nonlocal pieces_counted
+            pieces_counted += 1
+            return cls._count(clip, piece, count_strategy)
+
+        def fit_at(cut: str) -> tuple[int, int] | None:
+            positions = cls._boundaries(text, cut)
+            index = cls._piece_fit(count_piece, text, positions, token_budget)
+            return cls._confirm_fit(count_tokens, text, positions, index, token_budget)
+
+        cut_at = boundary
+        fit = fit_at(boundary)
+        if fit is None and boundary == "comma":
+            cut_at = "word (first tag exceeds budget)"
+            fit = fit_at("word")
+        position, fitted_tokens = fit if fit is not None else (0, 0)
+        fitted_text, remainder = cls._split_text(text, position)
+
+        details = " | ".join(
+            [
+                f"Kept: {fitted_tokens}/{token_budget} tokens",
+                f"Original: {total_tokens} tokens",
+                f"Cut at: {cut_at}",
+                f"Dropped: {len(remainder)} chars",
+                f"Counted: {pieces_counted} pieces, {len(counts)} prefixes",
+            ]
+        )
+        if fit is None:
+            details += (
+                " | Warning: the first word or weight group alone exceeds the budget"
+            )
+        return fitted_text, remainder, fitted_tokens, details
+
+    @classmethod
+    @override
+    def execute(
+        cls,
+        clip: Any,
+        text: str | None = None,
+        token_budget: int = 75,
+        boundary: str = "comma",
+        count_strategy: str = "max_stream",
+    ) -> io.NodeOutput:
+        """
+        Truncate the prompt to the token budget.
+
+        Returns:
+            tuple: (fitted_text, remainder, fitted_tokens, details)
+        """
+        if clip is None:
+            msg = "No CLIP input connected."
+            logging.warning("FensTokenTruncate: %s", msg)
+            return io.NodeOutput(text or "", "", 0, msg)
+        if not text or not text.strip():
+            return io.NodeOutput("", "", 0, "No text provided.")
+
+        try:
+            return io.NodeOutput(
+                *cls._truncate(clip, text, token_budget, boundary, count_strategy)
+            )
+        except (ValueError, TypeError) as e:
+            msg = f"Error: {e}"
+            logging.error("FensTokenTruncate: %s", msg)
+            return io.NodeOutput(text, "", 0, msg)
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import importlib
+import logging
+import os
+import threading
+
+import folder_paths
+import yaml
+from comfy_api.latest import io
+from typing_extensions import override
+
+from .fens_token_counter import FensTokenCounter
+from .token_common import TokenizerClip
+
+
+class FensTokenizerCounter(io.ComfyNode):
+    """
+    Counts prompt tokens with a tokenizer-only stand-in for a CLIP stack, so no
+    text-encoder weights are loaded just to count text.
+    Integrates tightly with ComfyUI V3 node API and provides UI-friendly output.
+    """
+
+    config_path = os.path.join(os.path.dirname(__file__), "tokenizer_config.yaml")
+    with open(config_path, encoding="utf-8") as f:
+        TOKENIZER_CONFIG = yaml.safe_load(f)
+
+    _tokenizer_clips: dict[str, TokenizerClip] = {}
+    _load_lock = threading.Lock()
+
+    @classmethod
+    @override
+    def define_schema(cls) -> io.Schema:
+        return io.Schema(
+            node_id="FensTokenizerCounter",
+            display_name="Fens Token Counter (Tokenizer Only)",
+            category="Fens_Simple_Nodes/Utility",
+            search_aliases=["token", "tokens", "token count", "tokenizer only"],
+            description="Count typed prompt tokens using only a model family's tokenizer files. No CLIP model or text-encoder weights are loaded.",
+            inputs=[
+                io.Combo.Input(
+                    "tokenizer_family",
+                    display_name="Tokenizer Family",
+                    options=list(cls.TOKENIZER_CONFIG.keys()),
+                    default="SDXL",
+                    tooltip="Which text-encoder stack's tokenizers to load (vocab/merges or SentencePiece/tokenizer.json files bundled with ComfyUI).",
+                ),
+                io.String.Input(
+                    "text",
+                    display_name="Prompt Text",
+                    multiline=True,
+                    dynamic_prompts=True,
+                    tooltip="The text to be counted.",
+                    optional=True,
+                ),
+                io.Combo.Input(
+                    "count_strategy",
+                    display_name="Count Strategy",
+                    options=["max_stream", "sum_streams"],
+                    default="max_stream",
+                    advanced=True,
+                    tooltip="How to aggregate counts across tokenizer branches (e.g. l/g/t5xxl): max_stream = largest branch count, sum_streams = sum of all branches.",
+                ),
+                io.Boolean.Input(
+                    "show_token_breakdown",
+                    display_name="Show Token Breakdown",
+                    default=False,
+                    advanced=True,
+                    tooltip="Append a per-token breakdown (id, decoded text, weight, word id) for each stream to the Details output.",
+                ),
+                io.Int.Input(
+                    "breakdown_offset",
+                    display_name="Breakdown Offset",
+                    default=0,
+                    min=0,
+                    max=10000000,
+                    advanced=True,
+                    tooltip="Skip this many tokens per stream before the breakdown window starts.",
+                ),
+                io.Int.Input(
+                    "breakdown_limit",
+                    display_name="Breakdown Limit",
+                    default=256,
+                    min=0,
+                    max=10000000,
+                    advanced=True,
+                    tooltip="Maximum tokens listed per stream in the breakdown (0 = no limit). Tokens outside the window are summarised as '… N more'.",
+                ),
+                io.Boolean.Input(
+                    "use_cache",
+                    display_name="Use Tokenization Cache",
+                    default=True,
+                    advanced=True,
+                    tooltip="Reuse tokenizer output for prompts already counted with the same tokenizer stack. Cache hit/miss counters are shown in the Details output.",
+                ),
+            ],
+            outputs=[
+                io.Int.Output(
+                    "total_tokens",
+                    display_name="Total Tokens",
+                    tooltip="Typed token count (excluding padding and most special tokens).",
+                ),
+                io.Int.Output(
+                    "context_limit_tokens",
+                    display_name="Context Limit Tokens",
+                    tooltip="Total padded slots in the active context window/floor (e.g. 77/154/231 for CLIP-style encoders). For unbounded encoders like T5XXL/Qwen3-family, this is just their minimum padding floor, not a hard ceiling.",
+                ),
+                io.Int.Output(
+                    "chunk_count",
+                    display_name="Chunk Count",
+                    tooltip="Number of tokenizer chunks/windows used for this prompt.",
+                ),
+                io.String.Output(
+                    "details",
+                    display_name="Details",
+                    tooltip="Human-readable summary of typed tokens and context usage. Includes a per-token breakdown when Show Token Breakdown is enabled.",
+                ),
+                io.String.Output(
+                    "text",
+                    display_name="Prompt Echo",
+                    tooltip="The input prompt (multiline string).",
+                ),
+                io.String.Output(
+                    "token_breakdown",
+                    display_name="Token Breakdown JSON",
+                    tooltip="The breakdown window as compact columnar JSON (positions, ids, text, weights, word ids per stream). Empty object unless Show Token Breakdown is enabled.",
+                ),
+            ],
+            is_experimental=False,
+        )
+
+    @classmethod
+    def _load_tokenizer_clip(cls, tokenizer_family: str) -> TokenizerClip:
+        """
+        Instantiate (once per family) the tokenizer wrapper named in
+        tokenizer_config.yaml and wrap it in a CLIP stand-in.
+
+        Raises:
+            ValueError: If the family is unknown or its tokenizer class cannot
+                be imported/constructed in this ComfyUI version.
+        """
+        with cls._load_lock:
+            cached = cls._tokenizer_clips.get(tokenizer_family)
+            if cached is not None:
+                return cached
+            cfg = cls.TOKENIZER_CONFIG.get(tokenizer_family)
+            if cfg is None:
+                raise ValueError(f"Unknown tokenizer_family '{tokenizer_family}'")
+            module_name, _, class_name = cfg["tokenizer"].rpartition(".")
+            try:
+                tokenizer_class = getattr(
+                    importlib.import_module(module_name), class_name
+                )
+            except (ImportError, AttributeError) as e:
+                raise ValueError(
+                    f"Tokenizer '{cfg['tokenizer']}' is not available in this ComfyUI version."
+                ) from e
+            tokenizer = tokenizer_class(
+                embedding_directory=folder_paths.get_folder_paths("embeddings"),
+                tokenizer_data={},
+            )
+            tokenizer_clip = TokenizerClip(tokenizer)
+            cls._tokenizer_clips[tokenizer_family] = tokenizer_clip
+            return tokenizer_clip
+
+    @classmethod
+    @override
+    def execute(
+        cls,
+        tokenizer_family: str,
+        text: str | None = None,
+        count_strategy: str = "max_stream",
+        show_token_breakdown: bool = False,
+        breakdown_offset: int = 0,
+        breakdown_limit: int = 256,
+        use_cache: bool = True,
+    ) -> io.NodeOutput:
+        """
+        Count prompt tokens for the chosen tokenizer family, using the same
+        BREAK handling, word-id based counting and breakdown as
+        FensTokenCounter.
+
+        Returns:
+            tuple: (total_tokens, context_limit, chunk_count, details, text_echo,
+                    token_breakdown_json)
+        """
+        try:
+            tokenizer_clip = cls._load_tokenizer_clip(tokenizer_family)
+        except ValueError as e:
+            msg = f"Error: {e}"
+            logging.error("FensTokenizerCounter: %s", msg)
+            return io.NodeOutput(0, 0, 0, msg, text or "", "{}")
+
+        outputs = FensTokenCounter._count_outputs(
+            tokenizer_clip,
+            text,
+            count_strategy=count_strategy,
+            show_token_breakdown=show_token_breakdown,
+            breakdown_offset=breakdown_offset,
+            breakdown_limit=breakdown_limit,
+            use_cache=use_cache,
+        )
+        desc = cls.TOKENIZER_CONFIG[tokenizer_family].get("desc", tokenizer_family)
+        details = f"Tokenizer: {desc} | {outputs[3]}"
+        return io.NodeOutput(*outputs[:3], details, *outputs[4:6])
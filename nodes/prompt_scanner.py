@@ -0,0 +1,539 @@
+from __future__ import annotations
+
+import re
+from bisect import bisect_left
+from collections.abc import Iterator
+from functools import lru_cache
+from itertools import accumulate
+from typing import NamedTuple
+
+SCAN_CACHE_SIZE = 16  # Recently scanned prompts kept (str hashes are cached)
+BARE_PAREN_WEIGHT = 1.1  # ComfyUI's multiplier for "(text)" without a weight
+MIN_WEIGHT_SEGMENT_LEN = 2  # Shortest weight-syntax segment: "()"
+
+# Special functions in reporting order.
+SPECIAL_FUNCTIONS = (
+    "TE",
+    "CAT",
+    "AVG",
+    "AND",
+    "STYLE",
+    "SDXL",
+    "SHUFFLE",
+    "SHIFT",
+    "CUT",
+)
+
+# Composition syntax of prompt-control style encoders. AND joins separately
+# encoded prompts, CAT concatenates and AVG averages encoded sub-prompts
+# within an AND part; directive calls configure encoding and are not text.
+COMPOSITION_OPERATORS = ("AND", "CAT", "AVG")
+DIRECTIVE_FUNCTIONS = ("TE", "STYLE", "SDXL", "SHUFFLE", "SHIFT", "CUT")
+DEFAULT_AVG_WEIGHT = 0.5  # AVG without an explicit "(weight)"
+
+# One precompiled alternation scanned left to right in a single pass. Every
+# branch is a fixed-length literal guarded by one-character lookarounds, so
+# scanning stays linear in the prompt length whatever the input looks like.
+#   brk:   BREAK on its own (preceded by whitespace/start, followed by
+#          whitespace, end, or , ; :) - not "breaking" or "rebreak"
+#   func:  a special function name preceded by start/whitespace/, ; ( and
+#          followed by whitespace, end, , ; ) or an opening parenthesis
+#   esc:   a backslash escaping a parenthesis (only the backslash is
+#          consumed, so the parenthesis is still seen by the paren branch)
+#   paren: any parenthesis, for weight-syntax segmentation
+_SCAN_PATTERN = re.compile(
+    r"(?P<brk>(?<!\S)BREAK(?=[\s,;:]|$))"
+    r"|(?P<func>(?<![^\s,;(])(?:" + "|".join(SPECIAL_FUNCTIONS) + r")(?=[\s,;()]|$))"
+    r"|(?P<esc>\\(?=[()]))"
+    r"|(?P<paren>[()])",
+    re.IGNORECASE | re.MULTILINE,
+)
+_PAREN_PATTERN = re.compile(r"[()]")
+# Weight parsing skips escaped parentheses: ComfyUI swaps "\\(" and "\\)" for
+# markers before parsing, so a parenthesis right after a backslash is text.
+_WEIGHT_PAREN_PATTERN = re.compile(r"(?<!\\)[()]")
+# Whitespace runs and parentheses, for cutting a prompt into pieces that do
+# not split weight syntax.
+_PIECE_PATTERN = re.compile(r"\s+|[()]")
+_NEWLINE_PATTERN = re.compile(r"\r?\n")
+# Case-sensitive, since "and" is ordinary prompt text:
+#   op:        AND / CAT / AVG on their own, optionally followed by "(arg)"
+#   directive: a directive call such as STYLE(A1111) or SDXL(1024 1024)
+_COMPOSITION_PATTERN = re.compile(
+    r"(?<!\S)(?P<op>"
+    + "|".join(COMPOSITION_OPERATORS)
+    + r")(?:\((?P<arg>[^()]*)\))?(?=\s|$)"
+    r"|(?<![^\s,;(])(?P<directive>" + "|".join(DIRECTIVE_FUNCTIONS) + r")\([^()]*\)"
+)
+# "prompt :1.2 AND ..." weights a whole AND part (A1111 syntax).
+_AND_WEIGHT_PATTERN = re.compile(r"\s*:\s*(-?\d+(?:\.\d+)?)\s*$")
+_TAG_SEPARATOR_PATTERN = re.compile(r"[,\n]")
+
+
+class PromptScan(NamedTuple):
+    """Everything the token counter needs from one pass over a prompt."""
+
+    break_spans: tuple[tuple[int, int], ...]  # (start, end) of each BREAK
+    special_functions: tuple[str, ...]  # detected names, SPECIAL_FUNCTIONS order
+    has_escaped_parens: bool
+    paren_segments: tuple[tuple[int, int], ...]  # parse_parentheses spans
+
+
+def _segment_spans(
+    text_len: int, paren_events: list[tuple[int, str]], start: int = 0
+) -> list[tuple[int, int]]:
+    """
+    Turn parenthesis positions into top-level segment spans of the text
+    between start and text_len.
+
+    Index-based equivalent of the character-by-character segmenter: a "("
+    at depth 0 closes the pending plain segment, the ")" returning to depth 0
+    closes the parenthesised one. Unbalanced ")" drives the depth negative
+    exactly as before. Runs in O(number of parentheses).
+    """
+    spans = []
+    segment_start = start
+    nesting_level = 0
+    for index, char in paren_events:
+        if char == "(":
+            if nesting_level == 0:
+                if index > segment_start:
+                    spans.append((segment_start, index))
+                segment_start = index
+            nesting_level += 1
+        else:
+            nesting_level -= 1
+            if nesting_level == 0:
+                spans.append((segment_start, index + 1))
+                segment_start = index + 1
+    if segment_start < text_len:
+        spans.append((segment_start, text_len))
+    return spans
+
+
+def _match_parentheses(events: list[tuple[int, str]]) -> list[int]:
+    """
+    Index of the event closing each "(" event, -1 for ")" events and
+    unclosed groups. A "(" closes at the first ")" that brings the balance
+    counted from it back to zero, whatever came before, so one stack pass
+    gives the matches every nesting level of the segmenter sees.
+    """
+    matches = [-1] * len(events)
+    opened = []
+    for index, (_, char) in enumerate(events):
+        if char == "(":
+            opened.append(index)
+        elif opened:
+            matches[opened.pop()] = index
+    return matches
+
+
+def _level_spans(
+    events: list[tuple[int, str]],
+    matches: list[int],
+    event_range: tuple[int, int],
+    start: int,
+    end: int,
+) -> list[tuple[int, int]]:
+    """
+    _segment_spans of text[start:end], whose events are
+    events[event_range[0]:event_range[1]], jumping from each group's "(" to
+    its matching ")" instead of walking the group's contents. Every event is
+    then looked at by one nesting level only, which keeps weight_tree linear
+    in the nesting depth.
+    """
+    spans = []
+    segment_start = start
+    nesting_level = 0
+    index, last = event_range
+    while index < last:
+        position, char = events[index]
+        index += 1
+        if char == ")":
+            nesting_level -= 1
+        elif nesting_level < 0:
+            nesting_level += 1
+        else:
+            if position > segment_start:
+                spans.append((segment_start, position))
+            close = matches[index - 1]
+            if not 0 <= close < last:
+                # Never closed in range: the group runs to the end
+                spans.append((position, end))
+                return spans
+            segment_start = events[close][0] + 1
+            spans.append((position, segment_start))
+            index = close + 1
+    if segment_start < end:
+        spans.append((segment_start, end))
+    return spans
+
+
+def parse_parentheses_spans(text: str) -> list[tuple[int, int]]:
+    """Top-level weight-syntax segment spans of text (see _segment_spans)."""
+    events = [(match.start(), match.group()) for match in _PAREN_PATTERN.finditer(text)]
+    return _segment_spans(len(text), events)
+
+
+@lru_cache(maxsize=SCAN_CACHE_SIZE)
+def scan_prompt(text: str) -> PromptScan:
+    """
+    Scan a prompt once for BREAK positions, special functions, escaped
+    parentheses and top-level parenthesis segments.
+    """
+    break_spans = []
+    found_functions = set()
+    has_escaped_parens = False
+    paren_events = []
+    for match in _SCAN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind == "paren":
+            paren_events.append((match.start(), match.group()))
+        elif kind == "brk":
+            break_spans.append(match.span())
+        elif kind == "func":
+            found_functions.add(match.group().upper())
+        else:
+            has_escaped_parens = True
+    return PromptScan(
+        tuple(break_spans),
+        tuple(name for name in SPECIAL_FUNCTIONS if name in found_functions),
+        has_escaped_parens,
+        tuple(_segment_spans(len(text), paren_events)),
+    )
+
+
+def split_on_break_spans(text: str) -> list[tuple[int, int]]:
+    """(start, end) of the stripped, non-empty segments between BREAK keywords."""
+    bounds = []
+    segment_start = 0
+    for start, end in scan_prompt(text).break_spans:
+        bounds.append((segment_start, start))
+        segment_start = end
+    bounds.append((segment_start, len(text)))
+    spans = []
+    for start, end in bounds:
+        segment = text[start:end]
+        stripped = segment.lstrip()
+        if stripped.strip():
+            begin = start + len(segment) - len(stripped)
+            spans.append((begin, begin + len(stripped.rstrip())))
+    return spans
+
+
+def split_on_break(text: str) -> list[str]:
+    """Stripped, non-empty segments of text between BREAK keywords."""
+    return [text[start:end] for start, end in split_on_break_spans(text)]
+
+
+class SubPrompt(NamedTuple):
+    """One separately encoded piece of a composed prompt."""
+
+    start: int  # Stripped span of the piece in the prompt
+    end: int
+    text: str  # What gets tokenized: the piece without directive calls
+    group: int  # Index of the AND part it belongs to
+    join: str  # "" for the first piece of an AND part, else "CAT" or "AVG"
+    weight: float  # AND weight on a part's first piece, AVG weight on AVG pieces
+
+
+class Composition(NamedTuple):
+    sub_prompts: tuple[SubPrompt, ...]  # In prompt order
+    directives: tuple[str, ...]  # Directive calls removed from the text
+
+
+def _piece_text(text: str, start: int, end: int, removed: list[tuple[int, int]]) -> str:
+    """text[start:end] without the removed spans inside it, stripped."""
+    kept, cursor = [], start
+    for cut_start, cut_end in removed:
+        if cut_start >= start and cut_end <= end:
+            kept.append(text[cursor:cut_start])
+            cursor = cut_end
+    kept.append(text[cursor:end])
+    return " ".join(part.strip() for part in kept if part.strip())
+
+
+def _operator_weight(operator: str, arg: str | None) -> float:
+    if operator != "AVG":
+        return 1.0
+    try:
+        return float(arg) if arg else DEFAULT_AVG_WEIGHT
+    except ValueError:
+        return DEFAULT_AVG_WEIGHT
+
+
+def split_composition(text: str) -> Composition:
+    """
+    Split a prompt into the sub-prompts that are encoded on their own.
+
+    The prompt is split on AND, then each AND part on CAT and AVG in prompt
+    order; operators inside weight groups are text. Directive calls are
+    removed from the sub-prompts and listed. With more than one AND part,
+    a trailing ":weight" on a part is its AND weight. Offsets refer to text;
+    escaped parentheses stay as typed.
+    """
+    events = [
+        (match.start(), match.group()) for match in _WEIGHT_PAREN_PATTERN.finditer(text)
+    ]
+    event_starts = [index for index, _ in events]
+    depths = list(accumulate(1 if char == "(" else -1 for _, char in events))
+    pieces: list[tuple[int, int, str, str | None]] = []
+    removed: list[tuple[int, int]] = []
+    piece_start, operator, arg = 0, "", None
+    for match in _COMPOSITION_PATTERN.finditer(text):
+        before = bisect_left(event_starts, match.start())
+        if before and depths[before - 1] > 0:
+            continue
+        if match.group("directive"):
+            removed.append(match.span())
+            continue
+        pieces.append((piece_start, match.start(), operator, arg))
+        piece_start, operator, arg = match.end(), match.group("op"), match.group("arg")
+    pieces.append((piece_start, len(text), operator, arg))
+
+    has_and = any(operator == "AND" for _, _, operator, _ in pieces)
+    sub_prompts: list[SubPrompt] = []
+    group, part_first = -1, 0
+    for index, (start, end, operator, arg) in enumerate(pieces):
+        first = index == 0 or operator == "AND"
+        if first:
+            group, part_first = group + 1, index
+        piece = _piece_text(text, start, end, removed)
+        last = index == len(pieces) - 1 or pieces[index + 1][2] == "AND"
+        weight_match = _AND_WEIGHT_PATTERN.search(piece) if has_and and last else None
+        if weight_match:
+            piece = piece[: weight_match.start()]
+        segment = text[start:end]
+        stripped = segment.lstrip()
+        begin = start + len(segment) - len(stripped)
+        sub_prompts.append(
+            SubPrompt(
+                begin,
+                begin + len(stripped.rstrip()),
+                piece,
+                group,
+                "" if first else operator,
+                1.0 if first else _operator_weight(operator, arg),
+            )
+        )
+        if weight_match:
+            sub_prompts[part_first] = sub_prompts[part_first]._replace(
+                weight=float(weight_match.group(1))
+            )
+    return Composition(
+        tuple(sub_prompts), tuple(text[start:end] for start, end in removed)
+    )
+
+
+class WeightGroup(NamedTuple):
+    """A parenthesised span of a prompt and the weight it applies."""
+
+    start: int  # Position of "("
+    end: int  # Position after ")"
+    weight: float
+    depth: int  # 1 for a top-level group
+    parent: int  # Index of the enclosing group, -1 at top level
+
+
+class WeightSpan(NamedTuple):
+    """A run of plain text and its effective weight (one token_weights entry)."""
+
+    start: int
+    end: int
+    weight: float
+    group: int  # Index of the innermost enclosing group, -1 at top level
+
+
+class WeightTree(NamedTuple):
+    spans: tuple[WeightSpan, ...]  # In text order
+    groups: tuple[WeightGroup, ...]  # In text order of their "("
+
+
+def unescape_parentheses(text: str) -> str:
+    """Turn "\\(" and "\\)" into literal parentheses, as ComfyUI does."""
+    return text.replace("\\)", ")").replace("\\(", "(")
+
+
+def unescape_offsets(text: str) -> list[int]:
+    """
+    Position in text of every character of unescape_parentheses(text), plus
+    len(text) for the end, so offsets into the unescaped prompt can be
+    mapped back to what the user typed.
+    """
+    origin = list(range(len(text)))
+    current = text
+    for escaped in ("\\)", "\\("):
+        removed = set()
+        index = current.find(escaped)
+        while index >= 0:
+            removed.add(index)
+            index = current.find(escaped, index + len(escaped))
+        if removed:
+            origin = [pos for i, pos in enumerate(origin) if i not in removed]
+            current = current.replace(escaped, escaped[1])
+    origin.append(len(text))
+    return origin
+
+
+def piece_spans(
+    text: str, start: int, end: int, first_chars: int, max_chars: int
+) -> Iterator[tuple[int, int]]:
+    """
+    Cut text[start:end] into consecutive (start, end) pieces that each end
+    at whitespace outside parentheses, so every piece parses its weight
+    syntax exactly as the whole text would.
+
+    Pieces start at about first_chars characters and double up to
+    max_chars. A piece only grows past its target when there is no safe
+    cut in it (a long group or word). Works through the text lazily, so
+    the caller can stop early without the rest being scanned.
+    """
+    piece_start = start
+    target = first_chars
+    while piece_start < end:
+        limit = piece_start + target
+        cut = end
+        depth = 0  # Pieces always start outside parentheses
+        for match in _PIECE_PATTERN.finditer(text, piece_start, end):
+            char = match.group()
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                depth = max(depth - 1, 0)
+            elif depth == 0 and match.start() > piece_start and match.end() >= limit:
+                cut = match.start()
+                break
+        yield piece_start, cut
+        piece_start = cut
+        target = min(target * 2, max_chars)
+
+
+def line_spans(text: str) -> list[tuple[int, int]]:
+    """(start, end) of every line of text, without the newline."""
+    spans = []
+    start = 0
+    for match in _NEWLINE_PATTERN.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(text)))
+    return spans
+
+
+def tag_spans(text: str) -> list[tuple[int, int]]:
+    """
+    (start, end) of the stripped, non-empty comma-separated tags of text.
+    Newlines and BREAK keywords also end a tag.
+    """
+    spans = []
+    for seg_start, seg_end in split_on_break_spans(text):
+        start = seg_start
+        for match in _TAG_SEPARATOR_PATTERN.finditer(text, seg_start, seg_end):
+            spans.append((start, match.start()))
+            start = match.end()
+        spans.append((start, seg_end))
+    stripped = []
+    for start, end in spans:
+        tag = text[start:end]
+        if tag.strip():
+            begin = start + len(tag) - len(tag.lstrip())
+            stripped.append((begin, begin + len(tag.strip())))
+    return stripped
+
+
+def _explicit_weight(
+    text: str, start: int, end: int, search_start: int | None = None
+) -> tuple[float, int] | None:
+    """
+    Parse a trailing ":weight" of a group's inner text[start:end] the way
+    ComfyUI does (last colon, not at the start, rest parses as a float).
+
+    A weight never contains parentheses, so callers may pass search_start
+    after the last parenthesis in the group to skip rescanning nested
+    groups for a colon.
+
+    Returns:
+        (weight, end_of_text_before_colon), or None when there is none.
+    """
+    colon = text.rfind(":", start if search_start is None else search_start, end)
+    if colon <= start:
+        return None
+    try:
+        return float(text[colon + 1 : end]), colon
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=SCAN_CACHE_SIZE)
+def weight_tree(text: str, base_weight: float = 1.0) -> WeightTree:
+    """
+    Parse weight syntax into plain-text spans with their effective weights.
+
+    Follows ComfyUI's recursive token_weights: "(text:1.3)" sets the weight,
+    "(text)" multiplies the enclosing weight by 1.1, groups nest, escaped
+    parentheses are text, and unbalanced parentheses segment exactly like
+    parse_parentheses. Implemented with an explicit stack, so deep nesting
+    cannot hit the recursion limit, and with parentheses matched once up
+    front (see _level_spans), so time stays linear in the nesting depth.
+    Offsets refer to text itself.
+    """
+    events = [
+        (match.start(), match.group()) for match in _WEIGHT_PAREN_PATTERN.finditer(text)
+    ]
+    event_starts = [index for index, _ in events]
+    matches = _match_parentheses(events)
+    spans: list[WeightSpan] = []
+    groups: list[WeightGroup] = []
+    # Work items: ("parse", start, end, weight, group) splits text[start:end]
+    # into segments; ("span", ...) emits a plain-text span. Items are pushed
+    # in reverse so spans come out in text order.
+    stack: list[tuple[str, int, int, float, int]] = [
+        ("parse", 0, len(text), base_weight, -1)
+    ]
+    while stack:
+        kind, start, end, weight, group = stack.pop()
+        if kind == "span":
+            spans.append(WeightSpan(start, end, weight, group))
+            continue
+        event_range = (bisect_left(event_starts, start), bisect_left(event_starts, end))
+        items = []
+        for seg_start, seg_end in _level_spans(
+            events, matches, event_range, start, end
+        ):
+            if (
+                seg_end - seg_start < MIN_WEIGHT_SEGMENT_LEN
+                or text[seg_start] != "("
+                or text[seg_end - 1] != ")"
+                or text[seg_end - 2] == "\\"
+            ):
+                items.append(("span", seg_start, seg_end, weight, group))
+                continue
+            inner_start, inner_end = seg_start + 1, seg_end - 1
+            group_weight = weight * BARE_PAREN_WEIGHT
+            last_event = bisect_left(event_starts, inner_end) - 1
+            explicit = _explicit_weight(
+                text,
+                inner_start,
+                inner_end,
+                max(inner_start, event_starts[last_event] + 1),
+            )
+            if explicit is not None:
+                group_weight, inner_end = explicit
+            parent_depth = groups[group].depth if group >= 0 else 0
+            groups.append(
+                WeightGroup(seg_start, seg_end, group_weight, parent_depth + 1, group)
+            )
+            items.append(
+                ("parse", inner_start, inner_end, group_weight, len(groups) - 1)
+            )
+        stack.extend(reversed(items))
+
+    # Groups are created level by level; renumber them in text order.
+    order = sorted(range(len(groups)), key=lambda index: groups[index].start)
+    new_index = {old: new for new, old in enumerate(order)}
+    new_index[-1] = -1
+    return WeightTree(
+        tuple(span._replace(group=new_index[span.group]) for span in spans),
+        tuple(
+            groups[old]._replace(parent=new_index[groups[old].parent]) for old in order
+        ),
+    )
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+
+from .prompt_scanner import line_spans, tag_spans, unescape_offsets
+from .token_arrays import TokenStream
+from .weight_attribution import WeightLayout, assign_spans
+
+ALIGN_WINDOW = 64  # Characters searched past the cursor for a token's text
+# Word-boundary markers of common vocabularies: CLIP BPE ("cat</w>"),
+# SentencePiece ("▁cat") and byte-level BPE ("Ġcat", "Ċ" for newline).
+_TOKEN_MARKERS = ("</w>", "▁", "Ġ", "Ċ")
+
+
+def _token_text(decoded: str | None) -> str:
+    """Decoded token text as it can appear in the lower-cased prompt."""
+    if not decoded:
+        return ""
+    for marker in _TOKEN_MARKERS:
+        decoded = decoded.replace(marker, " ")
+    return decoded.strip().lower()
+
+
+def _token_id(stream: TokenStream, position: int) -> Any:
+    """Token id at a slot, from the original entry for object slots."""
+    item = stream.objects.get(position)
+    if item is None:
+        return int(stream.token_ids[position])
+    return item[0] if isinstance(item, (tuple, list)) and item else item
+
+
+def _token_regions(
+    text: str,
+    stream: TokenStream,
+    layout: WeightLayout,
+    sub_tokenizer: Any,
+) -> tuple[list[int], list[tuple[int, int] | None]]:
+    """
+    Slot position and enclosing character range of each typed token: its
+    weighted span, or its whole BREAK segment for tokenizers that ignore
+    weight syntax (None = unknown).
+    """
+    positions, span_ids, weights_disabled = assign_spans(
+        text, stream, layout, sub_tokenizer
+    )
+    if not weights_disabled:
+        spans = layout.spans
+        return positions.tolist(), [
+            (spans[span_id].start, spans[span_id].end) if span_id >= 0 else None
+            for span_id in span_ids.tolist()
+        ]
+    regions: list[tuple[int, int] | None] = []
+    for segment_index, window in enumerate(stream.segment_slices()):
+        typed = int(np.count_nonzero(stream.word_ids[window] > 0))
+        bound = (
+            layout.bounds[segment_index] if segment_index < len(layout.bounds) else None
+        )
+        regions.extend([bound] * typed)
+    return positions.tolist(), regions
+
+
+def align_tokens(
+    text: str,
+    stream: TokenStream,
+    layout: WeightLayout,
+    sub_tokenizer: Any,
+    decode: Callable[[Any], str | None],
+) -> np.ndarray:
+    """
+    Character offset into text at which each typed token of one stream
+    starts, in token order (-1 = not placed).
+
+    ComfyUI's tokenizers return no character offsets, so they are
+    recovered from the stream that was already tokenized: word ids give
+    each token's weighted span (see assign_spans), and within the span the
+    decoded token texts are matched left to right against the prompt.
+    Tokens whose text cannot be matched (byte fallbacks, embeddings) are
+    placed at the current position, so they still land on the right word.
+
+    decode(token_id) returns a token's vocabulary text or None.
+    """
+    positions, regions = _token_regions(text, stream, layout, sub_tokenizer)
+    lowered = text.lower()
+    offsets = np.full(len(positions), -1, dtype=np.int64)
+    cursor = 0
+    for index, (position, region) in enumerate(zip(positions, regions, strict=True)):
+        if region is None:
+            continue
+        start, end = region
+        cursor = min(max(cursor, start), end)
+        piece = _token_text(decode(_token_id(stream, position)))
+        if piece:
+            found = lowered.find(
+                piece, cursor, min(end, cursor + ALIGN_WINDOW + len(piece))
+            )
+            if found >= 0:
+                offsets[index] = found
+                cursor = found + len(piece)
+                continue
+        while cursor < end - 1 and text[cursor].isspace():
+            cursor += 1
+        offsets[index] = cursor if cursor < end else max(start, end - 1)
+    return offsets
+
+
+def token_offsets(
+    text: str,
+    cleaned_text: str,
+    layout: WeightLayout,
+    stream: TokenStream,
+    *,
+    sub_tokenizer: Any,
+    decode: Callable[[Any], str | None],
+) -> np.ndarray:
+    """
+    Start of each typed token as a character offset into text, the prompt
+    as typed (-1 = not placed). layout is built from cleaned_text, the
+    prompt that was tokenized; offsets are mapped back through the
+    unescaping of \\( and \\).
+    """
+    offsets = align_tokens(cleaned_text, stream, layout, sub_tokenizer, decode)
+    if cleaned_text == text:
+        return offsets
+    origin = np.array(unescape_offsets(text), dtype=np.int64)
+    return np.where(offsets >= 0, origin[np.maximum(offsets, 0)], -1)
+
+
+def limit_offset(
+    offsets: dict[str, np.ndarray],
+    counted: dict[str, int],
+    limit: int,
+    *,
+    sum_streams: bool,
+) -> int:
+    """
+    Character offset of the token that takes the count over limit.
+
+    offsets holds each stream's token offsets in the text being looked at
+    (-1 = not placed, treated as its start), counted the tokens each stream
+    had before it. With sum_streams the streams share the limit; otherwise
+    the stream that goes over first decides. Returns -1 if none goes over.
+    """
+    placed = {name: np.sort(np.maximum(values, 0)) for name, values in offsets.items()}
+    if sum_streams:
+        merged = np.sort(
+            np.concatenate([np.zeros(0, dtype=np.int64), *placed.values()])
+        )
+        index = limit - sum(counted.values())
+        return int(merged[max(index, 0)]) if index < len(merged) else -1
+    crossings = []
+    for name, values in placed.items():
+        index = limit - counted.get(name, 0)
+        if index < len(values):
+            crossings.append(int(values[max(index, 0)]))
+    return min(crossings, default=-1)
+
+
+def count_in_ranges(offsets: np.ndarray, ranges: list[tuple[int, int]]) -> list[int]:
+    """Tokens starting inside each (start, end) character range."""
+    placed = np.sort(offsets[offsets >= 0])
+    if not ranges:
+        return []
+    bounds = np.array(ranges, dtype=np.int64)
+    counts = np.searchsorted(placed, bounds[:, 1], side="left") - np.searchsorted(
+        placed, bounds[:, 0], side="left"
+    )
+    return counts.tolist()
+
+
+def source_counts(
+    text: str,
+    cleaned_text: str,
+    layout: WeightLayout,
+    streams: dict[str, TokenStream],
+    *,
+    sub_tokenizers: dict[str, Any],
+    decoders: dict[str, Callable[[Any], str | None]],
+) -> dict[str, Any]:
+    """
+    Token counts per line and per comma-separated tag of the prompt, for
+    every stream, from one tokenization.
+
+    layout is built from cleaned_text (what was tokenized); offsets are
+    mapped back to text, so escaped parentheses and BREAK segments do not
+    shift them. sub_tokenizers and decoders are keyed by stream name,
+    decoders as for align_tokens.
+
+    Returns:
+        {"lines": [{"line", "start", "end", "text"}], "tags": [{"start",
+        "end", "text"}], "streams": {name: {"lines": [...], "tags": [...],
+        "unplaced": int, "offsets": [...]}}} with character offsets into
+        text; "offsets" holds each typed token's start (-1 = not placed),
+        so any other span can be counted from it.
+    """
+    lines = line_spans(text)
+    tags = tag_spans(text)
+    results = {}
+    for stream_name, stream in streams.items():
+        offsets = token_offsets(
+            text,
+            cleaned_text,
+            layout,
+            stream,
+            sub_tokenizer=sub_tokenizers.get(stream_name),
+            decode=decoders[stream_name],
+        )
+        results[stream_name] = {
+            "lines": count_in_ranges(offsets, lines),
+            "tags": count_in_ranges(offsets, tags),
+            "unplaced": int(np.count_nonzero(offsets < 0)),
+            "offsets": offsets.tolist(),
+        }
+    return {
+        "lines": [
+            {"line": number, "start": start, "end": end, "text": text[start:end]}
+            for number, (start, end) in enumerate(lines, start=1)
+        ],
+        "tags": [
+            {"start": start, "end": end, "text": text[start:end]} for start, end in tags
+        ],
+        "streams": results,
+    }
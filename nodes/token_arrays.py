@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
+from itertools import chain
+from operator import itemgetter
+from typing import Any, NamedTuple
+
+import numpy as np
+
+WORD_ID_INDEX = 2  # Position of word_id in a (token_id, weight, word_id) tuple
+MIN_WORD_ID_TUPLE_LEN = 3  # Shortest token tuple that carries a word_id
+UNTRACKED_WORD_ID = 1  # Stand-in for items without a word_id (always counted)
+OPAQUE_WORD_ID = int(np.iinfo(np.int32).min)  # Non-int word_id: shown, not counted
+INT32_MIN = int(np.iinfo(np.int32).min)
+INT32_MAX = int(np.iinfo(np.int32).max)
+OBJECT_TOKEN_ID = -1  # Placeholder id for entries kept as Python objects
+
+_get_token_id = itemgetter(0)
+_get_weight = itemgetter(1)
+_get_word_id = itemgetter(WORD_ID_INDEX)
+# (getter, exact Python type, column dtype) of a plain entry's fields
+_PLAIN_COLUMNS = (
+    (_get_token_id, int, np.int32),
+    (_get_weight, float, np.float64),
+    (_get_word_id, int, np.int32),
+)
+
+
+class StreamArrays(NamedTuple):
+    """Compact columnar view of one stream's batches."""
+
+    word_ids: np.ndarray  # int32, one entry per token slot (padding included)
+    batch_lengths: np.ndarray  # int32, slots per batch/chunk
+
+
+class StreamSummary(NamedTuple):
+    prompt_tokens: int
+    context_limit_tokens: int
+    chunk_count: int
+
+
+def _word_id_or_marker(token_item: Any) -> int:
+    """
+    Slow-path word id extraction matching the original per-tuple rules:
+    tuples carrying a non-int word id are not counted (but still listed in
+    breakdowns), while bare ids and short tuples (no word id at all) are
+    always counted.
+    """
+    if isinstance(token_item, (tuple, list)) and len(token_item) >= (
+        MIN_WORD_ID_TUPLE_LEN
+    ):
+        word_id = token_item[WORD_ID_INDEX]
+        return word_id if isinstance(word_id, int) else OPAQUE_WORD_ID
+    return UNTRACKED_WORD_ID
+
+
+class TokenStream:
+    """
+    Compact columnar form of one tokenizer stream.
+
+    Replaces the tokenizer's nested batches of (token_id, weight, word_id)
+    tuples (100+ bytes per token) with flat NumPy columns (16 bytes per
+    token) plus per-batch lengths. Entries that do not fit the columns -
+    embedding tensors as token ids, bare ids, short tuples, non-int word
+    ids - keep their original object in a sparse position map, so
+    item() and to_batches() give back exactly what the tokenizer returned.
+    """
+
+    __slots__ = (
+        "batch_lengths",
+        "objects",
+        "segment_batches",
+        "token_ids",
+        "weights",
+        "word_ids",
+    )
+
+    def __init__(
+        self,
+        token_ids: np.ndarray,
+        weights: np.ndarray,
+        word_ids: np.ndarray,
+        batch_lengths: np.ndarray,
+        objects: dict[int, Any] | None = None,
+        *,
+        segment_batches: np.ndarray | None = None,
+    ) -> None:
+        self.token_ids = token_ids  # int32, OBJECT_TOKEN_ID for object entries
+        self.weights = weights  # float64
+        self.word_ids = word_ids  # int32, see UNTRACKED/OPAQUE_WORD_ID
+        self.batch_lengths = batch_lengths  # int32, slots per batch/chunk
+        self.objects = objects or {}  # flat position -> original entry
+        # int32 batches per BREAK segment; None = a single tokenizer call
+        self.segment_batches = segment_batches
+
+    @classmethod
+    def from_batches(cls, stream_batches: list[list[Any]]) -> TokenStream:
+        """
+        Convert tokenizer batches in one pass per column.
+
+        Entries are flattened once and type-checked column by column with
+        C-level maps (see _plain_columns); a stream with any entry the
+        columns cannot hold exactly (not a 3-tuple, tensor or float id, int
+        weight, non-int word id) switches to a per-item conversion, so
+        item() and to_batches() give back exactly what the tokenizer
+        returned.
+        """
+        batch_lengths = np.fromiter(
+            (len(batch) for batch in stream_batches),
+            dtype=np.int32,
+            count=len(stream_batches),
+        )
+        entries = list(chain.from_iterable(stream_batches))
+        columns = _plain_columns(entries)
+        if columns is None:
+            return cls._from_irregular(entries, batch_lengths)
+        return cls(*columns, batch_lengths)
+
+    @classmethod
+    def _from_irregular(
+        cls, items: Iterable[Any], batch_lengths: np.ndarray
+    ) -> TokenStream:
+        token_ids, weights, word_ids = [], [], []
+        objects = {}
+        for position, item in enumerate(items):
+            if _is_plain(item):
+                token_ids.append(item[0])
+                weights.append(item[1])
+                word_ids.append(item[WORD_ID_INDEX])
+                continue
+            objects[position] = item
+            token_id = item[0] if isinstance(item, (tuple, list)) and item else item
+            token_ids.append(token_id if _is_int32(token_id) else OBJECT_TOKEN_ID)
+            weights.append(1.0)
+            word_ids.append(_word_id_or_marker(item))
+        return cls(
+            np.array(token_ids, dtype=np.int32),
+            np.array(weights, dtype=np.float64),
+            np.array(word_ids, dtype=np.int32),
+            batch_lengths,
+            objects,
+        )
+
+    @classmethod
+    def concat(cls, streams: list[TokenStream]) -> TokenStream:
+        """
+        Join streams batch-wise, e.g. the per-segment results of a BREAK
+        prompt. Each input stream's segments stay separate segments.
+        """
+        if len(streams) == 1:
+            return streams[0]
+        objects = {}
+        offset = 0
+        for stream in streams:
+            objects.update(
+                (offset + position, item) for position, item in stream.objects.items()
+            )
+            offset += len(stream)
+        return cls(
+            np.concatenate([s.token_ids for s in streams]).astype(np.int32),
+            np.concatenate([s.weights for s in streams]).astype(np.float64),
+            np.concatenate([s.word_ids for s in streams]).astype(np.int32),
+            np.concatenate([s.batch_lengths for s in streams]).astype(np.int32),
+            objects,
+            segment_batches=np.concatenate(
+                [s.segment_batch_counts() for s in streams]
+            ).astype(np.int32),
+        )
+
+    def __len__(self) -> int:
+        return len(self.word_ids)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.token_ids.nbytes
+            + self.weights.nbytes
+            + self.word_ids.nbytes
+            + self.batch_lengths.nbytes
+            + (0 if self.segment_batches is None else self.segment_batches.nbytes)
+        )
+
+    def segment_batch_counts(self) -> np.ndarray:
+        """Batches contributed by each BREAK segment, in order."""
+        if self.segment_batches is None:
+            return np.array([len(self.batch_lengths)], dtype=np.int32)
+        return self.segment_batches
+
+    def segment_slices(self) -> list[slice]:
+        """Flat slot range of each BREAK segment, in order."""
+        slot_ends = np.cumsum(self.batch_lengths, dtype=np.int64).tolist()
+        slices = []
+        start = batch_index = 0
+        for count in self.segment_batch_counts().tolist():
+            batch_index += count
+            end = slot_ends[batch_index - 1] if batch_index else 0
+            slices.append(slice(start, end))
+            start = end
+        return slices
+
+    def item(self, position: int) -> Any:
+        """The tokenizer entry at a flat slot position, as originally returned."""
+        if position in self.objects:
+            return self.objects[position]
+        return (
+            int(self.token_ids[position]),
+            float(self.weights[position]),
+            int(self.word_ids[position]),
+        )
+
+    def to_batches(self) -> list[list[Any]]:
+        """Rebuild the tokenizer's nested batches of entries."""
+        entries = list(
+            zip(
+                self.token_ids.tolist(),
+                self.weights.tolist(),
+                self.word_ids.tolist(),
+                strict=True,
+            )
+        )
+        for position, item in self.objects.items():
+            entries[position] = item
+        batches = []
+        start = 0
+        for length in self.batch_lengths.tolist():
+            batches.append(entries[start : start + length])
+            start += length
+        return batches
+
+
+def _is_int32(value: Any) -> bool:
+    return (
+        isinstance(value, int)
+        and not isinstance(value, bool)
+        and INT32_MIN < value <= INT32_MAX
+    )
+
+
+def _is_plain(item: Any) -> bool:
+    """True for a (int token_id, float weight, int word_id) entry."""
+    return (
+        isinstance(item, tuple)
+        and len(item) == MIN_WORD_ID_TUPLE_LEN
+        and _is_int32(item[0])
+        and isinstance(item[1], float)
+        and _is_int32(item[WORD_ID_INDEX])
+    )
+
+
+def _all_of_type(values: list[Any], value_type: type) -> bool:
+    """True if every value's type is exactly value_type (bools pass as int)."""
+    if value_type is not int:
+        return not set(map(type, values)) - {value_type}
+    # An int sum means all ints, at a fraction of a per-item type check: a
+    # float, NumPy scalar or tensor changes its type.
+    try:
+        return type(sum(values)) is int
+    except TypeError:
+        return False
+
+
+def _plain_columns(
+    entries: list[Any],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+    """
+    Token id, weight and word id columns if every entry is plain (see
+    _is_plain), else None. Types are checked up front because np.fromiter
+    silently truncates floats (and parses strings) into integer columns.
+    """
+    if set(map(type, entries)) - {tuple}:
+        return None
+    if set(map(len, entries)) - {MIN_WORD_ID_TUPLE_LEN}:
+        return None
+    columns = []
+    for getter, column_type, dtype in _PLAIN_COLUMNS:
+        values = list(map(getter, entries))
+        if not _all_of_type(values, column_type):
+            return None
+        try:
+            column = np.fromiter(values, dtype=dtype, count=len(values))
+        except OverflowError:
+            return None
+        # INT32_MIN doubles as OPAQUE_WORD_ID, so _is_int32 rejects it too.
+        if column_type is int and (column == INT32_MIN).any():
+            return None
+        columns.append(column)
+    return tuple(columns)
+
+
+def compact_streams(
+    token_streams: Any, segment_batches: dict[str, list[int]] | None = None
+) -> Any:
+    """
+    Convert a clip.tokenize result into {stream_name: TokenStream}.
+    Anything that is not a {stream: batches} dict is returned unchanged.
+
+    segment_batches optionally gives, per stream, how many of its batches
+    each BREAK segment contributed.
+    """
+    if not isinstance(token_streams, dict):
+        return token_streams
+    streams = {
+        stream_name: (
+            batches
+            if isinstance(batches, TokenStream)
+            else TokenStream.from_batches(batches)
+        )
+        for stream_name, batches in token_streams.items()
+    }
+    for stream_name, counts in (segment_batches or {}).items():
+        if stream_name in streams:
+            streams[stream_name].segment_batches = np.array(counts, dtype=np.int32)
+    return streams
+
+
+def as_token_stream(stream: TokenStream | list[list[Any]]) -> TokenStream:
+    return (
+        stream if isinstance(stream, TokenStream) else TokenStream.from_batches(stream)
+    )
+
+
+def stream_arrays(stream_batches: list[list[Any]] | TokenStream) -> StreamArrays:
+    """
+    Convert a stream's batches of (token_id, weight, word_id) tuples into
+    compact NumPy columns in one pass. A TokenStream already holds them.
+
+    The fast path pulls word ids out with a C-level itemgetter; streams with
+    irregular items (bare ids, short tuples, non-int word ids) fall back to a
+    per-item conversion with the same counting semantics.
+    """
+    if isinstance(stream_batches, TokenStream):
+        return StreamArrays(stream_batches.word_ids, stream_batches.batch_lengths)
+    batch_lengths = np.fromiter(
+        (len(batch) for batch in stream_batches),
+        dtype=np.int32,
+        count=len(stream_batches),
+    )
+    total = int(batch_lengths.sum())
+    flat = chain.from_iterable(stream_batches)
+    try:
+        word_ids = np.fromiter(map(_get_word_id, flat), dtype=np.int32, count=total)
+    except (TypeError, IndexError, ValueError, OverflowError):
+        word_ids = np.fromiter(
+            map(_word_id_or_marker, chain.from_iterable(stream_batches)),
+            dtype=np.int32,
+            count=total,
+        )
+    return StreamArrays(word_ids, batch_lengths)
+
+
+def summarize_stream(stream_batches: list[list[Any]] | TokenStream) -> StreamSummary:
+    """
+    Typed-token count, padded slot total and chunk count for one stream,
+    computed with vectorized reductions over its compact arrays.
+    """
+    arrays = stream_arrays(stream_batches)
+    return StreamSummary(
+        int(np.count_nonzero(arrays.word_ids > 0)),
+        int(arrays.batch_lengths.sum()),
+        len(arrays.batch_lengths),
+    )
+
+
+def visible_positions(arrays: StreamArrays) -> np.ndarray:
+    """
+    Flat slot positions of tokens that belong in a breakdown: everything
+    except special/padding tokens (int word_id <= 0).
+    """
+    word_ids = arrays.word_ids
+    return np.flatnonzero((word_ids > 0) | (word_ids == OPAQUE_WORD_ID))
+
+
+def batch_offsets(arrays: StreamArrays) -> np.ndarray:
+    """Flat slot position at which each batch starts."""
+    offsets = np.zeros(len(arrays.batch_lengths), dtype=np.int64)
+    np.cumsum(arrays.batch_lengths[:-1], out=offsets[1:])
+    return offsets
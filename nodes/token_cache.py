@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any
+
+from .token_arrays import TokenStream
+
+TOKEN_CACHE_MAX_ENTRIES = 256  # Max cached prompt tokenizations
+TOKEN_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Approximate memory budget (64 MiB)
+SEGMENT_CACHE_MAX_ENTRIES = 1024  # Max cached BREAK-segment tokenizations
+SEGMENT_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Approximate memory budget (64 MiB)
+TOKEN_ENTRY_BYTES = 120  # Rough CPython footprint of one (id, weight, word_id) tuple
+BATCH_OVERHEAD_BYTES = 64  # Rough footprint of one batch list object
+MAX_DECODE_TABLE_SIZE = 1_000_000  # Larger vocabularies decode per token instead
+DECODE_BATCH_SIZE = 4096  # Ids per batched decode call when building a table
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache bounded by entry count and bytes.
+
+    Sizes are caller-supplied estimates; an entry larger than the whole byte
+    budget is simply not stored. Hit/miss counters are kept for reporting.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Any, tuple[Any, int]] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def get(self, key: Any) -> Any | None:
+        """Return the cached value for key (marking it recently used) or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Any, value: Any, size: int) -> None:
+        """Store value under key, evicting least-recently-used entries as needed."""
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._total_bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or self._total_bytes > self.max_bytes
+            ):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+    def clear(self) -> None:
+        """Drop every entry and reset the hit/miss counters."""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+def estimate_streams_bytes(token_streams: dict[str, Any]) -> int:
+    """
+    Approximate the in-memory size of a tokenizer result, either raw
+    {stream: batches} or compact {stream: TokenStream}.
+    """
+    total = 0
+    for batches in token_streams.values():
+        if isinstance(batches, TokenStream):
+            total += batches.nbytes + len(batches.objects) * TOKEN_ENTRY_BYTES
+            continue
+        for batch in batches:
+            total += BATCH_OVERHEAD_BYTES + len(batch) * TOKEN_ENTRY_BYTES
+    return total
+
+
+def iter_sub_tokenizers(clip: Any) -> list[tuple[str, Any]]:
+    """
+    List (stream_name, sub_tokenizer) pairs found on clip.tokenizer.
+
+    A sub-tokenizer is any attribute exposing tokenize_with_weights. The
+    stream name drops the "clip_" prefix used by SD1/SDXL-style wrappers
+    (attribute "clip_l" -> stream "l"), matching the keys clip.tokenize returns.
+    """
+    tokenizer = getattr(clip, "tokenizer", None)
+    if tokenizer is None:
+        return []
+    try:
+        attributes = vars(tokenizer)
+    except TypeError:
+        return []
+    found = []
+    for attr_name, value in sorted(attributes.items()):
+        if value is tokenizer or not callable(
+            getattr(value, "tokenize_with_weights", None)
+        ):
+            continue
+        stream_name = attr_name.removeprefix("clip_")
+        found.append((stream_name, value))
+    return found
+
+
+def _vocab_size(sub_tokenizer: Any) -> int:
+    """Best-effort vocabulary size for a sub-tokenizer (-1 if unknown)."""
+    inv_vocab = getattr(sub_tokenizer, "inv_vocab", None)
+    if inv_vocab is not None:
+        try:
+            return len(inv_vocab)
+        except TypeError:
+            pass
+    for obj in (sub_tokenizer, getattr(sub_tokenizer, "tokenizer", None)):
+        size = getattr(obj, "vocab_size", None)
+        if isinstance(size, int):
+            return size
+    return -1
+
+
+def tokenizer_fingerprint(clip: Any) -> str:
+    """
+    Build a stable fingerprint of the tokenizer stack behind a CLIP object.
+
+    Combines the wrapper class, each sub-tokenizer's stream name, class,
+    vocab size and padding/embedding settings, plus any tokenizer options
+    set on the CLIP object, so two CLIPs that tokenize identically share
+    cache entries while a different encoder stack never does.
+    """
+    tokenizer = getattr(clip, "tokenizer", None)
+    if tokenizer is None:
+        return ""
+    wrapper_type = type(tokenizer)
+    parts = [f"{wrapper_type.__module__}.{wrapper_type.__qualname__}"]
+    for stream_name, sub_tokenizer in iter_sub_tokenizers(clip):
+        sub_type = type(sub_tokenizer)
+        parts.append(
+            ":".join(
+                str(part)
+                for part in (
+                    stream_name,
+                    f"{sub_type.__module__}.{sub_type.__qualname__}",
+                    _vocab_size(sub_tokenizer),
+                    getattr(sub_tokenizer, "max_length", None),
+                    getattr(sub_tokenizer, "min_length", None),
+                    getattr(sub_tokenizer, "pad_to_max_length", None),
+                    getattr(sub_tokenizer, "embedding_directory", None),
+                )
+            )
+        )
+    options = getattr(clip, "tokenizer_options", None)
+    if isinstance(options, dict) and options:
+        parts.append(repr(sorted(options.items(), key=lambda item: str(item[0]))))
+    return hashlib.sha1(
+        "|".join(parts).encode("utf-8"), usedforsecurity=False
+    ).hexdigest()
+
+
+def _decode_table_marker(sub_tokenizer: Any) -> int:
+    """Vocabulary size used to detect a mutated tokenizer (-1 if unknown)."""
+    return _vocab_size(sub_tokenizer)
+
+
+def _build_decode_table(sub_tokenizer: Any) -> list[str | None] | None:
+    """
+    Build a dense id -> text list for a sub-tokenizer.
+
+    Uses inv_vocab when present; otherwise decodes every id, in batches via
+    batch_decode when the tokenizer has it, falling back to one decode call
+    per id. Ids that fail to decode map to None.
+    """
+    inv_vocab = getattr(sub_tokenizer, "inv_vocab", None)
+    if isinstance(inv_vocab, dict) and inv_vocab:
+        int_ids = [token_id for token_id in inv_vocab if isinstance(token_id, int)]
+        if not int_ids or max(int_ids) >= MAX_DECODE_TABLE_SIZE or min(int_ids) < 0:
+            return None
+        table: list[str | None] = [None] * (max(int_ids) + 1)
+        for token_id in int_ids:
+            table[token_id] = inv_vocab[token_id]
+        return table
+
+    size = _vocab_size(sub_tokenizer)
+    decode_fn = getattr(sub_tokenizer, "decode", None)
+    if size <= 0 or size > MAX_DECODE_TABLE_SIZE or not callable(decode_fn):
+        return None
+    table = [None] * size
+    batch_decode_fn = getattr(sub_tokenizer, "batch_decode", None)
+    for start in range(0, size, DECODE_BATCH_SIZE):
+        ids = range(start, min(start + DECODE_BATCH_SIZE, size))
+        if callable(batch_decode_fn):
+            try:
+                table[start : start + len(ids)] = batch_decode_fn(
+                    [[token_id] for token_id in ids]
+                )
+                continue
+            except Exception:
+                batch_decode_fn = None  # unsupported; decode one by one below
+        for token_id in ids:
+            try:
+                table[token_id] = decode_fn([token_id])
+            except Exception:
+                table[token_id] = None
+    return table
+
+
+_decode_tables: weakref.WeakKeyDictionary[Any, tuple[int, Any]] = (
+    weakref.WeakKeyDictionary()
+)
+_decode_tables_lock = threading.Lock()
+
+
+def get_decode_table(sub_tokenizer: Any) -> list[str | None] | None:
+    """
+    Return the cached dense id -> text table for a sub-tokenizer, building it
+    on first use.
+
+    Tables are keyed weakly by the tokenizer object, so a replaced tokenizer
+    gets a fresh table and a dropped one frees its table; a change in vocab
+    size also triggers a rebuild. Returns None when no table can be built
+    (unknown/huge vocabulary, no decode support, non-weakrefable tokenizer).
+    """
+    if sub_tokenizer is None:
+        return None
+    marker = _decode_table_marker(sub_tokenizer)
+    with _decode_tables_lock:
+        try:
+            cached = _decode_tables.get(sub_tokenizer)
+        except TypeError:
+            return None
+        if cached is not None and cached[0] == marker:
+            return cached[1]
+        table = _build_decode_table(sub_tokenizer)
+        if table is None:
+            logging.debug(
+                "FensTokenCounter: No decode table for %s.", type(sub_tokenizer)
+            )
+        _decode_tables[sub_tokenizer] = (marker, table)
+        return table
+
+
+TOKENIZE_CACHE = LRUCache(TOKEN_CACHE_MAX_ENTRIES, TOKEN_CACHE_MAX_BYTES)
+SEGMENT_CACHE = LRUCache(SEGMENT_CACHE_MAX_ENTRIES, SEGMENT_CACHE_MAX_BYTES)
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import json
+import math
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, NamedTuple
+
+from .token_arrays import TokenStream, as_token_stream
+from .token_cache import iter_sub_tokenizers, tokenizer_fingerprint
+
+MAX_STREAM_THREADS = 8  # Upper bound on concurrently tokenized streams
+MIN_CONCURRENT_STREAMS = 2  # Single-stream stacks gain nothing from threads
+MAX_PROMPT_THREADS = 8  # Upper bound on concurrently tokenized sub-prompts
+
+_stream_executor: ThreadPoolExecutor | None = None
+_prompt_executor: ThreadPoolExecutor | None = None
+_stream_layouts: dict[str, tuple[str, ...] | None] = {}
+_stream_lock = threading.Lock()
+
+
+class TokenizerClip:
+    """
+    Minimal CLIP stand-in that exposes only a tokenizer.
+
+    Mirrors comfy.sd.CLIP.tokenize (including merging of tokenizer options)
+    so the counting helpers can run against a bare tokenizer stack, e.g. in
+    a worker process that never loads text-encoder weights.
+    """
+
+    def __init__(
+        self, tokenizer: Any, tokenizer_options: dict[str, Any] | None = None
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.tokenizer_options = dict(tokenizer_options or {})
+
+    def tokenize(self, text: str, return_word_ids: bool = False, **kwargs: Any) -> Any:
+        tokenizer_options = kwargs.get("tokenizer_options", {})
+        if self.tokenizer_options:
+            tokenizer_options = {**self.tokenizer_options, **tokenizer_options}
+        if tokenizer_options:
+            kwargs["tokenizer_options"] = tokenizer_options
+        return self.tokenizer.tokenize_with_weights(text, return_word_ids, **kwargs)
+
+
+class LimitScan(NamedTuple):
+    """Result of counting a prompt piece by piece up to a token limit."""
+
+    over_limit: bool
+    token_count: int  # Tokens counted before stopping (all of them if not over)
+    offset: int  # Character in the tokenized text that went over, else -1
+    pieces: int  # Tokenizer calls made
+    # The whole prompt's streams when it was tokenized in one piece, else None
+    token_streams: dict[str, TokenStream] | None
+
+
+class PretokenizedPrompt:
+    """
+    A counter node's token streams, handed downstream so an encode node
+    can skip tokenizing the same prompt a second time.
+
+    The streams are shared with the tokenization cache and must be treated
+    as read-only; to_batches() builds fresh tokenizer-format batches.
+    """
+
+    def __init__(
+        self,
+        text: str,
+        break_count: int,
+        fingerprint: str,
+        token_streams: dict[str, TokenStream] | None,
+    ) -> None:
+        self.text = text
+        self.break_count = break_count
+        self.fingerprint = fingerprint  # tokenizer_fingerprint of the counting CLIP
+        self.token_streams = token_streams  # None = must be tokenized again
+
+    def matches(self, clip: Any) -> bool:
+        """True when the streams can be used for clip as they are."""
+        return (
+            self.token_streams is not None
+            and self.fingerprint == tokenizer_fingerprint(clip)
+        )
+
+    def to_batches(self) -> dict[str, list[list[Any]]]:
+        """The streams in the {stream: batches} form clip.tokenize returns."""
+        return {
+            stream_name: as_token_stream(stream).to_batches()
+            for stream_name, stream in (self.token_streams or {}).items()
+        }
+
+
+def _get_stream_executor() -> ThreadPoolExecutor:
+    global _stream_executor  # noqa: PLW0603
+    with _stream_lock:
+        if _stream_executor is None:
+            _stream_executor = ThreadPoolExecutor(
+                max_workers=MAX_STREAM_THREADS, thread_name_prefix="fens-tokenize"
+            )
+        return _stream_executor
+
+
+def map_prompts(function: Callable[[str], Any], prompts: list[str]) -> list[Any]:
+    """
+    Apply function to each prompt on a thread pool, results in prompt order.
+
+    Uses its own pool rather than the stream pool, so a function that
+    tokenizes through ConcurrentStreamClip never waits on its own pool.
+    A single prompt runs on the calling thread. The first exception raised
+    by function (e.g. a cancellation) is re-raised here.
+    """
+    global _prompt_executor  # noqa: PLW0603
+    if len(prompts) <= 1:
+        return [function(prompt) for prompt in prompts]
+    with _stream_lock:
+        if _prompt_executor is None:
+            _prompt_executor = ThreadPoolExecutor(
+                max_workers=MAX_PROMPT_THREADS, thread_name_prefix="fens-prompt"
+            )
+        executor = _prompt_executor
+    futures = [executor.submit(function, prompt) for prompt in prompts]
+    return [future.result() for future in futures]
+
+
+class ConcurrentStreamClip:
+    """
+    CLIP proxy that tokenizes each sub-tokenizer stream on a thread pool.
+
+    Wrapper tokenizers (SDXL, SD3, Flux, Anima, ...) run their sub-tokenizers
+    one after another; this proxy resolves the sub-tokenizers itself and runs
+    them concurrently, which pays off when they release the GIL (HF fast
+    tokenizers). Some wrappers post-process the per-stream output, so the
+    first call per tokenizer stack tokenizes both ways and only enables the
+    concurrent path when the {stream: batches} results are identical.
+    """
+
+    def __init__(
+        self, clip: Any, resolve_sub_tokenizer: Callable[[Any, str], Any | None]
+    ) -> None:
+        self.clip = clip
+        self.tokenizer = clip.tokenizer
+        self.tokenizer_options = getattr(clip, "tokenizer_options", {})
+        self.fingerprint = tokenizer_fingerprint(clip)
+        self._resolve_sub_tokenizer = resolve_sub_tokenizer
+
+    def _merged_kwargs(self, kwargs: dict[str, Any]) -> dict[str, Any]:
+        """Merge CLIP-level tokenizer options the same way CLIP.tokenize does."""
+        tokenizer_options = kwargs.get("tokenizer_options", {})
+        if self.tokenizer_options:
+            tokenizer_options = {**self.tokenizer_options, **tokenizer_options}
+        if tokenizer_options:
+            kwargs = {**kwargs, "tokenizer_options": tokenizer_options}
+        return kwargs
+
+    def _tokenize_streams(
+        self,
+        stream_names: tuple[str, ...],
+        text: str,
+        return_word_ids: bool,
+        kwargs: dict[str, Any],
+    ) -> dict[str, Any]:
+        executor = _get_stream_executor()
+        merged_kwargs = self._merged_kwargs(kwargs)
+        futures = {
+            stream_name: executor.submit(
+                self._resolve_sub_tokenizer(
+                    self.clip, stream_name
+                ).tokenize_with_weights,
+                text,
+                return_word_ids,
+                **merged_kwargs,
+            )
+            for stream_name in stream_names
+        }
+        return {stream_name: future.result() for stream_name, future in futures.items()}
+
+    def _detect_layout(
+        self,
+        text: str,
+        return_word_ids: bool,
+        kwargs: dict[str, Any],
+        reference: Any,
+    ) -> tuple[str, ...] | None:
+        """Return the stream order if concurrent output matches, else None."""
+        if not isinstance(reference, dict):
+            return None
+        stream_names = tuple(reference.keys())
+        found = {stream_name for stream_name, _ in iter_sub_tokenizers(self.clip)}
+        if len(stream_names) < MIN_CONCURRENT_STREAMS or not set(stream_names) <= found:
+            return None
+        if any(
+            self._resolve_sub_tokenizer(self.clip, stream_name) is None
+            for stream_name in stream_names
+        ):
+            return None
+        try:
+            candidate = self._tokenize_streams(
+                stream_names, text, return_word_ids, kwargs
+            )
+            return stream_names if candidate == reference else None
+        except Exception:
+            # Any failure (e.g. tensors in embedding tokens) disables the fast path
+            return None
+
+    def tokenize(self, text: str, return_word_ids: bool = False, **kwargs: Any) -> Any:
+        with _stream_lock:
+            known = self.fingerprint in _stream_layouts
+            stream_names = _stream_layouts.get(self.fingerprint)
+        if not known:
+            reference = self.clip.tokenize(text, return_word_ids, **kwargs)
+            layout = self._detect_layout(text, return_word_ids, kwargs, reference)
+            with _stream_lock:
+                _stream_layouts[self.fingerprint] = layout
+            return reference
+        if stream_names is None:
+            return self.clip.tokenize(text, return_word_ids, **kwargs)
+        return self._tokenize_streams(stream_names, text, return_word_ids, kwargs)
+
+
+class TokenizationCancelledError(Exception):
+    """Raised inside a worker thread when the awaiting execute was cancelled."""
+
+
+class CancellableClip:
+    """
+    CLIP proxy that checks a cancellation event before every tokenize call.
+
+    Tokenization runs off the event loop in a worker thread, which cannot be
+    interrupted directly; checking between calls (one per BREAK segment)
+    lets a cancelled run stop early instead of tokenizing to the end.
+    """
+
+    def __init__(self, clip: Any, cancel_event: threading.Event) -> None:
+        self.clip = clip
+        self.tokenizer = clip.tokenizer
+        self.tokenizer_options = getattr(clip, "tokenizer_options", {})
+        self.cancel_event = cancel_event
+
+    def tokenize(self, text: str, return_word_ids: bool = False, **kwargs: Any) -> Any:
+        raise_if_cancelled(self.cancel_event)
+        return self.clip.tokenize(text, return_word_ids, **kwargs)
+
+
+def raise_if_cancelled(cancel_event: threading.Event | None) -> None:
+    """Raise TokenizationCancelledError once cancel_event has been set."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise TokenizationCancelledError()
+
+
+def parse_prompt_list(text: str, input_format: str = "auto") -> list[str]:
+    """
+    Split a batch input into individual prompts.
+
+    Formats:
+      lines: one prompt per non-empty line
+      json: a JSON array of prompts (non-string items are stringified)
+      auto: json if the text looks like a JSON array, otherwise lines
+
+    Raises:
+      ValueError: If json is requested and the text is not a JSON array
+    """
+    stripped = text.strip()
+    if input_format == "auto":
+        input_format = "json" if stripped.startswith("[") else "lines"
+    if input_format == "json":
+        try:
+            items = json.loads(stripped)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON prompt list: {e}") from e
+        if not isinstance(items, list):
+            raise ValueError("JSON prompt list must be an array.")
+        prompts = [
+            item if isinstance(item, str) else json.dumps(item) for item in items
+        ]
+        return [prompt for prompt in prompts if prompt.strip()]
+    return [line for line in text.splitlines() if line.strip()]
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list (0 for an empty list)."""
+    if not sorted_values:
+        return 0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize_counts(counts: list[int], token_limit: int) -> dict[str, Any]:
+    """Aggregate per-prompt token counts into min/max/mean/p95/over-limit stats."""
+    ordered = sorted(counts)
+    return {
+        "count": len(ordered),
+        "min": ordered[0] if ordered else 0,
+        "max": ordered[-1] if ordered else 0,
+        "mean": sum(ordered) / len(ordered) if ordered else 0.0,
+        "p95": percentile(ordered, 95),
+        "over_limit": sum(1 for count in ordered if count > token_limit),
+    }
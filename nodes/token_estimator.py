@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+from collections.abc import Callable
+from typing import Any, NamedTuple
+
+from .caption_cache import cache_directory
+from .chunk_analysis import DEFAULT_MAX_WORD_LENGTH, chunk_window
+from .prompt_scanner import split_on_break, unescape_parentheses, weight_tree
+from .token_arrays import TokenStream
+
+ESTIMATOR_FILE = "token_estimator.json"
+ESTIMATOR_VERSION = 1  # Bump when the model format or calibration corpus changes
+MAX_PIECE_LENGTH = 24  # Longer pieces use the per-character rate of the longest bucket
+CONFIDENCE_Z = 1.96  # Two-sided 95% interval
+# Calibration words are common prompt vocabulary, so rarer words in real
+# prompts run longer than the per-piece variance alone suggests; every
+# interval is widened by this share of the estimate.
+RELATIVE_ERROR_FLOOR = 0.05
+
+# Pre-tokenizer in the spirit of CLIP's BPE regex, with Python's re:
+# contractions, letter runs, single digits, and runs of other symbols.
+_PIECE_PATTERN = re.compile(
+    r"'s|'t|'re|'ve|'m|'ll|'d|[^\W\d_]+|\d|(?:[^\s\w]|_)+", re.IGNORECASE
+)
+
+# Calibration corpus: typical prompt vocabulary of varied length, some rare
+# and compound words, numbers, punctuation and non-Latin scripts. Weight
+# syntax characters are left out, since they are never tokenized.
+CALIBRATION_TEXT = """
+masterpiece, best quality, highly detailed, ultra-detailed, photorealistic,
+cinematic lighting, volumetric fog, dramatic shadows, soft rim light, bokeh,
+depth of field, 8k uhd, 35mm photograph, film grain, sharp focus, hdr,
+portrait of a young woman with freckles and long wavy auburn hair, smiling,
+wearing an embroidered silk kimono, standing in a cherry blossom garden at
+dusk, lanterns, reflections on a koi pond, intricate ornate filigree,
+a weathered lighthouse keeper, steampunk airship, bioluminescent jellyfish,
+cyberpunk megacity skyline, neon signage, rain-soaked streets, hovercars,
+isometric diorama, low-poly, claymation, watercolor, gouache, charcoal sketch,
+art nouveau, ukiyo-e, baroque, impressionism, surrealism, vaporwave,
+trending on artstation, unreal engine 5, octane render, ray tracing,
+subsurface scattering, anamorphic lens flare, chromatic aberration,
+golden hour, overcast, thunderstorm, aurora borealis, nebula, stardust,
+by greg rutkowski and alphonse mucha, studio ghibli, pixar, wlop, sakimichan,
+1girl, solo, looking at viewer, upper body, from side, outdoors, day,
+blue eyes, blonde hair, twintails, hair ribbon, school uniform, pleated skirt,
+thighhighs, absurdres, highres, lowres, worst quality, jpeg artifacts,
+bad anatomy, extra fingers, mutated hands, deformed, blurry, watermark,
+signature, text, username, cropped, out of frame, duplicate, disfigured,
+an anthropomorphic fox adventurer, medieval tavern interior, candlelight,
+Kyoto, Reykjavík, café, naïve, façade, Zürich, São Paulo, Ελλάδα, Москва,
+東京, 猫, 桜の花, 서울, ภาษาไทย, 2024, 1920x1080, 16:9, 3.5, #hashtag,
+@artist, rock'n'roll, it's, don't, we're, they've, I'm, you'll, she'd,
+hyperrealistic, photogrammetry, chiaroscuro, pointillism, tenebrism,
+antidisestablishmentarianism, floccinaucinihilipilification, xylophone,
+quixotic, zephyr, mnemonic, rhythm, sphinx, fjord, gnarled, wrought-iron,
+pre-raphaelite, post-apocalyptic, over-the-shoulder, close-up, wide-angle,
+a b c d e f g h i j k l m n o p q r s t u v w x y z ... !!! ??? ;; :: -- __
+"""
+
+
+class StreamModel(NamedTuple):
+    """Piece-length token model of one tokenizer stream."""
+
+    buckets: dict[str, list[list[float] | None]]  # class -> [mean, var] by length
+    slots: int | None  # Slots per chunk; None for unbounded streams
+    capacity: int | None  # Typed tokens per chunk
+    specials: int  # Start/end tokens around a segment
+    min_length: int  # Padded floor of an unbounded segment
+    max_word_length: int  # Weighted spans this long or longer are split
+
+
+class StreamEstimate(NamedTuple):
+    tokens: int  # Point estimate
+    low: int  # 95% interval
+    high: int
+    chunks: int  # Chunks for the point estimate
+    chunks_low: int  # Chunks for low and high
+    chunks_high: int
+    context_limit: int
+
+
+def pretokenize(text: str) -> list[str]:
+    """Pieces of text as a CLIP-style pre-tokenizer splits it (lowercased)."""
+    return _PIECE_PATTERN.findall(text.lower())
+
+
+def piece_class(piece: str) -> str:
+    """Model bucket of a piece: word, script (non-ASCII letters), digit or symbol."""
+    if piece[0] == "'" or not (piece[0].isalpha() or piece[0].isdigit()):
+        return "symbol"
+    if piece.isdigit():
+        return "digit"
+    return "word" if piece.isascii() else "script"
+
+
+def _segment_text(segment: str) -> tuple[str, int]:
+    """
+    Plain text of a BREAK segment without weight syntax, and its number of
+    weighted spans (each one packed whole into a chunk when short).
+    """
+    tree = weight_tree(segment)
+    spans = [
+        unescape_parentheses(segment[span.start : span.end]) for span in tree.spans
+    ]
+    return " ".join(spans), sum(1 for span in spans if span.strip())
+
+
+def stream_window(stream: TokenStream, sub_tokenizer: Any) -> dict[str, Any]:
+    """
+    Chunk layout fields of a StreamModel, from one stream of a calibration
+    tokenization and its sub-tokenizer's settings.
+    """
+    window = chunk_window(stream, sub_tokenizer)
+    min_length = getattr(sub_tokenizer, "min_length", None)
+    return {
+        "slots": window.slots if window else None,
+        "capacity": window.capacity if window else None,
+        "specials": int(getattr(sub_tokenizer, "start_token", 0) is not None)
+        + int(getattr(sub_tokenizer, "end_token", 0) is not None),
+        "min_length": min_length if isinstance(min_length, int) else 0,
+        "max_word_length": (
+            window.max_word_length if window else DEFAULT_MAX_WORD_LENGTH
+        ),
+    }
+
+
+def build_stream_model(
+    piece_counts: dict[str, int], window: dict[str, Any]
+) -> StreamModel:
+    """
+    Fit per-class, per-length token means and variances from exact token
+    counts of calibration pieces. window holds slots, capacity, specials,
+    min_length and max_word_length from the calibration tokenization.
+    """
+    samples: dict[str, list[list[int]]] = {}
+    for piece, count in piece_counts.items():
+        length = min(len(piece), MAX_PIECE_LENGTH)
+        lengths = samples.setdefault(
+            piece_class(piece), [[] for _ in range(MAX_PIECE_LENGTH + 1)]
+        )
+        lengths[length].append(count)
+    buckets: dict[str, list[list[float] | None]] = {}
+    for name, lengths in samples.items():
+        fitted: list[list[float] | None] = []
+        for counts in lengths:
+            if not counts:
+                fitted.append(None)
+                continue
+            mean = sum(counts) / len(counts)
+            variance = sum((count - mean) ** 2 for count in counts) / len(counts)
+            fitted.append([mean, variance])
+        buckets[name] = fitted
+    return StreamModel(buckets, **window)
+
+
+def _piece_stats(model: StreamModel, piece: str) -> tuple[float, float]:
+    """Mean and variance of the token count of one piece."""
+    lengths = model.buckets.get(piece_class(piece))
+    if not lengths:
+        return float(len(piece)), float(len(piece))
+    length = len(piece)
+    capped = min(length, MAX_PIECE_LENGTH)
+    # Nearest calibrated length at or below, else above, scaled by length.
+    for candidate in [*range(capped, 0, -1), *range(capped + 1, len(lengths))]:
+        stats = lengths[candidate]
+        if stats is not None:
+            scale = length / candidate
+            return stats[0] * scale, stats[1] * scale * scale
+    return float(length), float(length)
+
+
+def _chunks(tokens: int, capacity: int) -> int:
+    return max(1, math.ceil(tokens / capacity))
+
+
+def estimate_stream(model: StreamModel, text: str) -> StreamEstimate:
+    """
+    Estimate one stream's typed tokens, chunks and context limit for a
+    prompt, without tokenizing it.
+
+    BREAK segments are estimated separately. The upper chunk bound also
+    allows for the padding ComfyUI adds when it moves short weighted spans
+    whole to the next chunk.
+    """
+    tokens = low = high = chunks = chunks_low = chunks_high = context_limit = 0
+    for segment in split_on_break(text) or [text]:
+        plain, span_count = _segment_text(segment)
+        mean = variance = 0.0
+        for piece in pretokenize(plain):
+            piece_mean, piece_variance = _piece_stats(model, piece)
+            mean += piece_mean
+            variance += piece_variance
+        margin = CONFIDENCE_Z * math.sqrt(variance) + RELATIVE_ERROR_FLOOR * mean
+        segment_tokens = round(mean)
+        segment_low = max(0, math.floor(mean - margin))
+        segment_high = math.ceil(mean + margin)
+        tokens += segment_tokens
+        low += segment_low
+        high += segment_high
+        if model.capacity is None:
+            chunks += 1
+            chunks_low += 1
+            chunks_high += 1
+            context_limit += max(model.min_length, segment_tokens + model.specials)
+            continue
+        worst_capacity = model.capacity
+        if span_count > 1:
+            worst_capacity = max(1, model.capacity - (model.max_word_length - 1))
+        segment_chunks = _chunks(segment_tokens, model.capacity)
+        chunks += segment_chunks
+        chunks_low += _chunks(segment_low, model.capacity)
+        chunks_high += (
+            _chunks(segment_high, model.capacity)
+            if segment_high <= model.capacity
+            else _chunks(segment_high, worst_capacity)
+        )
+        context_limit += segment_chunks * (model.slots or 0)
+    return StreamEstimate(
+        tokens, low, high, chunks, chunks_low, chunks_high, context_limit
+    )
+
+
+class EstimatorStore:
+    """
+    Calibrated stream models per tokenizer fingerprint, kept in memory and
+    in a small JSON file so each tokenizer family is calibrated only once.
+    """
+
+    def __init__(self) -> None:
+        self._models: dict[str, dict[str, StreamModel]] | None = None
+        self._lock = threading.Lock()
+
+    def _path(self) -> str:
+        return os.path.join(cache_directory(), ESTIMATOR_FILE)
+
+    def _load(self) -> dict[str, dict[str, StreamModel]]:
+        try:
+            with open(self._path(), encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning("FensTokenCounter: Could not read estimator file. %s", e)
+            return {}
+        if not isinstance(data, dict) or data.get("version") != ESTIMATOR_VERSION:
+            return {}
+        try:
+            return {
+                fingerprint: {
+                    stream_name: StreamModel(**fields)
+                    for stream_name, fields in streams.items()
+                }
+                for fingerprint, streams in data.get("models", {}).items()
+            }
+        except TypeError as e:
+            logging.warning("FensTokenCounter: Ignoring estimator file. %s", e)
+            return {}
+
+    def _save(self, models: dict[str, dict[str, StreamModel]]) -> None:
+        """Write the file atomically, so a concurrent reader never sees half of it."""
+        data = {
+            "version": ESTIMATOR_VERSION,
+            "models": {
+                fingerprint: {
+                    stream_name: model._asdict()
+                    for stream_name, model in streams.items()
+                }
+                for fingerprint, streams in models.items()
+            },
+        }
+        directory = cache_directory()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".fens_estimator_")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f, separators=(",", ":"))
+                os.replace(tmp_path, self._path())
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logging.warning("FensTokenCounter: Could not save estimator file. %s", e)
+
+    def models(
+        self,
+        fingerprint: str,
+        calibrate: Callable[[], dict[str, StreamModel]],
+    ) -> dict[str, StreamModel]:
+        """
+        The stream models for a tokenizer stack, running calibrate (which
+        tokenizes the calibration corpus) and saving its result on first use.
+        """
+        with self._lock:
+            if self._models is None:
+                self._models = self._load()
+            cached = self._models.get(fingerprint)
+            if cached is not None:
+                return cached
+            models = calibrate()
+            self._models[fingerprint] = models
+            self._save(self._models)
+            return models
+
+
+ESTIMATOR_STORE = EstimatorStore()
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+import folder_paths
+
+from .token_common import percentile
+
+ROLLING_WINDOW = 1024  # Most recent samples kept per phase
+# Histogram bucket upper bounds in seconds (Prometheus "le" labels).
+PHASE_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+METRICS_DIR_ENV = "FENS_METRICS_DIR"  # Overrides the export directory
+METRICS_SUBDIR = "fens_metrics"  # Default export directory inside ComfyUI's user dir
+METRIC_NAME = "fens_token_counter_phase_seconds"
+EXPORT_FILE_MODE = 0o644  # Readable by scrapers running as another user
+EXPORT_FILES = {
+    "prometheus": "fens_token_counter.prom",
+    "json": "fens_token_counter_metrics.json",
+}
+
+
+class PhaseTimer:
+    """Wall-clock durations of the named phases of one counter run."""
+
+    def __init__(self) -> None:
+        self.durations: dict[str, float] = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+
+    def finish(self) -> None:
+        """Record the time since the timer was created as the "total" phase."""
+        self.durations["total"] = time.perf_counter() - self.started
+
+    def format(self) -> str:
+        """One-line summary such as "Timings: preprocess 0.12 ms, ..."."""
+        parts = [
+            f"{name} {seconds * 1000:.2f} ms"
+            for name, seconds in self.durations.items()
+        ]
+        return f"Timings: {', '.join(parts)}"
+
+
+class PhaseTotals:
+    """Lifetime bucket counts (not cumulative), count and sum of one phase."""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(PHASE_BUCKETS) + 1)  # Last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.buckets[bisect.bisect_left(PHASE_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+class PhaseMetrics:
+    """
+    Per-phase duration statistics shared by all counter runs.
+
+    Summary statistics cover only the most recent ROLLING_WINDOW samples per
+    phase, so they follow recent behaviour. The Prometheus histogram is
+    built from lifetime totals instead: Prometheus expects its buckets, sum
+    and count to only ever grow, and reads any drop as a counter reset.
+    """
+
+    def __init__(self, window: int = ROLLING_WINDOW) -> None:
+        self.window = window
+        self.runs = 0
+        self._samples: dict[str, deque[float]] = {}
+        self._totals: dict[str, PhaseTotals] = {}
+        self._lock = threading.Lock()
+
+    def record(self, durations: dict[str, float]) -> None:
+        with self._lock:
+            self.runs += 1
+            for name, seconds in durations.items():
+                samples = self._samples.get(name)
+                if samples is None:
+                    samples = self._samples[name] = deque(maxlen=self.window)
+                samples.append(seconds)
+                totals = self._totals.get(name)
+                if totals is None:
+                    totals = self._totals[name] = PhaseTotals()
+                totals.add(seconds)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.runs = 0
+            self._samples.clear()
+            self._totals.clear()
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Summary statistics and cumulative bucket counts per phase.
+
+        Returns:
+            {"runs": int, "window": int, "phases": {name: stats}} where stats
+            holds count, sum, mean, p50, p95, max (seconds) and buckets as
+            [upper_bound, cumulative_count] pairs.
+        """
+        with self._lock:
+            runs = self.runs
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+        phases = {}
+        for name, ordered in samples.items():
+            total = sum(ordered)
+            buckets = []
+            index = 0
+            for bound in PHASE_BUCKETS:
+                while index < len(ordered) and ordered[index] <= bound:
+                    index += 1
+                buckets.append([bound, index])
+            phases[name] = {
+                "count": len(ordered),
+                "sum": total,
+                "mean": total / len(ordered) if ordered else 0.0,
+                "p50": percentile(ordered, 50),
+                "p95": percentile(ordered, 95),
+                "max": ordered[-1] if ordered else 0.0,
+                "buckets": buckets,
+            }
+        return {"runs": runs, "window": self.window, "phases": phases}
+
+    def to_prometheus(self) -> str:
+        """
+        Render the lifetime histograms in the Prometheus text exposition
+        format, so rate() and histogram_quantile() work on them.
+        """
+        with self._lock:
+            runs = self.runs
+            totals = {
+                name: (list(phase.buckets), phase.count, phase.sum)
+                for name, phase in self._totals.items()
+            }
+        lines = [
+            f"# HELP {METRIC_NAME} Duration of FensTokenCounter phases.",
+            f"# TYPE {METRIC_NAME} histogram",
+        ]
+        for name, (buckets, count, total) in totals.items():
+            cumulative = 0
+            for bound, bucket_count in zip(PHASE_BUCKETS, buckets, strict=False):
+                cumulative += bucket_count
+                lines.append(
+                    f'{METRIC_NAME}_bucket{{phase="{name}",le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'{METRIC_NAME}_bucket{{phase="{name}",le="+Inf"}} {count}')
+            lines.append(f'{METRIC_NAME}_sum{{phase="{name}"}} {total}')
+            lines.append(f'{METRIC_NAME}_count{{phase="{name}"}} {count}')
+        lines.extend(
+            [
+                "# HELP fens_token_counter_runs_total Instrumented FensTokenCounter runs.",
+                "# TYPE fens_token_counter_runs_total counter",
+                f"fens_token_counter_runs_total {runs}",
+            ]
+        )
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2) + "\n"
+
+    def export(self, export_format: str, directory: str) -> str:
+        """
+        Write the metrics file for export_format ("prometheus" or "json")
+        into directory, replacing the previous file atomically so scrapers
+        never read a half-written file.
+
+        Returns:
+            Path of the written file.
+
+        Raises:
+            ValueError: If export_format is unknown
+            OSError: If the directory or file cannot be written
+        """
+        if export_format not in EXPORT_FILES:
+            raise ValueError(f"Unknown metrics export format '{export_format}'")
+        content = (
+            self.to_prometheus() if export_format == "prometheus" else self.to_json()
+        )
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, EXPORT_FILES[export_format])
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".fens_metrics_")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(content)
+            # mkstemp creates the file as 0600, and os.replace keeps that.
+            os.chmod(tmp_path, EXPORT_FILE_MODE)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return path
+
+
+PHASE_METRICS = PhaseMetrics()
+
+
+def metrics_directory() -> str:
+    """Export directory: $FENS_METRICS_DIR, else <ComfyUI user dir>/fens_metrics."""
+    override_dir = os.environ.get(METRICS_DIR_ENV)
+    if override_dir:
+        return override_dir
+    return os.path.join(folder_paths.get_user_directory(), METRICS_SUBDIR)
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import multiprocessing
+import os
+import pickle
+import runpy
+import threading
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.reduction import ForkingPickler
+from typing import Any
+
+from .fens_token_counter import FensTokenCounter
+from .token_cache import tokenizer_fingerprint
+from .token_common import TokenizerClip
+
+MAX_AUTO_WORKERS = 8  # Upper bound when the worker count is left on auto
+MIN_ITEMS_PER_WORKER = 4  # Below this many items per worker, stay in-process
+WORKER_BOOTSTRAP = os.path.join(os.path.dirname(__file__), "token_worker.py")
+
+_worker_clip: TokenizerClip | None = None
+_pool_lock = threading.Lock()
+_pool: ProcessPoolExecutor | None = None
+_pool_key: tuple[str, int] | None = None
+
+
+def resolve_worker_count(workers: int) -> int:
+    """Map the node's worker input to a process count (0 = auto)."""
+    if workers > 0:
+        return workers
+    return max(1, min(MAX_AUTO_WORKERS, (os.cpu_count() or 2) - 1))
+
+
+def _init_worker(tokenizer: Any, tokenizer_options: dict[str, Any]) -> None:
+    """Keep one tokenizer copy per worker; called by the worker bootstrap."""
+    global _worker_clip  # noqa: PLW0603
+    _worker_clip = TokenizerClip(tokenizer, tokenizer_options)
+
+
+def _count_in_worker(text: str, count_strategy: str) -> tuple[int, int, int]:
+    return FensTokenCounter._count_prompt(_worker_clip, text, count_strategy)
+
+
+def _mp_context() -> Any:
+    """
+    Prefer forkserver, else spawn. Forking the ComfyUI server itself would
+    copy a multithreaded process (server loop, prompt worker, tokenizer
+    thread pools) whose locks may be held at fork time.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def _worker_initargs(clip: Any) -> tuple[str, dict[str, Any]]:
+    """
+    Arguments of runpy.run_path(WORKER_BOOTSTRAP, ...), the pool initializer.
+
+    Pickled here once, so a tokenizer that cannot be shipped to a worker
+    fails at pool creation instead of inside the pool.
+
+    Raises:
+        pickle.PicklingError / TypeError / AttributeError: If the tokenizer
+            cannot be pickled
+    """
+    init_globals = {
+        "PACKAGE_NAME": __package__,
+        "PACKAGE_PATH": os.path.dirname(__file__),
+        "WORKER_MODULE": __name__,
+        "TOKENIZER": clip.tokenizer,
+        "TOKENIZER_OPTIONS": dict(getattr(clip, "tokenizer_options", {}) or {}),
+    }
+    ForkingPickler.dumps(init_globals)
+    return WORKER_BOOTSTRAP, init_globals
+
+
+def _get_pool(clip: Any, workers: int) -> ProcessPoolExecutor:
+    """
+    Return a process pool whose workers hold a copy of clip's tokenizer,
+    reusing the previous pool while the tokenizer stack is unchanged. A
+    replaced pool finishes the work already submitted to it.
+
+    Raises:
+        pickle.PicklingError / TypeError / AttributeError: If the tokenizer
+            cannot be pickled
+    """
+    global _pool, _pool_key  # noqa: PLW0603
+    key = (tokenizer_fingerprint(clip), workers)
+    if _pool is not None and _pool_key == key:
+        return _pool
+    initargs = _worker_initargs(clip)
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+    # The initializer is a stdlib function: ComfyUI imports custom nodes
+    # under their file path, which a fresh worker cannot import until the
+    # bootstrap has registered the package.
+    _pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=_mp_context(),
+        initializer=runpy.run_path,
+        initargs=initargs,
+    )
+    _pool_key = key
+    return _pool
+
+
+def shutdown_pool() -> None:
+    """Stop the shared worker pool, if any."""
+    global _pool, _pool_key  # noqa: PLW0603
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+    _pool_key = None
+
+
+atexit.register(shutdown_pool)
+
+
+def count_prompts(
+    clip: Any,
+    prompts: list[str],
+    count_strategy: str = "max_stream",
+    workers: int = 0,
+    progress: Callable[[int], None] | None = None,
+) -> tuple[list[tuple[int, int, int]], int]:
+    """
+    Count every prompt, spreading tokenization over worker processes.
+
+    CLIP BPE tokenization is pure Python and GIL-bound, so threads do not
+    help; each worker process holds its own tokenizer copy instead. Small
+    batches, a single worker, or a tokenizer that cannot be shipped to a
+    worker (unpicklable, pool broken) fall back to counting in-process.
+    The pool is shared: the lock only covers getting it, so concurrent
+    callers map their prompts on it at the same time.
+
+    Returns:
+        Tuple of (results, processes_used) where results holds one
+        (token_count, context_limit_tokens, chunk_count) per prompt and
+        processes_used is 1 when counting ran in-process.
+    """
+    worker_count = resolve_worker_count(workers)
+    use_pool = (
+        worker_count > 1
+        and len(prompts) >= worker_count * MIN_ITEMS_PER_WORKER
+        and getattr(clip, "tokenizer", None) is not None
+    )
+    pool = None
+    if use_pool:
+        try:
+            with _pool_lock:
+                pool = _get_pool(clip, worker_count)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+            # Pickling/Type/AttributeError: the tokenizer could not be shipped
+            logging.warning(
+                "FensTokenCounter: Process pool unavailable (%s), counting in-process.",
+                e,
+            )
+    if pool is not None:
+        chunksize = max(1, len(prompts) // (worker_count * 4))
+        try:
+            results = []
+            for result in pool.map(
+                _count_in_worker,
+                prompts,
+                [count_strategy] * len(prompts),
+                chunksize=chunksize,
+            ):
+                results.append(result)
+                if progress is not None:
+                    progress(len(results))
+            return results, worker_count
+        except BrokenProcessPool as e:
+            # A worker died or its bootstrap failed; errors raised while
+            # counting propagate unchanged.
+            logging.warning(
+                "FensTokenCounter: Process pool broke (%s), counting in-process.",
+                e,
+            )
+            with _pool_lock:
+                if _pool is pool:
+                    shutdown_pool()
+
+    results = []
+    for text in prompts:
+        results.append(FensTokenCounter._count_prompt(clip, text, count_strategy))
+        if progress is not None:
+            progress(len(results))
+    return results, 1
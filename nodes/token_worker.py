@@ -0,0 +1,33 @@
+"""
+Worker bootstrap of the token_pool process pool, run with runpy.run_path as
+the pool initializer.
+
+ComfyUI imports a custom node package under its file path, a module name a
+fresh forkserver/spawn worker cannot import. This script registers the
+package under that name, so the pickled worker function resolves, and hands
+the tokenizer to token_pool. It expects these init_globals:
+
+    PACKAGE_NAME, PACKAGE_PATH: __package__ and directory of token_pool
+    WORKER_MODULE: __name__ of token_pool
+    TOKENIZER, TOKENIZER_OPTIONS: the tokenizer stack to count with
+"""
+
+import importlib
+import sys
+import types
+
+
+def _register_package(name: str, path: str) -> None:
+    """Make name importable as a package rooted at path, without running it."""
+    if name in sys.modules:
+        return
+    package = types.ModuleType(name)
+    package.__path__ = [path]
+    sys.modules[name] = package
+
+
+_register_package(PACKAGE_NAME, PACKAGE_PATH)  # noqa: F821
+importlib.import_module(WORKER_MODULE)._init_worker(  # noqa: F821
+    TOKENIZER,  # noqa: F821
+    TOKENIZER_OPTIONS,  # noqa: F821
+)
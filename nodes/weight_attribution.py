@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import re
+from bisect import bisect_left, bisect_right
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from .prompt_scanner import (
+    WeightGroup,
+    WeightSpan,
+    split_on_break_spans,
+    unescape_parentheses,
+    weight_tree,
+)
+from .token_arrays import TokenStream
+
+DEFAULT_EMBEDDING_IDENTIFIER = "embedding:"  # ComfyUI's textual-inversion prefix
+WEIGHT_DECIMALS = 3  # Bucket precision: 1.1 * 1.1 lands in the "1.21" bucket
+
+
+class WeightLayout(NamedTuple):
+    """Weight syntax of a whole prompt, laid out per tokenizer call."""
+
+    bounds: list[tuple[int, int]]  # Text each tokenizer call saw
+    spans: list[WeightSpan]  # Offsets into the whole prompt
+    groups: list[WeightGroup]
+
+
+def _word_counts(text: str, embedding_identifier: str) -> tuple[int, int]:
+    """
+    Word ids one weighted span consumes under both ComfyUI conventions.
+
+    Current ComfyUI gives each weighted span one word id, splitting it only
+    in front of embeddings; older versions (and some custom tokenizers)
+    give each space-separated word its own id.
+
+    Returns:
+        (per_span_words, per_space_words)
+    """
+    text = unescape_parentheses(text)
+    identifier = re.escape(embedding_identifier)
+    pieces = re.split(f" {identifier}|\n{identifier}", text)
+    per_span = (1 if pieces[0] else 0) + len(pieces) - 1
+    per_space = sum(1 for word in text.replace("\n", " ").split(" ") if word)
+    return per_span, per_space
+
+
+def _word_to_span(
+    segment_spans: list[int],
+    word_counts: list[tuple[int, int]],
+    max_word_id: int,
+) -> np.ndarray:
+    """
+    Lookup table from word id to global span index (-1 = unattributed).
+
+    Picks the convention whose word total matches the largest word id seen
+    in the segment, else the first one with enough words.
+    """
+    candidates = []
+    for convention in (0, 1):
+        counts = [counts[convention] for counts in word_counts]
+        candidates.append(np.repeat(np.array(segment_spans, dtype=np.int32), counts))
+    chosen = next(
+        (table for table in candidates if len(table) == max_word_id),
+        next((table for table in candidates if len(table) >= max_word_id), None),
+    )
+    if chosen is None:
+        chosen = candidates[0]
+    return np.concatenate([np.array([-1], dtype=np.int32), chosen])
+
+
+def _token_weights(stream: TokenStream, positions: np.ndarray) -> np.ndarray:
+    """Weights at flat slot positions, with object entries' own weights patched in."""
+    weights = stream.weights[positions]
+    if not stream.objects:
+        return weights
+    index = {position: i for i, position in enumerate(positions.tolist())}
+    for position, item in stream.objects.items():
+        if (
+            position in index
+            and isinstance(item, (tuple, list))
+            and len(item) > 1
+            and isinstance(item[1], (int, float))
+        ):
+            weights[index[position]] = item[1]
+    return weights
+
+
+class SpanAssignment(NamedTuple):
+    """The weighted span each typed token of one stream belongs to."""
+
+    positions: np.ndarray  # Flat slot positions of the typed tokens, in order
+    span_ids: np.ndarray  # Index into WeightLayout.spans, -1 = unattributed
+    weights_disabled: bool
+
+
+def build_layout(text: str, break_count: int) -> WeightLayout:
+    """
+    Weighted spans and groups of a prompt. With BREAK, each stripped
+    segment is parsed on its own, as it is tokenized on its own; otherwise
+    the whole prompt is one segment.
+    """
+    bounds = split_on_break_spans(text) if break_count > 0 else [(0, len(text))]
+    spans: list[WeightSpan] = []
+    groups: list[WeightGroup] = []
+    for seg_start, seg_end in bounds:
+        tree = weight_tree(text[seg_start:seg_end])
+        offset = len(groups)
+        groups.extend(
+            WeightGroup(
+                group.start + seg_start,
+                group.end + seg_start,
+                group.weight,
+                group.depth,
+                group.parent + offset if group.parent >= 0 else -1,
+            )
+            for group in tree.groups
+        )
+        spans.extend(
+            WeightSpan(
+                span.start + seg_start,
+                span.end + seg_start,
+                span.weight,
+                span.group + offset if span.group >= 0 else -1,
+            )
+            for span in tree.spans
+        )
+    return WeightLayout(bounds, spans, groups)
+
+
+def assign_spans(
+    text: str,
+    stream: TokenStream,
+    layout: WeightLayout,
+    sub_tokenizer: Any = None,
+) -> SpanAssignment:
+    """
+    Map one stream's typed tokens to the weighted spans of text (layout
+    comes from build_layout with the same BREAK handling).
+
+    Uses only the stream that was already tokenized: the tokenizer numbers
+    the words of each weighted span consecutively, restarting in every
+    BREAK segment, so each token's word id identifies its span.
+    """
+    identifier = getattr(
+        sub_tokenizer, "embedding_identifier", DEFAULT_EMBEDDING_IDENTIFIER
+    )
+    weights_disabled = bool(getattr(sub_tokenizer, "disable_weights", False))
+    bounds, spans, _ = layout
+    span_starts = [span.start for span in spans]
+    positions = []
+    span_ids = []
+
+    for segment_index, window in enumerate(stream.segment_slices()):
+        word_ids = stream.word_ids[window]
+        typed = np.flatnonzero(word_ids > 0)
+        positions.append(typed + window.start)
+        typed_word_ids = word_ids[typed]
+        if weights_disabled or segment_index >= len(bounds):
+            span_ids.append(np.full(len(typed), -1, dtype=np.int32))
+            continue
+        seg_start, seg_end = bounds[segment_index]
+        segment_spans = list(
+            range(
+                bisect_left(span_starts, seg_start), bisect_left(span_starts, seg_end)
+            )
+        )
+        word_counts = [
+            _word_counts(text[spans[i].start : spans[i].end], identifier)
+            for i in segment_spans
+        ]
+        max_word_id = int(typed_word_ids.max()) if len(typed_word_ids) else 0
+        lookup = _word_to_span(segment_spans, word_counts, max_word_id)
+        segment_span_ids = np.full(len(typed), -1, dtype=np.int32)
+        in_range = typed_word_ids < len(lookup)
+        segment_span_ids[in_range] = lookup[typed_word_ids[in_range]]
+        span_ids.append(segment_span_ids)
+
+    return SpanAssignment(
+        np.concatenate([np.zeros(0, dtype=np.int64), *positions]),
+        np.concatenate([np.zeros(0, dtype=np.int32), *span_ids]),
+        weights_disabled,
+    )
+
+
+def attribute_stream(
+    text: str,
+    stream: TokenStream,
+    layout: WeightLayout,
+    sub_tokenizer: Any = None,
+) -> dict[str, Any]:
+    """
+    Attribute one stream's typed tokens to the weighted spans of text
+    (see assign_spans). Weight buckets come straight from the tokens'
+    weights and do not depend on the attribution.
+
+    Returns:
+        {"buckets": {weight: tokens}, "span_tokens": [...], "group_tokens":
+        [...], "unattributed": int, "weights_disabled": bool}
+    """
+    _, spans, groups = layout
+    positions, span_ids, weights_disabled = assign_spans(
+        text, stream, layout, sub_tokenizer
+    )
+    span_starts = [span.start for span in spans]
+    attributed = span_ids[span_ids >= 0]
+    span_tokens = np.bincount(attributed, minlength=len(spans))
+
+    all_weights = np.round(_token_weights(stream, positions), WEIGHT_DECIMALS)
+    values, counts = np.unique(all_weights, return_counts=True)
+    cumulative = np.concatenate([[0], np.cumsum(span_tokens)]).tolist()
+    group_tokens = [
+        cumulative[bisect_right(span_starts, group.end - 1)]
+        - cumulative[bisect_left(span_starts, group.start)]
+        for group in groups
+    ]
+    return {
+        "buckets": dict(zip(values.tolist(), counts.tolist(), strict=True)),
+        "span_tokens": span_tokens.tolist(),
+        "group_tokens": group_tokens,
+        "unattributed": len(span_ids) - len(attributed),
+        "weights_disabled": weights_disabled,
+    }